@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import ratelimit
+import response_cache
+
+# Define the URL and headers for the GraphQL API
+URL = 'https://ra.co/graphql'
+HEADERS = {
+    'Content-Type': 'application/json',
+    'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/113.0.0.0 Safari/537.36'
+}
+
+CITIES_PATH = "cities.txt"
+CACHE_PATH = "area_codes.json"  # City name -> RA area id, null when RA has no area for it
+BATCH_SIZE = 25  # City names looked up per request, one aliased areas field each
+CONCURRENCY = 4  # Requests in flight at the same time
+UNKNOWN = "None"  # Written in place of the code of cities RA has no area for
+
+
+def parse_city_line(line):
+    """
+    The city name of a cities.txt line, with any " - code" already appended removed.
+
+    :param line: A line such as "London", "London - 13" or "Nowhere - None".
+    :return: The city name, or '' for a blank line.
+    """
+    line = line.strip()
+    name, separator, code = line.rpartition(" - ")
+    if separator and (code.isdigit() or code == UNKNOWN):
+        return name
+    return line
+
+
+def read_cities(path=CITIES_PATH):
+    """
+    :param path: A file with one city per line, resolved or not.
+    :return: The city names, in file order.
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        return [name for name in (parse_city_line(line) for line in file) if name]
+
+
+def write_cities(path, names, codes):
+    """
+    Write one "City - code" line per city, from the names alone, so writing
+    the same list again gives the same file.
+
+    :param path: The output file.
+    :param names: The city names, in order.
+    :param codes: A dict of city name -> area id (None when unknown).
+    """
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "w", encoding="utf-8") as file:
+        for name in names:
+            code = codes.get(name)
+            file.write(f"{name} - {code if code is not None else UNKNOWN}\n")
+    os.replace(temporary_path, path)
+
+
+def alias(index):
+    """
+    The field alias used for the city at the given index in a batch.
+    """
+    return f"a{index}"
+
+
+def build_areas_payload(names):
+    """
+    Pack several area searches into one GraphQL document, one aliased areas field per name.
+
+    :param names: The city names.
+    :return: The batched payload.
+    """
+    definitions = ", ".join(f"$city{index}: String!" for index in range(len(names)))
+    fields = " ".join(f"{alias(index)}: areas(searchTerm: $city{index}) {{ id }}" for index in range(len(names)))
+    return {
+        "operationName": "GET_AREA_CODES",
+        "query": f"query GET_AREA_CODES({definitions}) {{ {fields} }}",
+        "variables": {f"city{index}": name for index, name in enumerate(names)},
+    }
+
+
+class AreaResolver:
+    """
+    Resolves city names to RA area ids, remembering every answer in a JSON
+    file so that only new names are ever looked up again.
+    """
+
+    def __init__(self, cache_path=CACHE_PATH, batch_size=BATCH_SIZE, concurrency=CONCURRENCY):
+        self.cache_path = cache_path
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.lock = threading.Lock()
+        self.codes = {}
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, "r", encoding="utf-8") as file:
+                self.codes = json.load(file)
+
+    def lookup(self, names, refresh=False):
+        """
+        Look up one batch of names with a single request.
+
+        :param names: The city names.
+        :param refresh: Ask ra.co even when the response cache has an answer. (default: False)
+        :return: A dict of name -> area id (None when RA has no area for it).
+            Names whose field failed are left out, so they are retried next time.
+        """
+        try:
+            data = response_cache.post_json(URL, build_areas_payload(names), headers=HEADERS, refresh=refresh)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Error: {str(e)}")
+            return {}
+
+        results = data.get("data") or {}
+        codes = {}
+        for index, name in enumerate(names):
+            areas = results.get(alias(index))
+            if areas is None:
+                continue
+            codes[name] = areas[0]["id"] if areas else None
+            if not areas:
+                print(f"No area found for city: {name}")
+        return codes
+
+    def resolve(self, names, refresh=False):
+        """
+        Resolve city names, looking up only the ones not in the cache.
+
+        :param names: The city names. Duplicates are looked up once.
+        :param refresh: Look every name up again on ra.co, bypassing both caches. (default: False)
+        :return: A dict of name -> area id (None when unknown or when the lookup failed).
+        """
+        missing = [name for name in dict.fromkeys(names) if refresh or name not in self.codes]
+        batches = [missing[start:start + self.batch_size] for start in range(0, len(missing), self.batch_size)]
+        if batches:
+            print(f"Looking up {len(missing)} city name(s) in {len(batches)} request(s)")
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for codes in executor.map(self.lookup, batches, [refresh] * len(batches)):
+                with self.lock:
+                    self.codes.update(codes)
+
+        if batches:
+            self.save()
+        return {name: self.codes.get(name) for name in names}
+
+    def save(self):
+        if not self.cache_path:
+            return
+        temporary_path = self.cache_path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(self.codes, file, ensure_ascii=False, indent=0, sort_keys=True)
+        os.replace(temporary_path, self.cache_path)
+
+
+def get_area_code(city_name):
+    """
+    Resolve a single city name through the shared cache.
+
+    :param city_name: The city name.
+    :return: The area id, or None if there is none.
+    """
+    return AreaResolver().resolve([city_name])[city_name]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resolve the cities of cities.txt to RA area codes.")
+    parser.add_argument("cities", nargs="?", default=CITIES_PATH, help=f"One city per line, resolved or not (default: {CITIES_PATH}).")
+    parser.add_argument("-o", "--output", type=str, help="Write the 'City - code' lines here (default: the input file).")
+    parser.add_argument("--cache", type=str, default=CACHE_PATH, help=f"JSON file remembering resolved names (default: {CACHE_PATH}).")
+    parser.add_argument("-b", "--batch-size", type=int, default=BATCH_SIZE, help=f"City names looked up per request (default: {BATCH_SIZE}).")
+    parser.add_argument("-c", "--concurrency", type=int, default=CONCURRENCY, help=f"Requests in flight at the same time (default: {CONCURRENCY}).")
+    parser.add_argument("-r", "--rate", type=float, default=ratelimit.RATE, help=f"Maximum requests per second sent to ra.co (default: {ratelimit.RATE}).")
+    parser.add_argument("--refresh", action="store_true", help="Look every city up again instead of reusing the cache.")
+    args = parser.parse_args()
+
+    ratelimit.configure(rate=args.rate)
+    resolver = AreaResolver(args.cache, args.batch_size, args.concurrency)
+    names = read_cities(args.cities)
+    codes = resolver.resolve(names, args.refresh)
+    write_cities(args.output or args.cities, names, codes)
+
+    unknown = sum(code is None for code in codes.values())
+    print(f"Resolved {len(codes) - unknown} of {len(codes)} cities to {len(set(codes.values()) - {None})} area code(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+import argparse
+import hashlib
+import re
+import sqlite3
+import threading
+import unicodedata
+import zlib
+
+INDEX_PATH = "artist_index.sqlite3"
+NUM_PERM = 24  # MinHash permutations per name
+BANDS = 8  # LSH bands of NUM_PERM // BANDS rows; names sharing a band are candidates
+THRESHOLD = 0.7  # Trigram Jaccard similarity above which an unidentified name is the same artist
+PRIME = (1 << 61) - 1
+MEMO_SIZE = 100000  # Resolved (RA id, name) pairs remembered in memory before the memo is cleared
+
+NON_WORD = re.compile(r'[\W_]+')
+
+# Fixed, so the band buckets stored by one run match the ones computed by the next
+_PERMUTATIONS = [
+    (int.from_bytes(hashlib.sha256(f"a{i}".encode()).digest()[:8], "big") % PRIME | 1,
+     int.from_bytes(hashlib.sha256(f"b{i}".encode()).digest()[:8], "big") % PRIME)
+    for i in range(NUM_PERM)
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artists (
+    key TEXT PRIMARY KEY,
+    ra_id TEXT UNIQUE,
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artists_name ON artists (name);
+CREATE TABLE IF NOT EXISTS aliases (
+    alias TEXT PRIMARY KEY,
+    key TEXT NOT NULL REFERENCES artists (key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS bands (
+    band INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    alias TEXT NOT NULL,
+    PRIMARY KEY (band, bucket, alias)
+) WITHOUT ROWID;
+"""
+
+
+def match_key(name):
+    """
+    The form names are compared in: accents and punctuation dropped, case folded.
+
+    :param name: An artist name.
+    :return: The key, '' if nothing is left.
+    """
+    decomposed = unicodedata.normalize("NFKD", name or "")
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(NON_WORD.sub(" ", stripped.casefold()).split())
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+def minhash(shingles):
+    """
+    The MinHash signature of a set of trigrams, NUM_PERM values.
+    """
+    hashes = [zlib.crc32(shingle.encode("utf-8")) for shingle in shingles]
+    return [min((a * h + b) % PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def band_buckets(shingles):
+    """
+    The (band, bucket) pairs of a set of trigrams for the LSH index.
+    """
+    signature = minhash(shingles)
+    rows = NUM_PERM // BANDS
+    buckets = []
+    for band in range(BANDS):
+        values = ",".join(map(str, signature[band * rows:(band + 1) * rows])).encode()
+        buckets.append((band, int.from_bytes(hashlib.blake2b(values, digest_size=8).digest(), "big", signed=True)))
+    return buckets
+
+
+def alias_names(aliases):
+    """
+    The names of an artist's aliases field, a list or a comma separated string.
+    """
+    if not aliases:
+        return []
+    if isinstance(aliases, str):
+        aliases = aliases.split(",")
+    return [alias.strip() for alias in aliases if isinstance(alias, str) and alias.strip()]
+
+
+class ArtistIndex:
+    """
+    Resolves artist names to stable artist keys, persisted in SQLite so each
+    run extends the index of the previous ones:
+
+    - an artist with an RA id is "ra:<id>", whatever its name is spelt like;
+    - every name and RA alias seen for an artist is in an alias map, so a
+      known spelling resolves with one lookup;
+    - a name without an id that is not in the alias map is matched by
+      trigram similarity, with MinHash LSH buckets narrowing the candidates
+      to a few indexed rows, and otherwise becomes "name:<match key>".
+    """
+
+    def __init__(self, path=INDEX_PATH, threshold=THRESHOLD):
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.memo = {}
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def key_of_alias(self, alias):
+        row = self.conn.execute("SELECT key FROM aliases WHERE alias = ?", (alias,)).fetchone()
+        return row[0] if row else None
+
+    def fuzzy(self, alias):
+        """
+        The closest known alias of a match key, through the LSH buckets.
+
+        :return: A (key, alias, similarity) tuple, or None below the threshold.
+        """
+        shingles = trigrams(alias)
+        candidates = set()
+        for band, bucket in band_buckets(shingles):
+            candidates.update(row[0] for row in self.conn.execute(
+                "SELECT alias FROM bands WHERE band = ? AND bucket = ?", (band, bucket)))
+
+        best = None
+        for candidate in candidates:
+            similarity = jaccard(shingles, trigrams(candidate))
+            if similarity >= self.threshold and (best is None or similarity > best[2]):
+                best = (self.key_of_alias(candidate), candidate, similarity)
+        return best
+
+    def add_alias(self, alias, key):
+        """
+        Map a match key to an artist, unless it already belongs to one.
+        """
+        if not alias:
+            return
+        inserted = self.conn.execute("INSERT OR IGNORE INTO aliases (alias, key) VALUES (?, ?)", (alias, key)).rowcount
+        if inserted:
+            self.conn.executemany("INSERT OR IGNORE INTO bands (band, bucket, alias) VALUES (?, ?, ?)",
+                                  [(band, bucket, alias) for band, bucket in band_buckets(trigrams(alias))])
+
+    def resolve(self, ra_id, name, aliases=()):
+        """
+        Find or create the artist of a name, adding what is learnt to the index.
+
+        :param ra_id: The RA artist id, or '' / None.
+        :param name: The cleaned artist name.
+        :param aliases: The RA aliases of the artist.
+        :return: The artist key, or None for an empty name without an id.
+        """
+        memo_key = (ra_id or None, name)
+        key = self.memo.get(memo_key)
+        if key is not None:
+            return key
+
+        alias = match_key(name)
+        with self.lock:
+            if ra_id:
+                row = self.conn.execute("SELECT key FROM artists WHERE ra_id = ?", (ra_id,)).fetchone()
+                if row:
+                    key = row[0]
+                    if name:
+                        self.conn.execute("UPDATE artists SET name = ? WHERE key = ? AND name != ?", (name, key, name))
+                else:
+                    # An artist first seen without its id takes the id once it shows up
+                    key = self.key_of_alias(alias)
+                    if key is not None and self.conn.execute(
+                            "SELECT ra_id FROM artists WHERE key = ?", (key,)).fetchone()[0] is None:
+                        self.conn.execute("UPDATE artists SET ra_id = ?, name = ? WHERE key = ?", (ra_id, name, key))
+                    else:
+                        key = f"ra:{ra_id}"
+                        self.conn.execute("INSERT INTO artists (key, ra_id, name) VALUES (?, ?, ?)", (key, ra_id, name))
+            elif alias:
+                key = self.key_of_alias(alias)
+                if key is None:
+                    match = self.fuzzy(alias)
+                    if match is not None:
+                        key = match[0]
+                    else:
+                        key = f"name:{alias}"
+                        self.conn.execute("INSERT OR IGNORE INTO artists (key, ra_id, name) VALUES (?, NULL, ?)", (key, name))
+            else:
+                return None
+
+            self.add_alias(alias, key)
+            for other in alias_names(aliases):
+                self.add_alias(match_key(other), key)
+
+        if len(self.memo) >= MEMO_SIZE:
+            self.memo.clear()
+        self.memo[memo_key] = key
+        return key
+
+    def match(self, name):
+        """
+        Look a name up without adding it: exact alias first, then fuzzy.
+
+        :param name: An artist name.
+        :return: A (key, RA id, canonical name, similarity) tuple, or None.
+        """
+        alias = match_key(name)
+        with self.lock:
+            key, similarity = self.key_of_alias(alias), 1.0
+            if key is None:
+                found = self.fuzzy(alias) if alias else None
+                if found is None:
+                    return None
+                key, _, similarity = found
+            ra_id, canonical = self.conn.execute("SELECT ra_id, name FROM artists WHERE key = ?", (key,)).fetchone()
+        return key, ra_id, canonical, similarity
+
+    def entity(self, key):
+        """
+        :return: The (RA id, canonical name) of an artist key.
+        """
+        with self.lock:
+            return self.conn.execute("SELECT ra_id, name FROM artists WHERE key = ?", (key,)).fetchone()
+
+    def display_name(self, key):
+        """
+        The name an artist is stored under in postgres, unique per artist: the
+        canonical name, unless an artist added to the index before has the
+        same one, then followed by the RA id, e.g. "Rødhåd (RA 4321)".
+
+        :return: The (RA id, display name) of an artist key.
+        """
+        with self.lock:
+            rowid, ra_id, name = self.conn.execute("SELECT rowid, ra_id, name FROM artists WHERE key = ?", (key,)).fetchone()
+            taken = self.conn.execute("SELECT 1 FROM artists WHERE name = ? AND rowid < ? LIMIT 1", (name, rowid)).fetchone()
+        if taken:
+            name = f"{name} (RA {ra_id})" if ra_id else f"{name} ({key})"
+        return ra_id, name
+
+    def counts(self):
+        with self.lock:
+            return {table: self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                    for table in ("artists", "aliases")}
+
+    def save(self):
+        with self.lock:
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+_index = None
+_enabled = True
+_lock = threading.Lock()
+
+
+def configure(path=INDEX_PATH, enabled=True):
+    """
+    Open the shared index at another path, or turn it off.
+
+    :param path: The SQLite file of the index.
+    :param enabled: Resolve artists through the index. (default: True)
+    """
+    global _index, _enabled
+    with _lock:
+        if _index is not None:
+            _index.close()
+        _index = ArtistIndex(path) if enabled else None
+        _enabled = enabled
+
+
+def get_index():
+    """
+    Return the shared index, opening it on first use, or None when disabled.
+    """
+    global _index
+    with _lock:
+        if _index is None and _enabled:
+            _index = ArtistIndex()
+        return _index
+
+
+def load_archive(index, path):
+    """
+    Add the artists of a JSON Lines archive (see pipeline.JsonLinesSink) to an index.
+
+    :return: The number of artist appearances resolved.
+    """
+    from jsonl_archive import ArchiveReader
+    from models import parse_events
+    from name_normalizer import split_artists
+
+    count = 0
+    for listing in ArchiveReader(path):
+        for event in parse_events([listing]):
+            for artist in event.artists:
+                names = split_artists(artist.name)
+                if index.resolve(artist.id, names[0] if names else '', artist.aliases):
+                    count += 1
+    index.save()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Look artists up in the artist resolution index.")
+    parser.add_argument("names", nargs="*", help="Artist names to look up.")
+    parser.add_argument("-i", "--index", type=str, default=INDEX_PATH, help=f"The index file (default: {INDEX_PATH}).")
+    parser.add_argument("--load", type=str, help="First add the artists of a JSON Lines archive written by event_fetcher.py --jsonl.")
+    parser.add_argument("-t", "--threshold", type=float, default=THRESHOLD, help=f"Similarity needed for a fuzzy match (default: {THRESHOLD}).")
+    args = parser.parse_args()
+
+    index = ArtistIndex(args.index, args.threshold)
+    if args.load:
+        print(f"Resolved {load_archive(index, args.load)} artist appearances from {args.load}")
+    for name in args.names:
+        match = index.match(name)
+        if match is None:
+            print(f"{name}: no match")
+        else:
+            key, ra_id, canonical, similarity = match
+            print(f"{name}: {canonical} ({key}, RA id {ra_id or 'unknown'}, similarity {similarity:.2f})")
+    counts = index.counts()
+    print(f"{counts['artists']} artists, {counts['aliases']} aliases")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+import json
+import threading
+
+import decoder
+import metrics
+import query_compiler
+import response_cache
+from event_fetcher import EventFetcher
+
+BATCH_SIZE = 10  # Number of area/page combinations packed into one request
+WAIT = 0.05  # Seconds a page request waits for others to share its request
+
+
+def split_template_query(query):
+    """
+    Split the GET_EVENT_LISTINGS template query into the selection set of
+    eventListings and the fragment definitions that follow the operation.
+
+    :param query: The query string from graphql_query_template.json.
+    :return: A (selection, fragments) tuple, selection including its braces.
+    """
+    start = query.index("eventListings(")
+    start = query.index("{", query.index(")", start))
+
+    depth = 0
+    for end in range(start, len(query)):
+        if query[end] == "{":
+            depth += 1
+        elif query[end] == "}":
+            depth -= 1
+            if depth == 0:
+                break
+
+    selection = query[start:end + 1]
+    operation_end = query.index("}", end + 1)
+    fragments = query[operation_end + 1:]
+    return selection, fragments
+
+
+def alias(index):
+    """
+    The field alias used for the request at the given index in a batch.
+    """
+    return f"q{index}"
+
+
+def build_batch_payload(combinations, template=None):
+    """
+    Pack several area/page combinations into one GraphQL document, one
+    aliased eventListings field per combination.
+
+    :param combinations: A list of (areas, page, listing_date_gte, listing_date_lte) tuples.
+    :param template: The payload to take the query and shared variables from. (default: the query template)
+    :return: The batched payload.
+    """
+    if template is None:
+        template = EventFetcher.generate_payload(None, None, None)
+
+    selection, fragments = split_template_query(template["query"])
+    template_variables = template["variables"]
+
+    definitions = ["$filterOptions: FilterOptionsInputDtoInput", "$pageSize: Int"]
+    fields = []
+    variables = {
+        "filterOptions": template_variables["filterOptions"],
+        "pageSize": template_variables["pageSize"],
+    }
+
+    for index, (areas, page, listing_date_gte, listing_date_lte) in enumerate(combinations):
+        definitions.append(f"$filters{index}: FilterInputDtoInput")
+        definitions.append(f"$page{index}: Int")
+        fields.append(
+            f"{alias(index)}: eventListings(filters: $filters{index}, filterOptions: $filterOptions, "
+            f"pageSize: $pageSize, page: $page{index}) {selection}"
+        )
+        variables[f"filters{index}"] = {
+            "areas": {"eq": areas},
+            "listingDate": {"gte": listing_date_gte, "lte": listing_date_lte},
+        }
+        variables[f"page{index}"] = page
+
+    query = f"query GET_EVENT_LISTINGS_BATCH({', '.join(definitions)}) {{{' '.join(fields)}}}{fragments}"
+    return {
+        "operationName": "GET_EVENT_LISTINGS_BATCH",
+        "variables": variables,
+        "query": query,
+    }
+
+
+def combination(payload):
+    """
+    The (areas, page, listing_date_gte, listing_date_lte) tuple of a single page payload, see build_batch_payload.
+    """
+    variables = payload["variables"]
+    filters = variables["filters"]
+    return filters["areas"]["eq"], variables["page"], filters["listingDate"]["gte"], filters["listingDate"]["lte"]
+
+
+def batch_key(payload):
+    """
+    What the payloads of one batch must share: the query and the variables that are not per page.
+    """
+    variables = payload["variables"]
+    return payload["query"], variables["pageSize"], json.dumps(variables["filterOptions"], sort_keys=True)
+
+
+class _Request:
+    def __init__(self, payload):
+        self.payload = payload
+        self.key = batch_key(payload)
+        self.done = threading.Event()
+        self.body = None
+        self.error = None
+
+
+class PageBatcher:
+    """
+    Packs the page requests of every area scraped at the same time into
+    shared requests, one aliased eventListings field per page. A page request
+    waits up to ``wait`` seconds for others, then takes up to ``batch_size``
+    of the waiting ones and sends them together. Each page gets back the body
+    it would have got alone, so pagination, the response cache and the
+    decoders work as without batching.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, wait=WAIT):
+        self.batch_size = batch_size
+        self.wait = wait
+        self.lock = threading.Lock()
+        self.pending = []
+
+    def post_json(self, url, payload, headers=None, decode=None):
+        """
+        Like query_compiler.post_json, sending the page in a batch on a cache miss.
+
+        :param url: The GraphQL endpoint.
+        :param payload: A single page payload, see query_compiler.listing_payload.
+        :param headers: The request headers.
+        :param decode: Decodes the response body, see response_cache.post_json.
+        :return: The decoded response.
+        """
+        return response_cache.post_json(url, payload, headers=headers, decode=decode,
+                                        send=lambda payload: self.send(url, payload, headers))
+
+    def send(self, url, payload, headers=None):
+        """
+        Send a page payload in the next batch.
+
+        :return: The body of the response to the page alone.
+        :raises requests.exceptions.RequestException: If the batch request fails.
+        """
+        request = _Request(payload)
+        with self.lock:
+            self.pending.append(request)
+            full = sum(other.key == request.key for other in self.pending) >= self.batch_size
+        if not full:
+            request.done.wait(self.wait)
+
+        with self.lock:
+            batch = self.take(request)
+        if batch:
+            self.fetch(url, headers, batch)
+
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.body
+
+    def take(self, request):
+        """
+        Remove a batch led by request from the waiting requests, or return
+        an empty list when another request already took it. Call with the lock held.
+        """
+        if request not in self.pending:
+            return []
+        batch = [request] + [other for other in self.pending if other is not request and other.key == request.key]
+        batch = batch[:self.batch_size]
+        for other in batch:
+            self.pending.remove(other)
+        return batch
+
+    def fetch(self, url, headers, batch):
+        """
+        Send one batch and hand each request the body of its own page. Pages
+        whose field is null, e.g. after a GraphQL error in one of them, are
+        sent again alone, so one bad page never fails the others.
+        """
+        try:
+            payload = build_batch_payload([combination(request.payload) for request in batch], batch[0].payload)
+            data = query_compiler.post_json(url, payload, headers=headers, decode=decoder.decode_batch, cached=False)
+        except Exception as error:
+            for request in batch:
+                request.error = error
+                request.done.set()
+            return
+        metrics.increment("batched_pages", len(batch))
+
+        fields = data.get("data") or {}
+        alone = []
+        for index, request in enumerate(batch):
+            field = fields.get(alias(index))
+            if field is not None:
+                request.body = b'{"data":{"eventListings":' + field + b'}}'
+            elif len(batch) > 1:
+                alone.append(request)
+                continue
+            else:
+                request.body = decoder.dumps({"data": None, "errors": data.get("errors") or [{"message": "No eventListings"}]})
+            request.done.set()
+
+        for request in alone:
+            self.fetch(url, headers, [request])
+
+
+_batcher = None
+_lock = threading.Lock()
+
+
+def configure(batch_size=BATCH_SIZE, wait=WAIT):
+    """
+    Batch the page requests sent afterwards, or stop batching them.
+
+    :param batch_size: The number of pages sent per request, 1 to send one request per page.
+    :param wait: The seconds a page request waits for others.
+    """
+    global _batcher
+    with _lock:
+        _batcher = PageBatcher(batch_size, wait) if batch_size > 1 else None
+
+
+def post_json(url, payload, headers=None, decode=None):
+    """
+    POST a single page payload, in a batch when configured, else alone through query_compiler.post_json.
+    """
+    batcher = _batcher
+    if batcher is None:
+        return query_compiler.post_json(url, payload, headers=headers, decode=decode)
+    return batcher.post_json(url, payload, headers=headers, decode=decode)
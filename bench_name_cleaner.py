@@ -0,0 +1,124 @@
+import argparse
+import json
+import random
+import re
+import timeit
+
+from name_normalizer import _normalize, normalize_name
+
+TOKENS = [
+    'Ben Klock', 'Marcel Dettmann', 'DJ Stingray 313', 'Nina Kraviz', 'Âme', 'Dixon', 'Kerri Chandler',
+    'Objekt', 'Call Super', 'Helena Hauff', 'Shed', 'Leon Vynehall', 'Peggy Gou', "Jeremy Underground",
+    'Resident Advisor', 'Residents', 'resident', 'TBA', 'tba', 'Friends', 'friends', 'Opening', 'CLOSING',
+    'live', 'LIVE', 'Live', '(live)', '(DJ Set)', '[Ostgut Ton]', 'b2b', 'B2B', 'w/', '+', '&', '//',
+    'Room 1:', 'ROOM', 'room', 'Main Floor:', '22-04', '23 -01', '00- 06', '__hidden__', '@host', '24',
+    'noch nicht fetsgelegt', "''", ',', ',,', '\n', '\xa0', ' ', '  ',
+]
+SEPARATORS = [' ', ', ', '\n', ' & ', ' b2b ', ' + ', ' w/ ', ' // ', '']
+
+
+def legacy_name_cleaner(name):
+    """The original utils.name_cleaner, kept verbatim as the reference (pd.notnull aside)"""
+    if name is not None and name == name:
+        name = re.sub('\\n', ',', name)
+        name = re.sub(r'\broom|ROOM\b', 'room:,', name)
+        name = re.sub('(\\xa0)', '', name)
+        name = re.sub(r'\bTBA|tba\b', '', name)
+        name = re.sub('(noch nicht fetsgelegt)', '', name)
+        name = re.sub(r'\b(Friends|friends)\b', '', name)
+        name = re.sub(r'\b(opening|Opening|OPENING)\b', '', name)
+        name = re.sub(r'\b(closing|Closing|CLOSING)\b', '', name)
+        name = re.sub(r'\bResidents|residents\b', '', name)
+        name = re.sub(r'\bResident|resident\b', '', name)
+        name = re.sub(r'\b(\d\d\s\-\d\d)\b', '', name)
+        name = re.sub(r'\b(\d\d\-\d\d)\b', '', name)
+        name = re.sub(r'\b(\d\d\-\s\d\d)\b', '', name)
+        name = re.sub(r'(\_{2}[a-zA-Z]*\_{2})', '', name)
+        name = re.sub(r'\blive|LIVE|Live\b', ',', name)
+        name = re.sub(r"\(.*?\)", ',', name)
+        name = re.sub(r'\&', ',', name)
+        name = re.sub(r'\[.*?\]', '', name)
+        name = re.sub(r'[\s\w]+\:', '', name)
+        name = re.sub(r'\/{2}', ',', name)
+        name = re.sub(r'\,{2}', ',', name)
+        name = re.sub(r'\,{2}', ',', name)
+        name = re.sub(r'\'{2},', '', name)
+        name = re.sub(r'^,', '', name)
+        name = re.sub(r'^\s', '', name)
+        name = re.sub(r'\s$', '', name)
+        name = re.sub(r'\b\d{2}\b', '', name)
+        name = re.sub(r'\bb2b|B2B\b', ',', name)
+        name = re.sub(r'w\/', ',', name)
+        name = re.sub(r'\+', ',', name)
+        name = re.sub(r'\&', ',', name)  # & symbol, replace with ','
+        name = re.sub(r'[,\s]*$', '', name)  # white space & comma from end of string
+        name = re.sub(r'^@', '', name)  # @ from the beginning of str
+        return name
+    return ''
+
+
+def generate_corpus(size, seed=0):
+    """
+    Random lineup strings built from artist names, separators and the words
+    the cleaning rules look for.
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        parts = []
+        for _ in range(rng.randint(1, 8)):
+            parts.append(rng.choice(TOKENS))
+            parts.append(rng.choice(SEPARATORS))
+        corpus.append(''.join(parts))
+    return corpus
+
+
+def load_corpus(path):
+    """
+    Artist names from a JSON file written by save_events_to_json, or one
+    name per line from any other file.
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        if path.endswith('.json'):
+            events = json.load(file)
+            return [artist.get('name', '') for event in events
+                    for artist in event.get('event', {}).get('artists', [])]
+        return [line.rstrip('\n') for line in file]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check name_normalizer against the original name_cleaner rules and time both.")
+    parser.add_argument("corpus", nargs="?", help="A JSON file of events or a text file with one name per line (default: a generated corpus).")
+    parser.add_argument("-n", "--size", type=int, default=20000, help="Size of the generated corpus (default: 20000).")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Timing repetitions, the best one is reported (default: 3).")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else generate_corpus(args.size)
+
+    mismatches = [(name, legacy_name_cleaner(name), _normalize(name))
+                  for name in corpus if legacy_name_cleaner(name) != _normalize(name)]
+    print(f"{len(corpus)} names, {len(set(corpus))} distinct, {len(mismatches)} mismatch(es)")
+    for name, expected, got in mismatches[:10]:
+        print(f"  {name!r}: expected {expected!r}, got {got!r}")
+
+    def run_legacy():
+        for name in corpus:
+            legacy_name_cleaner(name)
+
+    def run_uncached():
+        for name in corpus:
+            _normalize(name)
+
+    def run_cached():
+        normalize_name.cache_clear()
+        for name in corpus:
+            normalize_name(name)
+
+    legacy = min(timeit.repeat(run_legacy, number=1, repeat=args.repeat))
+    for label, function in (('legacy', run_legacy), ('compiled', run_uncached), ('compiled + memo', run_cached)):
+        best = min(timeit.repeat(function, number=1, repeat=args.repeat))
+        print(f"{label:>16}: {best * 1000:8.1f} ms  {len(corpus) / best:10.0f} names/s  {legacy / best:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import artist_index
+import decoder
+import fingerprints
+import http_client
+import ratelimit
+import response_cache
+from event_fetcher import BATCH_SIZE, MAX_SHARD_RESULTS, QUEUE_SIZE, EventFetcher
+from replay import ERROR_STATUS, LATENCY, RECORDINGS_PATH, ReplayAdapter
+
+CONCURRENCY_LEVELS = [1, 2, 4, 8]
+UNLIMITED_RATE = 1e6  # Requests per second, so the rate limiter does not hide the transport
+
+
+class TimedSink:
+    """
+    Wraps a sink and measures the time spent in it.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.needs_raw = sink.needs_raw
+        self.seconds = 0.0
+        self.events = 0
+
+    def write(self, events):
+        start = time.perf_counter()
+        self.sink.write(events)
+        self.seconds += time.perf_counter() - start
+        self.events += len(events)
+
+    def close(self):
+        start = time.perf_counter()
+        self.sink.close()
+        self.seconds += time.perf_counter() - start
+
+    @property
+    def failed(self):
+        return getattr(self.sink, "failed", 0)
+
+
+class FirstEventSink:
+    """
+    Notes when the first event reaches the sinks.
+    """
+    needs_raw = False
+
+    def __init__(self):
+        self.first_event = None
+
+    def write(self, events):
+        if self.first_event is None and events:
+            self.first_event = time.perf_counter()
+
+    def close(self):
+        pass
+
+
+def counted(pages, counter):
+    for page in pages:
+        counter[0] += 1
+        yield page
+
+
+def run_level(options, concurrency):
+    """
+    Scrape the recorded range once against the replay stub.
+
+    Run in a fresh process per level, so the peak RSS is the level's own.
+    Each level starts with empty fingerprint and artist indexes of its own,
+    so every level writes every event and the indexes of real runs are not touched.
+
+    :param options: The parsed command line.
+    :param concurrency: The number of pages fetched at the same time.
+    :return: A dict of measurements.
+    """
+    # Imported here because sharding and pipeline build on EventFetcher
+    import pipeline
+    from sharding import ShardPlanner
+
+    adapter = ReplayAdapter(options.recordings, options.latency, options.jitter, options.error_rate, options.seed)
+    ratelimit.configure(rate=UNLIMITED_RATE, burst=max(concurrency, ratelimit.BURST))
+    http_client.configure(concurrency, adapter)
+    response_cache.configure(enabled=False)
+    decoder.configure(options.json_backend)
+    state_dir = tempfile.TemporaryDirectory()
+    fingerprints.configure(os.path.join(state_dir.name, fingerprints.INDEX_PATH), enabled=options.postgres)
+    artist_index.configure(os.path.join(state_dir.name, artist_index.INDEX_PATH), enabled=options.postgres)
+
+    first = FirstEventSink()
+    sinks = [first]
+    postgres = None
+    if options.postgres:
+        event_fetcher = EventFetcher(options.area, f"{options.start_date}T00:00:00.000Z", f"{options.end_date}T23:59:59.999Z")
+        postgres = TimedSink(pipeline.PostgresSink(event_fetcher, options.batch_size))
+        sinks.append(postgres)
+
+    pages = [0]
+    start = time.perf_counter()
+    planner = ShardPlanner(options.area, options.start_date, options.end_date, options.max_shard_results, concurrency)
+    events = pipeline.run(pipeline.unique_events(counted(planner.iter_pages(options.queue_size), pages)), sinks)
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "pages": pages[0],
+        "events": events,
+        "first_event": first.first_event - start if first.first_event is not None else None,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "misses": adapter.misses,
+        "db_rows_per_second": None,
+    }
+    if postgres is not None and postgres.seconds:
+        result["db_rows_per_second"] = postgres.sink.rows / postgres.seconds
+
+    fingerprints.configure(enabled=False)
+    artist_index.configure(enabled=False)
+    state_dir.cleanup()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scraper offline against recorded ra.co responses.")
+    parser.add_argument("area", type=int, help="The recorded area code.")
+    parser.add_argument("start_date", type=str, help="The recorded start date (format: YYYY-MM-DD).")
+    parser.add_argument("end_date", type=str, help="The recorded end date (format: YYYY-MM-DD).")
+    parser.add_argument("-f", "--recordings", type=str, default=RECORDINGS_PATH, help=f"Responses written by event_fetcher.py --record (default: {RECORDINGS_PATH}).")
+    parser.add_argument("-c", "--concurrency", type=int, nargs="+", default=CONCURRENCY_LEVELS, help=f"Concurrency levels to measure (default: {' '.join(map(str, CONCURRENCY_LEVELS))}).")
+    parser.add_argument("-l", "--latency", type=float, default=LATENCY, help=f"Seconds the replay stub waits per request (default: {LATENCY}).")
+    parser.add_argument("-j", "--jitter", type=float, default=0.0, help="Up to this many more seconds of random latency per request (default: 0).")
+    parser.add_argument("-e", "--error-rate", type=float, default=0.0, help=f"Share of requests failing with {ERROR_STATUS} (default: 0).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the latency and error draws (default: 0).")
+    parser.add_argument("-s", "--max-shard-results", type=int, default=MAX_SHARD_RESULTS, help=f"As for event_fetcher.py; use the value of the recorded run (default: {MAX_SHARD_RESULTS}).")
+    parser.add_argument("-q", "--queue-size", type=int, default=QUEUE_SIZE, help=f"Pages buffered between the fetchers and the sinks (default: {QUEUE_SIZE}).")
+    parser.add_argument("--json-backend", choices=decoder.BACKENDS, help="Library decoding the responses, to compare them (default: the fastest installed).")
+    parser.add_argument("--postgres", action="store_true", help="Also store the events in postgres and measure rows/s.")
+    parser.add_argument("-b", "--batch-size", type=int, default=BATCH_SIZE, help=f"Rows sent to postgres per INSERT statement (default: {BATCH_SIZE}).")
+    args = parser.parse_args()
+
+    print(f"{'concurrency':>11} {'seconds':>8} {'pages/s':>8} {'events/s':>9} {'first event':>11} {'peak RSS':>9} {'db rows/s':>10}")
+    context = multiprocessing.get_context("spawn")
+    for concurrency in args.concurrency:
+        with context.Pool(1) as pool:
+            result = pool.apply(run_level, (args, concurrency))
+
+        seconds = result["seconds"]
+        first_event = f"{result['first_event'] * 1000:9.0f}ms" if result["first_event"] is not None else f"{'-':>11}"
+        db_rows = f"{result['db_rows_per_second']:10.0f}" if result["db_rows_per_second"] is not None else f"{'-':>10}"
+        print(f"{concurrency:>11} {seconds:8.2f} {result['pages'] / seconds:8.1f} {result['events'] / seconds:9.0f} "
+              f"{first_event} {result['peak_rss_mb']:7.1f}MB {db_rows}")
+        if result["misses"]:
+            print(f"{'':>11} {result['misses']} request(s) were not in the recordings")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import os
+import time
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+    ds = None
+
+FORMAT = "parquet"  # "parquet" or "arrow" (Arrow IPC files)
+ROW_GROUP_SIZE = 50000  # Events buffered before a part file is written
+EXTENSIONS = {"parquet": "parquet", "arrow": "arrow"}
+DATASET_FORMATS = {"parquet": "parquet", "arrow": "ipc"}
+
+# Column name -> arrow type name; string columns with few distinct values are dictionary encoded
+EVENT_COLUMNS = {
+    "event_id": "string", "listing_id": "string", "listing_date": "string", "title": "string",
+    "date": "string", "start_time": "string", "end_time": "string", "cost": "string",
+    "attending": "int64", "content_url": "string", "venue_id": "dictionary",
+    "venue_name": "dictionary", "venue_address": "dictionary", "area": "string", "month": "string",
+}
+EVENT_ARTIST_COLUMNS = {"event_id": "string", "artist_id": "string", "position": "int32", "area": "string", "month": "string"}
+EVENT_GENRE_COLUMNS = {"event_id": "string", "genre_slug": "dictionary", "area": "string", "month": "string"}
+ARTIST_COLUMNS = {
+    "artist_id": "string", "name": "string", "country_id": "dictionary", "first_name": "string",
+    "last_name": "string", "facebook": "string", "instagram": "string", "twitter": "string",
+    "soundcloud": "string", "discogs": "string", "bandcamp": "string", "website": "string",
+}
+GENRE_COLUMNS = {"genre_slug": "string", "name": "string"}
+PARTITION_COLUMNS = ["area", "month"]
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("The columnar export needs pyarrow: pip install pyarrow")
+
+
+def arrow_array(values, type_name):
+    """
+    Build an arrow array for one column.
+
+    :param values: The column values.
+    :param type_name: "string", "int32", "int64" or "dictionary" (a dictionary encoded string column).
+    :return: The arrow array.
+    """
+    if type_name == "dictionary":
+        return pa.array(values, type=pa.string()).dictionary_encode()
+    return pa.array(values, type=getattr(pa, type_name)())
+
+
+def empty_columns(columns):
+    return {name: [] for name in columns}
+
+
+class ColumnarSink:
+    """
+    Writes events as normalized columnar tables: events, event_artist and
+    event_genre (one row per event, per event/artist and per event/genre),
+    plus artists and genres (one row per distinct artist and genre).
+
+    Each table is a directory of Parquet or Arrow IPC part files. Event
+    tables are optionally partitioned by area and month (hive style,
+    area=13/month=2023-04/). Repeated strings are dictionary encoded.
+    """
+    needs_raw = False
+    fields = (
+        "id listingDate event { id title date startTime endTime cost attending contentUrl "
+        "venue { id name address } genres { name slug } "
+        "artists { id countryId name firstName lastName facebook instagram twitter soundcloud discogs bandcamp website } }"
+    )
+
+    def __init__(self, output_dir, area, file_format=FORMAT, partition=True, row_group_size=ROW_GROUP_SIZE):
+        require_pyarrow()
+        if file_format not in EXTENSIONS:
+            raise ValueError(f"Unknown columnar format: {file_format}")
+
+        self.output_dir = output_dir
+        self.area = str(area)
+        self.file_format = file_format
+        self.partition = partition
+        self.row_group_size = row_group_size
+        self.run_id = time.strftime("%Y%m%dT%H%M%S")
+        self.parts = 0
+
+        self.events = empty_columns(EVENT_COLUMNS)
+        self.event_artist = empty_columns(EVENT_ARTIST_COLUMNS)
+        self.event_genre = empty_columns(EVENT_GENRE_COLUMNS)
+        self.artists = {}
+        self.genres = {}
+
+    def write(self, events):
+        for event in events:
+            month = event.date[:7]
+            attending = event.attending if isinstance(event.attending, int) else None
+            row = {
+                "event_id": event.id, "listing_id": event.listing_id, "listing_date": event.listing_date,
+                "title": event.title, "date": event.date, "start_time": event.start_time,
+                "end_time": event.end_time, "cost": event.cost, "attending": attending,
+                "content_url": event.content_url, "venue_id": event.venue.id,
+                "venue_name": event.venue.name, "venue_address": event.venue.address,
+                "area": self.area, "month": month,
+            }
+            for name, value in row.items():
+                self.events[name].append(value)
+
+            for position, artist in enumerate(event.artists):
+                artist_id = artist.id or artist.name
+                self.artists.setdefault(artist_id, artist)
+                self.event_artist["event_id"].append(event.id)
+                self.event_artist["artist_id"].append(artist_id)
+                self.event_artist["position"].append(position)
+                self.event_artist["area"].append(self.area)
+                self.event_artist["month"].append(month)
+
+            for genre in event.genres:
+                genre_slug = genre.slug or genre.name
+                self.genres.setdefault(genre_slug, genre)
+                self.event_genre["event_id"].append(event.id)
+                self.event_genre["genre_slug"].append(genre_slug)
+                self.event_genre["area"].append(self.area)
+                self.event_genre["month"].append(month)
+
+        if len(self.events["event_id"]) >= self.row_group_size:
+            self.flush()
+
+    def write_table(self, name, columns, types, partition):
+        """
+        Write one part file (or one per partition) of a table.
+
+        :param name: The table name, i.e. its directory below output_dir.
+        :param columns: A dict of column name -> values.
+        :param types: A dict of column name -> type name, see arrow_array.
+        :param partition: Partition the part by area and month.
+        """
+        table = pa.table({column: arrow_array(columns[column], types[column]) for column in types})
+        partitioning = None
+        if partition:
+            partitioning = ds.partitioning(
+                pa.schema([(column, pa.string()) for column in PARTITION_COLUMNS]), flavor="hive")
+
+        ds.write_dataset(
+            table,
+            os.path.join(self.output_dir, name),
+            format=DATASET_FORMATS[self.file_format],
+            partitioning=partitioning,
+            basename_template=f"part-{self.area}-{self.run_id}-{self.parts}-{{i}}.{EXTENSIONS[self.file_format]}",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+
+    def flush(self):
+        """
+        Write the buffered events, event_artist and event_genre rows as new part files.
+        """
+        if not self.events["event_id"]:
+            return
+
+        self.write_table("events", self.events, EVENT_COLUMNS, self.partition)
+        self.write_table("event_artist", self.event_artist, EVENT_ARTIST_COLUMNS, self.partition)
+        self.write_table("event_genre", self.event_genre, EVENT_GENRE_COLUMNS, self.partition)
+        self.parts += 1
+
+        self.events = empty_columns(EVENT_COLUMNS)
+        self.event_artist = empty_columns(EVENT_ARTIST_COLUMNS)
+        self.event_genre = empty_columns(EVENT_GENRE_COLUMNS)
+
+    def close(self):
+        """
+        Write the remaining events and the artists and genres seen in this run.
+        """
+        self.flush()
+
+        if self.artists:
+            artists = empty_columns(ARTIST_COLUMNS)
+            for artist_id, artist in self.artists.items():
+                artists["artist_id"].append(artist_id)
+                for column in ARTIST_COLUMNS:
+                    if column != "artist_id":
+                        artists[column].append(getattr(artist, column))
+            self.write_table("artists", artists, ARTIST_COLUMNS, False)
+
+        if self.genres:
+            genres = {
+                "genre_slug": list(self.genres),
+                "name": [genre.name for genre in self.genres.values()],
+            }
+            self.write_table("genres", genres, GENRE_COLUMNS, False)
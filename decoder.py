@@ -0,0 +1,215 @@
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional, TypedDict
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKENDS = ("msgspec", "orjson", "json")  # In order of preference
+BACKEND_VARIABLE = "RA_JSON_DECODER"  # Environment variable forcing one of BACKENDS
+
+
+def available_backends():
+    """
+    The JSON backends that can be imported here, in order of preference.
+    """
+    installed = {"msgspec": msgspec is not None, "orjson": orjson is not None, "json": True}
+    return [name for name in BACKENDS if installed[name]]
+
+
+_backend = None
+_keep_raw = False
+_lock = threading.Lock()
+
+
+def configure(backend=None, keep_raw=False):
+    """
+    Choose how responses are decoded.
+
+    :param backend: One of BACKENDS. (default: $RA_JSON_DECODER, else the first available)
+    :param keep_raw: Keep the encoded bytes of every event listing for archiving. (default: False)
+    :raises ValueError: If the backend is unknown or not installed.
+    """
+    global _backend, _keep_raw
+    backend = backend or os.environ.get(BACKEND_VARIABLE) or available_backends()[0]
+    if backend not in available_backends():
+        raise ValueError(f"JSON backend {backend!r} is not available, choose one of: {', '.join(available_backends())}")
+    with _lock:
+        _backend = backend
+        _keep_raw = keep_raw
+
+
+def backend():
+    """
+    The configured backend, see configure.
+    """
+    if _backend is None:
+        configure()
+    return _backend
+
+
+def loads(data):
+    """
+    Decode a JSON document with the configured backend.
+
+    :param data: The document, as bytes or str.
+    :return: The decoded object.
+    """
+    name = backend()
+    if name == "msgspec":
+        return msgspec.json.decode(data)
+    if name == "orjson":
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj):
+    """
+    Encode an object as compact UTF-8 JSON with the configured backend.
+
+    :param obj: A JSON serializable object.
+    :return: The encoded bytes.
+    """
+    name = backend()
+    if name == "msgspec":
+        return msgspec.json.encode(obj)
+    if name == "orjson":
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class RawListing(dict):
+    """
+    An event listing dict that also holds the bytes it was decoded from, so
+    archives can store the listing exactly as received without encoding it again.
+    """
+    __slots__ = ('raw',)
+
+    def __init__(self, data, raw):
+        super().__init__(data)
+        self.raw = raw
+
+
+# The part of a GET_EVENT_LISTINGS response the models read. Any other field,
+# e.g. images, pick or flyerFront, is skipped by the msgspec decoder without
+# building objects for it. Scalars are typed Any so a changed type never fails a page.
+class GenreFields(TypedDict, total=False):
+    name: Any
+    slug: Any
+
+
+class VenueFields(TypedDict, total=False):
+    id: Any
+    name: Any
+    address: Any
+    contentUrl: Any
+    live: Any
+
+
+class ArtistFields(TypedDict, total=False):
+    id: Any
+    countryId: Any
+    name: Any
+    firstName: Any
+    lastName: Any
+    aliases: Any
+    facebook: Any
+    instagram: Any
+    twitter: Any
+    soundcloud: Any
+    discogs: Any
+    bandcamp: Any
+    website: Any
+
+
+class EventFields(TypedDict, total=False):
+    id: Any
+    title: Any
+    date: Any
+    startTime: Any
+    endTime: Any
+    cost: Any
+    attending: Any
+    contentUrl: Any
+    isTicketed: Any
+    venue: Optional[VenueFields]
+    artists: Optional[List[ArtistFields]]
+    genres: Optional[List[GenreFields]]
+
+
+class ListingFields(TypedDict, total=False):
+    id: Any
+    listingDate: Any
+    event: Optional[EventFields]
+
+
+def _response_type(listing_type):
+    listings = TypedDict("EventListingsFields", {"data": Optional[List[listing_type]], "totalResults": Any}, total=False)
+    data = TypedDict("DataFields", {"eventListings": Optional[listings]}, total=False)
+    return TypedDict("ListingsResponse", {"data": Optional[data], "errors": Any}, total=False)
+
+
+if msgspec is not None:
+    _batch_decoder = msgspec.json.Decoder(TypedDict("BatchResponse", {"data": Optional[Dict[str, msgspec.Raw]], "errors": Any}, total=False))
+    _listings_decoder = msgspec.json.Decoder(_response_type(ListingFields))
+    _raw_listings_decoder = msgspec.json.Decoder(_response_type(msgspec.Raw))
+    _listing_decoder = msgspec.json.Decoder(ListingFields)
+
+
+def decode_listings(body):
+    """
+    Decode a GET_EVENT_LISTINGS response. With msgspec, only the fields the
+    models read are decoded, checked against the typed layout above. With
+    keep_raw configured, each listing is a RawListing carrying its own bytes.
+
+    :param body: The response body.
+    :return: The decoded response, with plain dicts and lists.
+    :raises ValueError: If the body is not JSON or does not have the expected layout.
+    """
+    if backend() != "msgspec":
+        return loads(body)
+
+    try:
+        if not _keep_raw:
+            return _listings_decoder.decode(body)
+
+        data = _raw_listings_decoder.decode(body)
+        listings = ((data.get("data") or {}).get("eventListings") or {})
+        if listings.get("data"):
+            listings["data"] = [RawListing(_listing_decoder.decode(raw), bytes(raw)) for raw in listings["data"]]
+        return data
+    except msgspec.DecodeError as error:
+        raise ValueError(f"Unexpected eventListings response: {error}") from error
+
+
+def decode_batch(body):
+    """
+    Decode a batched response, see batch_query.build_batch_payload, without
+    decoding the fields themselves.
+
+    :param body: The response body.
+    :return: The decoded response, "data" mapping each alias to the encoded
+        bytes of its field (None when the field is null).
+    :raises ValueError: If the body is not JSON or does not have the expected layout.
+    """
+    if backend() != "msgspec":
+        data = loads(body)
+        fields = data.get("data") or {}
+        data["data"] = {name: None if field is None else dumps(field) for name, field in fields.items()}
+        return data
+
+    try:
+        data = _batch_decoder.decode(body)
+    except msgspec.DecodeError as error:
+        raise ValueError(f"Unexpected batch response: {error}") from error
+    fields = data.get("data") or {}
+    data["data"] = {name: None if bytes(field) == b"null" else bytes(field) for name, field in fields.items()}
+    return data
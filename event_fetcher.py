@@ -1,12 +1,24 @@
 import requests
+import psycopg2
 import json
-import time
 import csv
+import math
+from concurrent.futures import ThreadPoolExecutor
 import sys
+from contextlib import nullcontext
 import argparse
-from datetime import datetime, timedelta
-from utils import commit_to_dataBase, name_cleaner
-from psycopg2 import sql
+import artist_index
+import decoder
+import fingerprints
+import http_client
+import metrics
+import query_compiler
+import ratelimit
+import response_cache
+from models import parse_events
+from name_normalizer import split_artists
+from utils import (BATCH_SIZE, add_artists_ra_id_column, check_event_data_key, close_pool, create_event_genres_table,
+                   create_genres_table, ensure_tables, fit, insert_rows)
 
 URL = 'https://ra.co/graphql'
 HEADERS = {
@@ -14,8 +26,23 @@ HEADERS = {
     'Referer': 'https://ra.co/events/de/berlin',
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:106.0) Gecko/20100101 Firefox/106.0'
 }
-QUERY_TEMPLATE_PATH = "graphql_query_template.json"
-DELAY = 1  # Adjust this value as needed
+CONCURRENCY = 4  # Maximum number of pages fetched at the same time in async mode
+MAX_SHARD_RESULTS = 500  # Date ranges with more events than this are split into shards
+QUEUE_SIZE = 8  # Pages buffered between the fetchers and the sinks before fetching pauses
+ARTIST_LINKS = ['facebook', 'instagram', 'soundcloud', 'discogs', 'bandcamp', 'website']
+CSV_HEADER = [
+    "Event id", "Event name", "Date", "Start Time", "End Time",
+    "Artists", "Genres",
+    "Venue", "Event URL", "Number of guests attending",
+    "Artist ID", "Artist Country ID", "Artist Name",
+    "Artist First Name", "Artist Last Name", "Artist Facebook",
+    "Artist Instagram", "Artist Twitter", "Artist Soundcloud",
+    "Artist Discogs", "Artist Bandcamp", "Artist Website",  # Add new fields here
+]
+
+
+class GraphQLError(requests.exceptions.RequestException):
+    """Raised when ra.co answers without eventListings, e.g. with GraphQL errors."""
 
 
 class EventFetcher:
@@ -23,44 +50,50 @@ class EventFetcher:
     A class to fetch and print event details from RA.co
     """
 
-    def __init__(self, areas, listing_date_gte, listing_date_lte):
+    def __init__(self, areas, listing_date_gte, listing_date_lte, concurrency=CONCURRENCY):
         self.payload = self.generate_payload(areas, listing_date_gte, listing_date_lte)
+        self.concurrency = concurrency
+        self.failed_rows = 0  # Rows postgres did not store because of an error that can pass, see store_rows
+        self.dropped_rows = 0  # Rows postgres rejected and will always reject
 
     @staticmethod
     def generate_payload(areas, listing_date_gte, listing_date_lte):
         """
-        Generate the payload for the GraphQL request.
+        Generate the payload for the GraphQL request, requesting the fields
+        configured in query_compiler.
 
         :param areas: The area code to filter events.
         :param listing_date_gte: The start date for event listings (inclusive).
         :param listing_date_lte: The end date for event listings (inclusive).
         :return: The generated payload.
         """
-        with open(QUERY_TEMPLATE_PATH, "r") as file:
-            payload = json.load(file)
+        return query_compiler.listing_payload(areas, listing_date_gte, listing_date_lte)
 
-        payload["variables"]["filters"]["areas"]["eq"] = areas
-        payload["variables"]["filters"]["listingDate"]["gte"] = listing_date_gte
-        payload["variables"]["filters"]["listingDate"]["lte"] = listing_date_lte
+    def page_payload(self, page_number):
+        """
+        Build a copy of the payload for the given page number, so that
+        concurrent requests never share a mutable variables dict.
 
+        :param page_number: The page number for event listings.
+        :return: The payload for that page.
+        """
+        payload = dict(self.payload)
+        payload["variables"] = dict(self.payload["variables"], page=page_number)
         return payload
 
-    def get_events(self, page_number):
+    def get_listings(self, page_number):
         """
-        Fetch events for the given page number.
+        Fetch the eventListings object for the given page number.
 
         :param page_number: The page number for event listings.
-        :return: A list of events.
+        :return: The eventListings dict (with "data" and "totalResults").
+        :raises requests.exceptions.RequestException: If the page cannot be fetched after retrying,
+            so a transient failure never silently ends pagination.
+        :raises GraphQLError: If the response has no eventListings, so a GraphQL error is never
+            taken for an empty page.
         """
-        self.payload["variables"]["page"] = page_number
-        response = requests.post(URL, headers=HEADERS, json=self.payload)
-
-        try:
-            response.raise_for_status()
-            data = response.json()
-        except (requests.exceptions.RequestException, ValueError):
-            print(f"Error: {response.status_code}")
-            return []
+        import batch_query  # Imported here because batch_query builds on EventFetcher
+        data = batch_query.post_json(URL, self.page_payload(page_number), headers=HEADERS, decode=decoder.decode_listings)
 
         #print("GraphQL Response:", data)
 
@@ -68,11 +101,33 @@ class EventFetcher:
         #with open(f"response_page_{page_number}.json", "w", encoding="utf-8") as file:
             #json.dump(data, file, ensure_ascii=False, indent=2)
 
-        if 'data' not in data:
-            print(f"Error: {data}")
-            return []
+        listings = (data.get("data") or {}).get("eventListings")
+        if listings is None:
+            raise GraphQLError(f"Page {page_number} has no eventListings: {data.get('errors') or data}")
+
+        return listings
 
-        return data["data"]["eventListings"]["data"]
+    def get_events(self, page_number):
+        """
+        Fetch events for the given page number.
+
+        :param page_number: The page number for event listings.
+        :return: A list of events.
+        """
+        with metrics.timer("get_events"):
+            listings = self.get_listings(page_number)
+
+        return listings.get("data") or []
+
+    def page_count(self, total_results):
+        """
+        Work out how many pages are needed for the given number of results.
+
+        :param total_results: The totalResults value reported by the API.
+        :return: The number of pages.
+        """
+        page_size = self.payload["variables"].get("pageSize") or 1
+        return math.ceil((total_results or 0) / page_size)
 
     @staticmethod
     def print_event_details(events):
@@ -133,29 +188,103 @@ class EventFetcher:
 
             self.print_event_details(events)
             page_number += 1
-            time.sleep(DELAY)
 
-    def fetch_all_events(self):
+    def fetch_all_events(self, concurrent=False, first_page=None):
         """
         Fetch all events and return them as a list.
 
+        :param concurrent: Fetch the pages after the first one concurrently. (default: False)
+        :param first_page: The eventListings of page 1, if it was already fetched. (default: None)
         :return: A list of all events.
         """
+        if concurrent:
+            return self.fetch_all_events_concurrently(first_page)
+
         all_events = []
-        page_number = 1
+        for events in self.iter_pages(first_page):
+            all_events.extend(events)
 
-        while True:
+        return all_events
+
+    def iter_pages(self, first_page=None):
+        """
+        Fetch the pages one after the other, yielding each page's events as
+        soon as it arrives.
+
+        :param first_page: The eventListings of page 1, if it was already fetched. (default: None)
+        :return: A generator of event lists, one per page.
+        """
+        listings = first_page or self.get_listings(1)
+        yield listings.get("data") or []
+        total_pages = self.page_count(listings.get("totalResults"))
+
+        for page_number in range(2, total_pages + 1):
             events = self.get_events(page_number)
 
             if not events:
                 break
 
-            all_events.extend(events)
-            page_number += 1
-            time.sleep(DELAY)
+            yield events
+
+    def fetch_all_events_concurrently(self, first_page=None):
+        """
+        Fetch all events, reading totalResults from the first page and then
+        fetching the remaining pages at the same time, at most
+        ``self.concurrency`` in flight.
+
+        :param first_page: The eventListings of page 1, if it was already fetched. (default: None)
+        :return: A list of all events, in page order.
+        """
+        listings = first_page or self.get_listings(1)
+        total_pages = self.page_count(listings.get("totalResults"))
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            pages = executor.map(self.get_events, range(2, total_pages + 1))
+
+            all_events = list(listings.get("data") or [])
+            for events in pages:
+                all_events.extend(events)
 
         return all_events
 
+    @staticmethod
+    def csv_rows(events):
+        """
+        Build the CSV rows for the given events, one row per artist.
+
+        :param events: A list of event listings or parsed Events.
+        :return: A generator of rows.
+        """
+        for event in parse_events(events):
+            genres = ', '.join([genre.name for genre in event.genres]) or 'N/A'
+
+            for artist in event.artists:
+                yield [
+                    event.id,
+                    event.title,
+                    event.date,
+                    event.start_time,
+                    event.end_time,
+                    event.lineup,
+                    genres,
+                    event.venue.name,
+                    event.content_url,
+                    event.attending,
+                    artist.id,
+                    artist.country_id,
+                    artist.name,
+                    artist.first_name,
+                    artist.last_name,
+                    artist.facebook,
+                    artist.instagram,
+                    artist.twitter,
+                    artist.soundcloud,
+                    artist.discogs,
+                    artist.bandcamp,
+                    artist.website,
+                    # Add new fields here
+                ]
+
     def save_events_to_csv(self, events, output_file="events.csv"):
         """
         Save events to a CSV file.
@@ -165,162 +294,267 @@ class EventFetcher:
         """
         with open(output_file, "w", newline="", encoding="utf-8") as file:
             writer = csv.writer(file)
-            writer.writerow([
-                "Event id", "Event name", "Date", "Start Time", "End Time",
-                "Artists", "Genres",
-                "Venue", "Event URL", "Number of guests attending",
-                "Artist ID", "Artist Country ID", "Artist Name",
-                "Artist First Name", "Artist Last Name", "Artist Facebook",
-                "Artist Instagram", "Artist Twitter", "Artist Soundcloud",
-                "Artist Discogs", "Artist Bandcamp", "Artist Website",  # Add new fields here
-            ])
-
-            for event in events:
-                event_data = event.get("event", {})
-                artists_info = event_data.get("artists", [])
-                genres_info = event_data.get("genres", [])
-                genres = [genre.get('name', '') for genre in genres_info]
-
-                if not genres:
-                    genres = ['N/A']
+            writer.writerow(CSV_HEADER)
+            writer.writerows(self.csv_rows(events))
 
-    
-                for artist in artists_info:
-                    writer.writerow([
-                        event_data.get('id', ''),
-                        event_data.get('title', ''),
-                        event_data.get('date', ''),
-                        event_data.get('startTime', ''),
-                        event_data.get('endTime', ''),
-                        ', '.join([artist_info.get('name', '') for artist_info in artists_info]),
-                        ', '.join(genres),
-                        event_data.get('venue', {}).get('name', ''),
-                        event_data.get('contentUrl', ''),
-                        event_data.get('attending', ''),
-                        artist.get('id', ''),
-                        artist.get('countryId', ''),
-                        artist.get('name', ''),
-                        artist.get('firstName', ''),
-                        artist.get('lastName', ''),
-                        artist.get('facebook', ''),
-                        artist.get('instagram', ''),
-                        artist.get('twitter', ''),
-                        artist.get('soundcloud', ''),
-                        artist.get('discogs', ''),
-                        artist.get('bandcamp', ''),
-                        artist.get('website', ''),
-                        # Add new fields here
-                    ])
-
-
-
-    def save_events_to_postgres(self, events):
-        """
-        Export event data to postgres
 
-        :param events: A list of events.
-        
+
+    @staticmethod
+    def time_of_day(timestamp):
+        """
+        Take the HH:MM:SS part of an ISO timestamp such as "2023-04-23T23:00:00.000".
+
+        :param timestamp: The timestamp string.
+        :return: The time string, or None if there is none.
+        """
+        if 'T' not in (timestamp or ''):
+            return None
+        return timestamp.split('T')[1].split('.')[0]
+
+    def store_rows(self, tables, query, rows, template=None, batch_size=BATCH_SIZE):
+        """
+        Create the tables if needed, then bulk insert the rows. Rows postgres
+        rejects (see utils.insert_rows) are added to dropped_rows; rows lost to
+        any other error, e.g. a lost connection, to failed_rows, so callers can
+        tell a failed batch from an empty one and retry it.
+
+        :param tables: The DDL statements the query needs, see utils.ensure_tables.
+        :param query: The INSERT statement, see utils.insert_rows.
+        :param rows: The rows.
+        :param template: The row template. (default: one %s per value)
+        :param batch_size: The number of rows sent per INSERT statement. (default: BATCH_SIZE)
+        :return: The number of rows stored.
+        """
+        rows = list(rows)
+        if not rows:
+            return 0
+
+        try:
+            ensure_tables(*tables)
+            stored, dropped = insert_rows(query, rows, template=template, batch_size=batch_size)
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(error)
+            self.failed_rows += len(rows)
+            return 0
+
+        self.dropped_rows += dropped
+        return stored
+
+    def save_events_to_postgres(self, events, batch_size=BATCH_SIZE):
+        """
+        Upsert event data into postgres by RA event id, in one transaction with
+        batch_size rows per statement. A stored event is only rewritten when
+        its content hash differs, see fingerprints.py.
+
+        :param events: A list of event listings or parsed Events.
+        :param batch_size: The number of rows sent per INSERT statement. (default: BATCH_SIZE)
+        :return: The number of rows stored.
         """
         """     "Event id", "Event name", "Date", "Start Time", "End Time",
                 "Artists", "Genres", "Venue", "Event URL", "Number of guests attending",
         """
-        unique_event_names = set()  # Keep track of unique event names
+        unique_events = {}  # RA event id -> event, the last one seen wins
+        for event in parse_events(events):
+            if event.id:
+                unique_events[event.id] = event
+
+        rows = []
+        for event_id, event in unique_events.items():
+            # Texts are cut to their column widths, so a long free-text cost never loses the event
+            rows.append((
+                event_id,
+                fit(event.title, 256),
+                fit(event.venue.name, 256),
+                fit(event.venue.address, 300),
+                event.date.split('T')[0] or None,
+                self.time_of_day(event.start_time),
+                self.time_of_day(event.end_time),
+                event.lineup,
+                event.attending,
+                fit(event.cost, 30),
+                [genre.name for genre in event.genres if genre.name],
+                fingerprints.event_fingerprint(event),
+            ))
+        # Keyed rows in a fixed order, so parallel writers lock them in the same order and cannot deadlock
+        rows.sort(key=lambda row: row[0])
+        return self.store_rows((check_event_data_key,), """INSERT INTO event_data (
+                            ra_event_id, event_name, club_name, club_address, event_date, start_time, end_time,
+                            artists, popularity, price, event_genres, content_hash
+                        ) VALUES %s
+                        ON CONFLICT (ra_event_id) DO UPDATE SET
+                            event_name = EXCLUDED.event_name,
+                            club_name = EXCLUDED.club_name,
+                            club_address = EXCLUDED.club_address,
+                            event_date = EXCLUDED.event_date,
+                            start_time = EXCLUDED.start_time,
+                            end_time = EXCLUDED.end_time,
+                            artists = EXCLUDED.artists,
+                            popularity = EXCLUDED.popularity,
+                            price = EXCLUDED.price,
+                            event_genres = EXCLUDED.event_genres,
+                            content_hash = EXCLUDED.content_hash
+                        WHERE event_data.content_hash IS DISTINCT FROM EXCLUDED.content_hash;""",
+                    rows,
+                    template="(%s, %s, %s, %s, %s, %s, %s, ARRAY[%s]::TEXT[], %s, %s, %s::TEXT[], %s)",
+                    batch_size=batch_size)
 
-        for event in events:
-            event_data = event.get("event", {})
-            artists_info = event_data.get("artists", [])
-            genres_info = event_data.get("genres", [])
-            genres = [genre.get('name', '') for genre in genres_info]
-
-            eventName = event_data.get('title', '')
-                    # Check if the event name is already in the set, if so, skip this event
-            if eventName in unique_event_names:
-                continue
+    @staticmethod
+    def collect_genres(events):
+        """
+        Collect the genres of all events, keyed by RA slug (or name when there
+        is no slug), and the genre slugs of each event, keyed by RA event id.
 
-            unique_event_names.add(eventName)  # Add event name to the set
-
-                
-            #event_data.get('id', ''),
-            eventName = event_data.get('title', ''),
-            eventDate = str(event_data.get('date', '')),
-            startTime = event_data.get('startTime', ''),
-            endTime   = event_data.get('endTime', ''),
-            artists   = ', '.join([artist_info.get('name', '') for artist_info in artists_info]),
-            genres_str    = ', '.join(genres),
-            clubName  = event_data.get('venue', {}).get('name', ''),
-            popularity= event_data.get('attending', ''),
-            clubAddress = event_data.get('venue', {}).get('address', ''),
-            price     = event_data.get('cost', '')          
-            eventDate = event_data.get('date', '').split('T')[0]
-            startTime = event_data.get('startTime', '').split('T')[1].split('.')[0]
-            endTime = event_data.get('endTime', '').split('T')[1].split('.')[0]
-            query = sql.SQL("""INSERT INTO event_data (
-                                event_name, club_name, club_address,
-                                event_date, start_time, end_time, artists, popularity, price, event_genres
-                            ) VALUES (
-                                {eventName}, {clubName}, {clubAddress}, {eventDate}, {startTime},
-                                {endTime}, {artists}, {popularity}, {price}, {genres}
-                            )ON CONFLICT (event_name) DO NOTHING;""").format(
-                    eventName=sql.Literal(eventName),
-                    clubName=sql.Literal(clubName),
-                    clubAddress=sql.Literal(clubAddress),
-                    eventDate=sql.Literal(eventDate),
-                    startTime=sql.Literal(startTime),
-                    endTime=sql.Literal(endTime),
-                    artists=sql.SQL("ARRAY[{}]::TEXT[]").format(sql.Literal(artists)),
-                    popularity=sql.Literal(popularity),
-                    price=sql.Literal(price),
-                    genres=sql.SQL("ARRAY[{}]::TEXT[]").format(sql.Literal(genres_str))
-                    )
-            
-                    #print(query)
-            commit_to_dataBase(query)
-    
-    def save_artists_to_postgres(self, events):   
+        :param events: A list of event listings or parsed Events.
+        :return: A (dict of slug -> name, dict of RA event id -> sorted list of slugs) tuple.
+        """
+        genres = {}
+        event_genres = {}
+        for event in parse_events(events):
+            if not event.id:
+                continue
+            slugs = set()
+            for genre in event.genres:
+                slug = genre.slug or genre.name
+                if not slug:
+                    continue
+                genres.setdefault(slug, genre.name or slug)
+                slugs.add(slug)
+            event_genres[event.id] = sorted(slugs)
+        return genres, event_genres
+
+    def save_genres_to_postgres(self, events, batch_size=BATCH_SIZE):
+        """
+        Upsert the genres of the events into genres and replace their links
+        in event_genres. Only the rows of these events are touched, so no pass
+        over the whole event_data table is needed afterwards. Run after
+        save_events_to_postgres, as every link refers to an event_data row.
+
+        :param events: A list of event listings or parsed Events.
+        :param batch_size: The number of rows sent per INSERT statement. (default: BATCH_SIZE)
+        :return: The number of rows stored.
         """
-        Export event data to postgres
+        genres, event_genres = self.collect_genres(events)
+        tables = (check_event_data_key, create_genres_table, create_event_genres_table)
+        count = self.store_rows(tables, """INSERT INTO genres (genre_slug, genre_name) VALUES %s
+                        ON CONFLICT (genre_slug) DO UPDATE SET genre_name = EXCLUDED.genre_name
+                        WHERE genres.genre_name IS DISTINCT FROM EXCLUDED.genre_name;""",
+                    sorted({fit(slug, 100): fit(name, 100) for slug, name in genres.items()}.items()),
+                    batch_size=batch_size)
+        # One row per event, so the links an event no longer has are dropped in the same
+        # statement; links to events that are not in event_data (e.g. a failed batch) are skipped
+        count += self.store_rows(tables, """WITH v (ra_event_id, genre_slugs) AS (VALUES %s),
+                        stale AS (
+                            DELETE FROM event_genres g USING v
+                            WHERE g.ra_event_id = v.ra_event_id AND NOT g.genre_slug = ANY (v.genre_slugs)
+                        )
+                        INSERT INTO event_genres (ra_event_id, genre_slug)
+                        SELECT v.ra_event_id, unnest(v.genre_slugs) FROM v
+                        WHERE EXISTS (SELECT 1 FROM event_data e WHERE e.ra_event_id = v.ra_event_id)
+                        ON CONFLICT DO NOTHING;""",
+                    sorted((event_id, [fit(slug, 100) for slug in slugs]) for event_id, slugs in event_genres.items()),
+                    template="(%s, %s::VARCHAR[])",
+                    batch_size=batch_size)
+        return count
 
-        :param events: A list of events.
-        
+    @staticmethod
+    def collect_artists(events):
+        """
+        De-duplicate the artists of all events in memory. The name is cleaned
+        once per RA artist id (or raw name when there is no id) and resolved
+        through the artist index (see artist_index.py), so every spelling of
+        an artist gets its canonical name, and distinct RA artists sharing a
+        name get distinct names. Artists are merged by that name, the table's
+        key, and the genres of all their events are merged.
+
+        :param events: A list of event listings or parsed Events.
+        :return: A dict mapping artist names to their merged details, with their RA id.
+        """
+        index = artist_index.get_index()
+        cleaned_names = {}  # RA artist id or raw name -> (canonical name, RA id)
+        artists = {}
+
+        for event in parse_events(events):
+            genres = [genre.name for genre in event.genres if genre.name]
+
+            for artist in event.artists:
+                key = artist.id or artist.name
+                if key not in cleaned_names:
+                    with metrics.timer("name_cleaning"):
+                        names = split_artists(artist.name)
+                    name, ra_id = (names[0] if names else ''), artist.id or None
+                    if name and index is not None:
+                        with metrics.timer("artist_resolution"):
+                            ra_id, name = index.display_name(index.resolve(artist.id, name, artist.aliases))
+                    cleaned_names[key] = (name, ra_id)
+
+                artistName, ra_id = cleaned_names[key]
+                if not artistName:
+                    continue
+
+                # Never merge two RA artists, e.g. when the index is off and their names are equal
+                merged = artists.get(artistName)
+                if merged and ra_id and merged['ra_id'] and merged['ra_id'] != ra_id:
+                    artistName = f"{artistName} (RA {ra_id})"
+                merged = artists.setdefault(artistName, {'genres': [], 'ra_id': None})
+                merged['ra_id'] = merged['ra_id'] or ra_id
+                for link in ARTIST_LINKS:
+                    if not merged.get(link):
+                        merged[link] = getattr(artist, link)
+                for genre in genres:
+                    if genre not in merged['genres']:
+                        merged['genres'].append(genre)
+
+        if index is not None:
+            index.save()
+        return artists
+
+    def save_artists_to_postgres(self, events, batch_size=BATCH_SIZE):
+        """
+        Export artist data to postgres as one batched upsert of the unique
+        artists. Genres are merged with the ones already stored, links are
+        only filled in where they are still empty. A row holding another RA
+        artist under the same name is left untouched.
+
+        :param events: A list of event listings or parsed Events.
+        :param batch_size: The number of rows sent per INSERT statement. (default: BATCH_SIZE)
+        :return: The number of rows stored.
         """
         """       
             "Artist ID", "Artist Country ID", "Artist Name",
             "Artist First Name", "Artist Last Name", "Artist Facebook",
             "Artist Instagram", "Artist Twitter", "Artist Soundcloud",
             "Artist Discogs", "Artist Bandcamp", "Artist Website", 
-        """                           
-        for event in events:
-            event_data = event.get("event", {})
-            artists_info = event_data.get("artists", [])
-            genres_info = event_data.get("genres", [])
-            genres = [genre.get('name', '') for genre in genres_info]
-
-            for artist in artists_info:
-                artistName = name_cleaner(artist.get('name', ''))
-                facebook = artist.get('facebook', '')
-                instagram = artist.get('instagram', '')
-                soundcloud = artist.get('soundcloud', '')
-                discogs = artist.get('discogs', '')
-                bandcamp = artist.get('bandcamp', '')
-                website = artist.get('website', '')
-
-                query2 = sql.SQL("""INSERT INTO artists (
-                                    artist_name, facebook_link, instagram_link, genres, soundcloud_link, bandcamp_link, website, other_link
-                                ) VALUES (
-                                    {artistName}, {facebook}, {instagram}, ARRAY[{genres}], {soundcloud}, {bandcamp}, {website}, {discogs}
-                                )ON CONFLICT (artist_name) DO NOTHING;""").format(
-                    artistName=sql.Literal(artistName[0] if artistName else ''),
-                    facebook=sql.Literal(facebook),
-                    instagram=sql.Literal(instagram),
-                    genres=sql.SQL("ARRAY[{}]::TEXT[]").format(sql.Literal(genres)),
-                    soundcloud=sql.Literal(soundcloud),
-                    bandcamp=sql.Literal(bandcamp),
-                    website=sql.Literal(website),
-                    discogs=sql.Literal(discogs)
-                )
-                            #print(query2)
-                commit_to_dataBase(query2)
-                     
+        """
+        rows = {}  # Names cut to the column width can meet, the first one is kept
+        for artistName, artist in sorted(self.collect_artists(events).items()):
+            rows.setdefault(fit(artistName, 150), (
+                fit(artistName, 150),
+                fit(artist['facebook'], 200, cut=False),
+                fit(artist['instagram'], 200, cut=False),
+                artist['genres'],
+                fit(artist['soundcloud'], 200, cut=False),
+                fit(artist['bandcamp'], 200, cut=False),
+                artist['website'],
+                fit(artist['discogs'], 200, cut=False),
+                fit(artist['ra_id'], 20),
+            ))
+        return self.store_rows((add_artists_ra_id_column,), """INSERT INTO artists (
+                            artist_name, facebook_link, instagram_link, genres, soundcloud_link, bandcamp_link, website, other_link, ra_artist_id
+                        ) VALUES %s
+                        ON CONFLICT (artist_name) DO UPDATE SET
+                            genres = ARRAY(SELECT DISTINCT unnest(COALESCE(artists.genres, '{}') || EXCLUDED.genres)),
+                            facebook_link = COALESCE(NULLIF(artists.facebook_link, ''), EXCLUDED.facebook_link),
+                            instagram_link = COALESCE(NULLIF(artists.instagram_link, ''), EXCLUDED.instagram_link),
+                            soundcloud_link = COALESCE(NULLIF(artists.soundcloud_link, ''), EXCLUDED.soundcloud_link),
+                            bandcamp_link = COALESCE(NULLIF(artists.bandcamp_link, ''), EXCLUDED.bandcamp_link),
+                            website = COALESCE(NULLIF(artists.website, ''), EXCLUDED.website),
+                            other_link = COALESCE(NULLIF(artists.other_link, ''), EXCLUDED.other_link),
+                            ra_artist_id = COALESCE(artists.ra_artist_id, EXCLUDED.ra_artist_id)
+                        WHERE artists.ra_artist_id IS NULL OR EXCLUDED.ra_artist_id IS NULL
+                            OR artists.ra_artist_id = EXCLUDED.ra_artist_id;""",
+                    rows.values(),
+                    template="(%s, %s, %s, %s::TEXT[], %s, %s, %s, %s, %s)",
+                    batch_size=batch_size)
 
    
    
@@ -340,31 +574,106 @@ def main():
     parser.add_argument("areas", type=int, help="The area code to filter events.")
     parser.add_argument("start_date", type=str, help="The start date for event listings (inclusive, format: YYYY-MM-DD).")
     parser.add_argument("end_date", type=str, help="The end date for event listings (inclusive, format: YYYY-MM-DD).")
+    parser.add_argument("-r", "--rate", type=float, default=ratelimit.RATE, help=f"Maximum requests per second sent to ra.co (default: {ratelimit.RATE}).")
+    parser.add_argument("-c", "--concurrency", type=int, default=CONCURRENCY, help=f"Maximum number of pages fetched at the same time (default: {CONCURRENCY}).")
+    parser.add_argument("-s", "--max-shard-results", type=int, default=MAX_SHARD_RESULTS, help=f"Split the date range until each shard has at most this many events (default: {MAX_SHARD_RESULTS}).")
+    parser.add_argument("-i", "--incremental", action="store_true", help="Only fetch windows that are new or can still change, and only store new or changed events.")
+    parser.add_argument("-b", "--batch-size", type=int, default=BATCH_SIZE, help=f"Rows sent to postgres per INSERT statement (default: {BATCH_SIZE}).")
+    parser.add_argument("--no-cache", action="store_true", help="Always fetch from ra.co instead of reusing cached responses.")
+    parser.add_argument("-q", "--queue-size", type=int, default=QUEUE_SIZE, help=f"Pages buffered between the fetchers and the sinks (default: {QUEUE_SIZE}).")
+    parser.add_argument("--csv", type=str, help="Also write the events to this CSV file, one row per artist.")
+    parser.add_argument("--jsonl", type=str, help="Also append the events to this JSON Lines archive, one event per line; .gz or .zst compresses it.")
+    parser.add_argument("--overwrite", action="store_true", help="Replace an existing --jsonl archive instead of appending the events not already in it.")
+    parser.add_argument("--resume", action="store_true", help=argparse.SUPPRESS)  # The default now, kept for old command lines
+    parser.add_argument("--columnar", type=str, help="Also write normalized events, event_artist, event_genre, artists and genres tables to this directory (needs pyarrow).")
+    parser.add_argument("--columnar-format", choices=["parquet", "arrow"], default="parquet", help="File format of the columnar tables (default: parquet).")
+    parser.add_argument("--no-partition", action="store_true", help="Do not partition the columnar event tables by area and month.")
+    parser.add_argument("--store", type=str, help="Also upsert the events into this local SQLite store, e.g. events.sqlite3; query it with event_store.py.")
+    parser.add_argument("--artist-index", type=str, default=artist_index.INDEX_PATH, help=f"Resolve postgres artists through this index of RA ids, aliases and name variants (default: {artist_index.INDEX_PATH}).")
+    parser.add_argument("--no-artist-index", action="store_true", help="Key postgres artists by their cleaned name alone.")
+    parser.add_argument("--fingerprints", type=str, default=fingerprints.INDEX_PATH, help=f"Remember the fingerprint of every event written to postgres here, and skip events that are unchanged since (default: {fingerprints.INDEX_PATH}).")
+    parser.add_argument("--no-fingerprints", action="store_true", help="Write every event to postgres, changed or not.")
+    parser.add_argument("--no-postgres", action="store_true", help="Do not store the events in postgres.")
+    parser.add_argument("--record", type=str, help="Append every GraphQL request and response to this JSON Lines file, e.g. recordings.jsonl.")
+    parser.add_argument("--replay", type=str, help="Answer requests from a file written by --record instead of ra.co (implies --no-cache).")
+    parser.add_argument("--full-query", action="store_true", help="Request every field of the query template instead of only the fields the sinks need.")
+    parser.add_argument("--json-backend", choices=decoder.BACKENDS, help=f"Library decoding the responses (default: ${decoder.BACKEND_VARIABLE}, else the fastest installed).")
+    parser.add_argument("--persisted-queries", action="store_true", help="Send the sha256 hash of the query instead of its text when ra.co accepts it.")
+    parser.add_argument("--metrics", type=str, help="Write stage timings and counters at the end of the run: Prometheus text for a .prom file, a JSON summary otherwise.")
+    parser.add_argument("--profile", type=str, nargs="?", const="", help="Run under cProfile and print the slowest functions; also save the stats to the given file.")
     #parser.add_argument("-o", "--output", type=str, default="events.csv", help="The output file path (default: events.csv).")
     args = parser.parse_args()
+    pool_size = max(args.concurrency, http_client.POOL_SIZE)
+    adapter = None
+    if args.replay:
+        from replay import ReplayAdapter
+        adapter = ReplayAdapter(args.replay)
+    elif args.record:
+        from replay import RecordingAdapter
+        adapter = RecordingAdapter(args.record, pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+
+    ratelimit.configure(rate=args.rate)
+    http_client.configure(pool_size, adapter)
+    response_cache.configure(enabled=not (args.no_cache or args.replay))
+    artist_index.configure(args.artist_index, enabled=not (args.no_artist_index or args.no_postgres))
+    fingerprints.configure(args.fingerprints, enabled=not (args.no_fingerprints or args.no_postgres))
 
     listing_date_gte = f"{args.start_date}T00:00:00.000Z"
     listing_date_lte = f"{args.end_date}T23:59:59.999Z"
 
-    event_fetcher = EventFetcher(args.areas, listing_date_gte, listing_date_lte)
+    event_fetcher = EventFetcher(args.areas, listing_date_gte, listing_date_lte, args.concurrency)
     
 
     #event_fetcher.fetch_and_print_all_events()
 
-    all_events = []
-    current_start_date = datetime.strptime(args.start_date, "%Y-%m-%d")
-
-    while current_start_date <= datetime.strptime(args.end_date, "%Y-%m-%d"):
-        listing_date_gte = current_start_date.strftime("%Y-%m-%dT00:00:00.000Z")
-        event_fetcher.payload = event_fetcher.generate_payload(args.areas, listing_date_gte, listing_date_lte)
-        events = event_fetcher.fetch_all_events()
-        all_events.extend(events)
-        current_start_date += timedelta(days=len(events))
-
-    #event_fetcher.save_events_to_csv(all_events, args.output)
-    #event_fetcher.save_events_to_json(all_events, "events.json")
-    event_fetcher.save_events_to_postgres(all_events)
-    event_fetcher.save_artists_to_postgres(all_events)
+    # Imported here because sharding, incremental and pipeline build on EventFetcher
+    from sharding import ShardPlanner
+    from incremental import IncrementalScrape
+    import pipeline
+
+    sinks = []
+    if args.csv:
+        sinks.append(pipeline.CsvSink(args.csv))
+    if args.jsonl:
+        sinks.append(pipeline.JsonLinesSink(args.jsonl, resume=not args.overwrite))
+    if args.columnar:
+        from columnar_export import ColumnarSink
+        sinks.append(ColumnarSink(args.columnar, args.areas, args.columnar_format, not args.no_partition))
+    if args.store:
+        from event_store import StoreSink
+        sinks.append(StoreSink(args.store, args.areas))
+    if not args.no_postgres:
+        sinks.append(pipeline.PostgresSink(event_fetcher, args.batch_size))
+
+    # Only request the fields the sinks read
+    fields = None if args.full_query else query_compiler.required_fields(sinks)
+    query_compiler.configure(fields, args.persisted_queries)
+    decoder.configure(args.json_backend, keep_raw=any(sink.needs_raw for sink in sinks))
+
+    if args.incremental:
+        scrape = IncrementalScrape(args.areas)
+        pages = scrape.iter_changed_pages(args.start_date, args.end_date, args.max_shard_results, args.concurrency, args.queue_size)
+    else:
+        planner = ShardPlanner(args.areas, args.start_date, args.end_date, args.max_shard_results, args.concurrency)
+        pages = planner.iter_pages(args.queue_size)
+
+    profiler = metrics.profile(args.profile or None) if args.profile is not None else nullcontext()
+    try:
+        with profiler:
+            count = pipeline.run(pipeline.unique_events(pages), sinks)
+    except RuntimeError as error:
+        # Some events were not stored: keep the incremental state as it was, so they are fetched again
+        print(f"Error: {error}")
+        close_pool()
+        sys.exit(1)
+    print(f"Stored {count} events.")
+    close_pool()
+
+    if args.metrics:
+        metrics.export(args.metrics)
+
+    if args.incremental:
+        scrape.save()
 
 if __name__ == "__main__":
     main()
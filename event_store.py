@@ -0,0 +1,452 @@
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+STORE_PATH = "events.sqlite3"
+BATCH_SIZE = 1000  # Events written per transaction
+LIMIT = 20  # Rows printed per query by default
+BUSY_TIMEOUT = 30000  # Milliseconds a writer waits for another one, e.g. parallel areas
+MMAP_SIZE = 256 * 1024 * 1024  # Bytes of the database file mapped into memory for reads
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS venues (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    address TEXT NOT NULL,
+    content_url TEXT NOT NULL,
+    live INTEGER
+);
+CREATE TABLE IF NOT EXISTS events (
+    id TEXT PRIMARY KEY,
+    listing_id TEXT,
+    area INTEGER,
+    date TEXT NOT NULL,
+    listing_date TEXT NOT NULL,
+    title TEXT NOT NULL,
+    start_time TEXT NOT NULL,
+    end_time TEXT NOT NULL,
+    cost TEXT NOT NULL,
+    attending INTEGER,
+    content_url TEXT NOT NULL,
+    is_ticketed INTEGER,
+    venue_id TEXT REFERENCES venues (id)
+);
+CREATE TABLE IF NOT EXISTS artists (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    country_id TEXT NOT NULL,
+    first_name TEXT NOT NULL,
+    last_name TEXT NOT NULL,
+    facebook TEXT NOT NULL,
+    instagram TEXT NOT NULL,
+    twitter TEXT NOT NULL,
+    soundcloud TEXT NOT NULL,
+    discogs TEXT NOT NULL,
+    bandcamp TEXT NOT NULL,
+    website TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS genres (
+    slug TEXT PRIMARY KEY,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS event_artists (
+    event_id TEXT NOT NULL REFERENCES events (id),
+    artist_id TEXT NOT NULL REFERENCES artists (id),
+    position INTEGER NOT NULL,
+    PRIMARY KEY (event_id, artist_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS event_genres (
+    event_id TEXT NOT NULL REFERENCES events (id),
+    genre_slug TEXT NOT NULL REFERENCES genres (slug),
+    PRIMARY KEY (event_id, genre_slug)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS events_date ON events (date);
+CREATE INDEX IF NOT EXISTS events_area_date ON events (area, date);
+CREATE INDEX IF NOT EXISTS events_venue_date ON events (venue_id, date);
+CREATE INDEX IF NOT EXISTS event_artists_artist ON event_artists (artist_id, event_id);
+CREATE INDEX IF NOT EXISTS event_genres_genre ON event_genres (genre_slug, event_id);
+CREATE INDEX IF NOT EXISTS artists_name ON artists (name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS venues_name ON venues (name COLLATE NOCASE);
+"""
+
+# Full-text index over the event titles, kept in step with the events table
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5 (title, content='events', content_rowid='rowid');
+CREATE TRIGGER IF NOT EXISTS events_fts_insert AFTER INSERT ON events BEGIN
+    INSERT INTO events_fts (rowid, title) VALUES (new.rowid, new.title);
+END;
+CREATE TRIGGER IF NOT EXISTS events_fts_delete AFTER DELETE ON events BEGIN
+    INSERT INTO events_fts (events_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+END;
+CREATE TRIGGER IF NOT EXISTS events_fts_update AFTER UPDATE OF title ON events BEGIN
+    INSERT INTO events_fts (events_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+    INSERT INTO events_fts (rowid, title) VALUES (new.rowid, new.title);
+END;
+"""
+
+ARTIST_LINKS = ["facebook", "instagram", "twitter", "soundcloud", "discogs", "bandcamp", "website"]
+ARTIST_COLUMNS = ["id", "name", "country_id", "first_name", "last_name"] + ARTIST_LINKS
+
+# Columns printed for lists of events
+EVENT_SELECT = """
+SELECT e.date, e.title, v.name AS venue, e.area, e.attending, e.id
+FROM events e LEFT JOIN venues v ON v.id = e.venue_id
+"""
+
+
+def keep_known(columns):
+    """
+    An ON CONFLICT update that never replaces a known value with an empty
+    one, since a run may request fewer fields than an earlier one.
+    """
+    return ", ".join(f"{column} = COALESCE(NULLIF(excluded.{column}, ''), {column})" for column in columns)
+
+
+def date_filter(column, start_date=None, end_date=None, area=None, area_column="e.area"):
+    """
+    The WHERE conditions and parameters limiting events to a date range and area.
+
+    :param column: The date column.
+    :param start_date: The first day (inclusive, YYYY-MM-DD), or None.
+    :param end_date: The last day (inclusive, YYYY-MM-DD), or None.
+    :param area: The area code, or None.
+    :return: A (list of conditions, list of parameters) tuple.
+    """
+    conditions, parameters = [], []
+    if start_date:
+        conditions.append(f"{column} >= ?")
+        parameters.append(start_date)
+    if end_date:
+        conditions.append(f"{column} <= ?")
+        parameters.append(end_date)
+    if area is not None:
+        conditions.append(f"{area_column} = ?")
+        parameters.append(area)
+    return conditions, parameters
+
+
+def where(conditions):
+    return f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+
+class EventStore:
+    """
+    A local, normalized copy of the scraped events in a single SQLite file:
+    events, venues, artists and genres, with the event/artist and event/genre
+    links, indexed for lookups by date, area, venue, artist and genre, and a
+    full-text index over event titles when SQLite has FTS5.
+
+    Events are upserted by id, so scraping a range again updates it in place.
+    """
+
+    def __init__(self, path=STORE_PATH, readonly=False):
+        self.path = path
+        self.lock = threading.Lock()
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT / 1000, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT}")
+        self.conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        self.conn.row_factory = sqlite3.Row
+
+        if not readonly:
+            with self.conn:
+                self.conn.executescript(SCHEMA)
+                try:
+                    self.conn.executescript(FTS_SCHEMA)
+                except sqlite3.OperationalError as e:
+                    print(f"No full-text search, SQLite was built without FTS5: {str(e)}")
+        self.fts = self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'events_fts'").fetchone() is not None
+
+    def add(self, events, area=None):
+        """
+        Insert or update events with their venues, artists and genres, in one transaction.
+
+        :param events: A list of Events.
+        :param area: The area code of the events. (default: keep the stored one)
+        :return: The number of events written.
+        """
+        venues, artists, genres = {}, {}, {}
+        event_rows, artist_links, genre_links = [], [], []
+        for event in events:
+            venue = event.venue
+            if venue.id:
+                venues[venue.id] = (venue.id, venue.name, venue.address, venue.content_url, venue.live)
+            attending = event.attending if isinstance(event.attending, int) else None
+            event_rows.append((
+                event.id, event.listing_id, area, event.date[:10], event.listing_date, event.title,
+                event.start_time, event.end_time, event.cost, attending, event.content_url,
+                event.is_ticketed, venue.id or None,
+            ))
+            for position, artist in enumerate(event.artists):
+                artist_id = artist.id or artist.name
+                artists[artist_id] = (artist_id,) + tuple(getattr(artist, column) or '' for column in ARTIST_COLUMNS[1:])
+                artist_links.append((event.id, artist_id, position))
+            for genre in event.genres:
+                genre_slug = genre.slug or genre.name
+                genres[genre_slug] = (genre_slug, genre.name)
+                genre_links.append((event.id, genre_slug))
+
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO venues (id, name, address, content_url, live) VALUES (?, ?, ?, ?, ?) "
+                f"ON CONFLICT (id) DO UPDATE SET {keep_known(['name', 'address', 'content_url'])}, "
+                "live = COALESCE(excluded.live, live)",
+                sorted(venues.values()))
+            self.conn.executemany(
+                f"INSERT INTO artists ({', '.join(ARTIST_COLUMNS)}) VALUES ({', '.join('?' * len(ARTIST_COLUMNS))}) "
+                f"ON CONFLICT (id) DO UPDATE SET {keep_known(ARTIST_COLUMNS[1:])}",
+                sorted(artists.values()))
+            self.conn.executemany(
+                f"INSERT INTO genres (slug, name) VALUES (?, ?) ON CONFLICT (slug) DO UPDATE SET {keep_known(['name'])}",
+                sorted(genres.values()))
+            self.conn.executemany(
+                "INSERT INTO events (id, listing_id, area, date, listing_date, title, start_time, end_time, "
+                "cost, attending, content_url, is_ticketed, venue_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET listing_id = excluded.listing_id, "
+                "area = COALESCE(excluded.area, area), date = excluded.date, listing_date = excluded.listing_date, "
+                "attending = COALESCE(excluded.attending, attending), is_ticketed = COALESCE(excluded.is_ticketed, is_ticketed), "
+                "venue_id = COALESCE(excluded.venue_id, venue_id), "
+                f"{keep_known(['title', 'start_time', 'end_time', 'cost', 'content_url'])}",
+                event_rows)
+
+            # The line-up and genres of an event are replaced as a whole
+            event_ids = [(row[0],) for row in event_rows]
+            self.conn.executemany("DELETE FROM event_artists WHERE event_id = ?", event_ids)
+            self.conn.executemany("INSERT OR IGNORE INTO event_artists (event_id, artist_id, position) VALUES (?, ?, ?)", artist_links)
+            self.conn.executemany("DELETE FROM event_genres WHERE event_id = ?", event_ids)
+            self.conn.executemany("INSERT OR IGNORE INTO event_genres (event_id, genre_slug) VALUES (?, ?)", genre_links)
+        return len(event_rows)
+
+    def query(self, sql, parameters=()):
+        with self.lock:
+            return self.conn.execute(sql, parameters).fetchall()
+
+    def artist_events(self, artist, start_date=None, end_date=None, area=None, limit=LIMIT):
+        """
+        The events of an artist, given by RA id or by name (any case).
+        """
+        conditions, parameters = date_filter("e.date", start_date, end_date, area)
+        conditions.insert(0, "ea.artist_id IN (SELECT id FROM artists WHERE id = ? OR name = ? COLLATE NOCASE)")
+        return self.query(
+            f"{EVENT_SELECT} JOIN event_artists ea ON ea.event_id = e.id {where(conditions)} ORDER BY e.date LIMIT ?",
+            [artist, artist] + parameters + [limit])
+
+    def venue_events(self, venue, start_date=None, end_date=None, limit=LIMIT):
+        """
+        The events at a venue, given by RA id or by name (any case).
+        """
+        conditions, parameters = date_filter("e.date", start_date, end_date)
+        conditions.insert(0, "e.venue_id IN (SELECT id FROM venues WHERE id = ? OR name = ? COLLATE NOCASE)")
+        return self.query(f"{EVENT_SELECT} {where(conditions)} ORDER BY e.date LIMIT ?", [venue, venue] + parameters + [limit])
+
+    def genre_events(self, genre, start_date=None, end_date=None, area=None, limit=LIMIT):
+        """
+        The events of a genre, given by slug or by name (any case).
+        """
+        conditions, parameters = date_filter("e.date", start_date, end_date, area)
+        conditions.insert(0, "eg.genre_slug IN (SELECT slug FROM genres WHERE slug = ? OR name = ? COLLATE NOCASE)")
+        return self.query(
+            f"{EVENT_SELECT} JOIN event_genres eg ON eg.event_id = e.id {where(conditions)} ORDER BY e.date LIMIT ?",
+            [genre, genre] + parameters + [limit])
+
+    def busiest_venues(self, start_date=None, end_date=None, area=None, limit=LIMIT):
+        """
+        The venues with the most events in a date range.
+        """
+        conditions, parameters = date_filter("e.date", start_date, end_date, area)
+        conditions.append("e.venue_id IS NOT NULL")
+        return self.query(
+            "SELECT v.name AS venue, v.address, COUNT(*) AS events, SUM(e.attending) AS attending "
+            f"FROM events e JOIN venues v ON v.id = e.venue_id {where(conditions)} "
+            "GROUP BY e.venue_id ORDER BY events DESC, attending DESC LIMIT ?",
+            parameters + [limit])
+
+    def busiest_artists(self, start_date=None, end_date=None, area=None, limit=LIMIT):
+        """
+        The artists playing the most events in a date range.
+        """
+        conditions, parameters = date_filter("e.date", start_date, end_date, area)
+        return self.query(
+            "SELECT a.name AS artist, COUNT(*) AS events, MIN(e.date) AS first, MAX(e.date) AS last "
+            "FROM event_artists ea JOIN events e ON e.id = ea.event_id JOIN artists a ON a.id = ea.artist_id "
+            f"{where(conditions)} GROUP BY ea.artist_id ORDER BY events DESC LIMIT ?",
+            parameters + [limit])
+
+    def top_genres(self, start_date=None, end_date=None, area=None, limit=LIMIT):
+        """
+        The genres with the most events in a date range.
+        """
+        conditions, parameters = date_filter("e.date", start_date, end_date, area)
+        return self.query(
+            "SELECT g.name AS genre, COUNT(*) AS events "
+            "FROM event_genres eg JOIN events e ON e.id = eg.event_id JOIN genres g ON g.slug = eg.genre_slug "
+            f"{where(conditions)} GROUP BY eg.genre_slug ORDER BY events DESC LIMIT ?",
+            parameters + [limit])
+
+    def search(self, text, start_date=None, end_date=None, area=None, limit=LIMIT):
+        """
+        Events whose title matches a full-text query, best matches first, e.g.
+        'techno AND open*'. Without FTS5, titles containing the text are listed by date.
+        """
+        conditions, parameters = date_filter("e.date", start_date, end_date, area)
+        if not self.fts:
+            conditions.insert(0, "e.title LIKE ?")
+            return self.query(f"{EVENT_SELECT} {where(conditions)} ORDER BY e.date LIMIT ?", [f"%{text}%"] + parameters + [limit])
+        conditions.insert(0, "events_fts MATCH ?")
+        return self.query(
+            f"{EVENT_SELECT} JOIN events_fts ON events_fts.rowid = e.rowid {where(conditions)} ORDER BY events_fts.rank LIMIT ?",
+            [text] + parameters + [limit])
+
+    def counts(self):
+        """
+        The number of rows of each table.
+        """
+        tables = ["events", "venues", "artists", "genres", "event_artists", "event_genres"]
+        return {table: self.query(f"SELECT COUNT(*) FROM {table}")[0][0] for table in tables}
+
+    def close(self):
+        with self.lock:
+            try:
+                self.conn.execute("PRAGMA optimize")
+            except sqlite3.OperationalError:
+                pass
+            self.conn.close()
+
+
+class StoreSink:
+    """
+    Upserts events into an EventStore, batch_size events per transaction.
+    Several sinks (e.g. one per area) may share one file.
+    """
+    needs_raw = False
+    fields = (
+        "id listingDate event { id title date startTime endTime cost attending contentUrl isTicketed "
+        "venue { id name address contentUrl live } genres { name slug } "
+        "artists { id countryId name firstName lastName facebook instagram twitter soundcloud discogs bandcamp website } }"
+    )
+
+    def __init__(self, path=STORE_PATH, area=None, batch_size=BATCH_SIZE):
+        self.store = EventStore(path)
+        self.area = area
+        self.batch_size = batch_size
+        self.buffer = []
+        self.rows = 0
+
+    def write(self, events):
+        self.buffer.extend(events)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.rows += self.store.add(self.buffer, self.area)
+            self.buffer = []
+
+    def close(self):
+        self.flush()
+        self.store.close()
+
+
+def load_archive(store, path, area=None, batch_size=BATCH_SIZE):
+    """
+    Add the events of a JSON Lines archive (see pipeline.JsonLinesSink) to a store.
+
+    :return: The number of events written.
+    """
+    from jsonl_archive import ArchiveReader
+    from models import parse_events
+
+    count = 0
+    batch = []
+    for listing in ArchiveReader(path):
+        batch.append(listing)
+        if len(batch) >= batch_size:
+            count += store.add(parse_events(batch), area)
+            batch = []
+    if batch:
+        count += store.add(parse_events(batch), area)
+    return count
+
+
+def print_rows(rows):
+    """
+    Print query results as aligned columns.
+    """
+    if not rows:
+        print("No results.")
+        return
+    columns = rows[0].keys()
+    values = [["" if row[column] is None else str(row[column]) for column in columns] for row in rows]
+    widths = [min(40, max(len(column), *(len(row[i]) for row in values))) for i, column in enumerate(columns)]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in values:
+        print("  ".join(value[:width].ljust(width) for value, width in zip(row, widths)))
+
+
+def main():
+    options = argparse.ArgumentParser(add_help=False)
+    options.add_argument("-d", "--db", type=str, default=STORE_PATH, help=f"The store file (default: {STORE_PATH}).")
+    options.add_argument("--from", dest="start_date", type=str, help="Only events on or after this day (format: YYYY-MM-DD).")
+    options.add_argument("--to", dest="end_date", type=str, help="Only events on or before this day (format: YYYY-MM-DD).")
+    options.add_argument("-a", "--area", type=int, help="Only events of this area code; for load, the area of the archive.")
+    options.add_argument("-n", "--limit", type=int, default=LIMIT, help=f"Rows to print (default: {LIMIT}).")
+
+    parser = argparse.ArgumentParser(description="Query the local event store written by event_fetcher.py --store.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("artist", parents=[options], help="Events of an artist.").add_argument("name", help="Artist name or RA id.")
+    commands.add_parser("venue", parents=[options], help="Events at a venue.").add_argument("name", help="Venue name or RA id.")
+    commands.add_parser("genre", parents=[options], help="Events of a genre.").add_argument("name", help="Genre name or slug.")
+    commands.add_parser("search", parents=[options], help="Full-text search over event titles.").add_argument("text", help="An FTS5 query, e.g. 'open air'.")
+    commands.add_parser("venues", parents=[options], help="Busiest venues.")
+    commands.add_parser("artists", parents=[options], help="Artists playing the most events.")
+    commands.add_parser("genres", parents=[options], help="Genres with the most events.")
+    commands.add_parser("stats", parents=[options], help="Row counts of every table.")
+    load = commands.add_parser("load", parents=[options], help="Add the events of a JSON Lines archive.")
+    load.add_argument("archive", help="A file written by event_fetcher.py --jsonl.")
+    args = parser.parse_args()
+
+    if args.command != "load" and not os.path.exists(args.db):
+        print(f"Error: no event store at {args.db}, scrape with event_fetcher.py --store first")
+        sys.exit(1)
+    store = EventStore(args.db, readonly=args.command not in ("load",))
+    dates = {"start_date": args.start_date, "end_date": args.end_date}
+    started = time.perf_counter()
+    if args.command == "load":
+        print(f"Loaded {load_archive(store, args.archive, args.area)} events from {args.archive}")
+    elif args.command == "stats":
+        for table, count in store.counts().items():
+            print(f"{table}: {count}")
+    else:
+        if args.command == "artist":
+            rows = store.artist_events(args.name, area=args.area, limit=args.limit, **dates)
+        elif args.command == "venue":
+            rows = store.venue_events(args.name, limit=args.limit, **dates)
+        elif args.command == "genre":
+            rows = store.genre_events(args.name, area=args.area, limit=args.limit, **dates)
+        elif args.command == "search":
+            try:
+                rows = store.search(args.text, area=args.area, limit=args.limit, **dates)
+            except sqlite3.OperationalError as e:
+                print(f"Error: {str(e)}")
+                sys.exit(1)
+        elif args.command == "venues":
+            rows = store.busiest_venues(area=args.area, limit=args.limit, **dates)
+        elif args.command == "artists":
+            rows = store.busiest_artists(area=args.area, limit=args.limit, **dates)
+        else:
+            rows = store.top_genres(area=args.area, limit=args.limit, **dates)
+        print_rows(rows)
+        print(f"{len(rows)} row(s) in {(time.perf_counter() - started) * 1000:.1f} ms")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import argparse
+import hashlib
+import sqlite3
+import threading
+
+import metrics
+
+INDEX_PATH = "fingerprints.sqlite3"
+CHUNK_SIZE = 500  # Event ids looked up per SELECT, below SQLite's bound parameter limit
+
+SEPARATOR = "\x1f"  # Between the fields of a fingerprint, never part of RA text
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    event_id TEXT PRIMARY KEY,
+    digest INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def event_fingerprint(event):
+    """
+    A 64-bit digest of everything postgres stores about an event: its
+    columns in event_data, its artists and its genres. Two runs fetching an
+    unchanged event get the same fingerprint.
+
+    :param event: A parsed Event.
+    :return: The digest as a signed integer, to fit a BIGINT column.
+    """
+    parts = [
+        event.title, event.date, event.start_time, event.end_time,
+        event.venue.name, event.venue.address, event.attending, event.cost,
+    ]
+    for artist in event.artists:
+        aliases = artist.aliases if isinstance(artist.aliases, str) else ",".join(artist.aliases or ())
+        parts += [artist.id, artist.name, aliases, artist.facebook, artist.instagram,
+                  artist.soundcloud, artist.discogs, artist.bandcamp, artist.website]
+    for genre in event.genres:
+        parts += [genre.slug, genre.name]
+
+    encoded = SEPARATOR.join("" if part is None else str(part) for part in parts).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(encoded, digest_size=8).digest(), "big", signed=True)
+
+
+class FingerprintIndex:
+    """
+    The fingerprint of every event last written to postgres, keyed by RA
+    event id and persisted in SQLite, so a run only sends the events that are
+    new or changed since the previous ones.
+    """
+
+    def __init__(self, path=INDEX_PATH):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def changed(self, events):
+        """
+        Filter events down to the ones whose fingerprint differs from the stored one.
+
+        :param events: A list of parsed Events. Events without an id are dropped.
+        :return: A (list of new or changed Events, dict of event id -> fingerprint) tuple.
+            Pass the dict to record once the events are written.
+        """
+        digests = {}
+        for event in events:
+            if event.id:
+                digests[str(event.id)] = event_fingerprint(event)
+
+        ids = list(digests)
+        stored = {}
+        with self.lock:
+            for start in range(0, len(ids), CHUNK_SIZE):
+                chunk = ids[start:start + CHUNK_SIZE]
+                stored.update(self.conn.execute(
+                    f"SELECT event_id, digest FROM fingerprints WHERE event_id IN ({','.join('?' * len(chunk))})",
+                    chunk))
+
+        changed_digests = {event_id: digest for event_id, digest in digests.items() if stored.get(event_id) != digest}
+        changed = [event for event in events if event.id and str(event.id) in changed_digests]
+        metrics.increment("events_unchanged", len(digests) - len(changed_digests))
+        metrics.increment("events_changed", len(changed_digests))
+        return changed, changed_digests
+
+    def record(self, digests):
+        """
+        Store the fingerprints of events written to postgres.
+
+        :param digests: A dict of event id -> fingerprint, as returned by changed.
+        """
+        if not digests:
+            return
+        with self.lock:
+            self.conn.executemany("""INSERT INTO fingerprints (event_id, digest) VALUES (?, ?)
+                                     ON CONFLICT (event_id) DO UPDATE SET digest = excluded.digest""",
+                                  digests.items())
+            self.conn.commit()
+
+    def forget(self, event_ids=None):
+        """
+        Drop stored fingerprints, so the events are written again by the next run.
+
+        :param event_ids: The RA event ids to drop. (default: all of them)
+        :return: The number of fingerprints dropped.
+        """
+        with self.lock:
+            if event_ids is None:
+                count = self.conn.execute("DELETE FROM fingerprints").rowcount
+            else:
+                count = self.conn.executemany("DELETE FROM fingerprints WHERE event_id = ?",
+                                              [(str(event_id),) for event_id in event_ids]).rowcount
+            self.conn.commit()
+        return count
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+_index = None
+_enabled = True
+_lock = threading.Lock()
+
+
+def configure(path=INDEX_PATH, enabled=True):
+    """
+    Open the shared index at another path, or turn it off.
+
+    :param path: The SQLite file of the index.
+    :param enabled: Skip events whose fingerprint is unchanged. (default: True)
+    """
+    global _index, _enabled
+    with _lock:
+        if _index is not None:
+            _index.close()
+        _index = FingerprintIndex(path) if enabled else None
+        _enabled = enabled
+
+
+def get_index():
+    """
+    Return the shared index, opening it on first use, or None when disabled.
+    """
+    global _index
+    with _lock:
+        if _index is None and _enabled:
+            _index = FingerprintIndex()
+        return _index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or reset the fingerprints of the events written to postgres.")
+    parser.add_argument("event_ids", nargs="*", help="With --forget, only forget these RA event ids.")
+    parser.add_argument("-i", "--index", type=str, default=INDEX_PATH, help=f"The fingerprint file (default: {INDEX_PATH}).")
+    parser.add_argument("--forget", action="store_true", help="Forget fingerprints, so the next run writes those events again.")
+    args = parser.parse_args()
+
+    index = FingerprintIndex(args.index)
+    if args.forget:
+        print(f"Forgot {index.forget(args.event_ids or None)} fingerprint(s)")
+    print(f"{index.count()} event fingerprints")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 import requests
 import json
 
+import http_client
+
 URL = 'https://ra.co/graphql'
 HEADERS = {
     'Content-Type': 'application/json',
@@ -27,9 +29,8 @@ def fetch_graphql_schema():
         """
     }
 
-    response = requests.post(URL, headers=HEADERS, json=introspection_query)
-
     try:
+        response = http_client.post(URL, headers=HEADERS, json=introspection_query)
         response.raise_for_status()
         schema_data = response.json()
     except (requests.exceptions.RequestException, ValueError) as e:
@@ -0,0 +1,92 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+import ratelimit
+
+POOL_SIZE = 10  # Keep-alive connections kept open per host
+TIMEOUT = (5, 30)  # Connect and read timeout in seconds
+
+
+def _brotli_available():
+    """urllib3 only decodes br responses when a brotli package is installed."""
+    try:
+        import brotli  # noqa: F401
+    except ImportError:
+        try:
+            import brotlicffi  # noqa: F401
+        except ImportError:
+            return False
+    return True
+
+
+ACCEPT_ENCODING = "gzip, deflate, br" if _brotli_available() else "gzip, deflate"
+
+_session = None
+_lock = threading.Lock()
+
+
+def create_session(pool_size=POOL_SIZE, adapter=None):
+    """
+    Create a requests session with a keep-alive connection pool.
+
+    :param pool_size: The number of connections kept open per host.
+    :param adapter: The transport adapter to mount instead, e.g. replay.ReplayAdapter.
+    :return: The session.
+    """
+    session = requests.Session()
+    if adapter is None:
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "Accept-Encoding": ACCEPT_ENCODING,
+        "Connection": "keep-alive",
+    })
+    return session
+
+
+def get_session():
+    """
+    Return the shared session, creating it on first use.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+
+def configure(pool_size=POOL_SIZE, adapter=None):
+    """
+    Replace the shared session with one using the given pool size.
+
+    :param pool_size: The number of connections kept open per host.
+    :param adapter: The transport adapter to mount instead, e.g. replay.ReplayAdapter.
+    """
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = create_session(pool_size, adapter)
+
+
+def post(url, timeout=TIMEOUT, **kwargs):
+    """
+    POST through the shared session and rate limiter, with retries.
+
+    :param url: The url to post to.
+    :param timeout: The (connect, read) timeout for this request.
+    :param kwargs: Passed on to requests.Session.post.
+    :return: The successful response.
+    """
+    with metrics.timer("http_request"):
+        response = ratelimit.request_with_retry(get_session().post, url, timeout=timeout, **kwargs)
+
+    metrics.increment("requests")
+    metrics.increment("bytes_sent", len(response.request.body or b"") if response.request is not None else 0)
+    # Bytes on the wire, i.e. compressed when the server compressed the response
+    metrics.increment("bytes_received", int(response.headers.get("Content-Length") or len(response.content)))
+    return response
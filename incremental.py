@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+from event_fetcher import QUEUE_SIZE
+from sharding import DATE_FORMAT, ShardPlanner
+
+STATE_DIR = "scrape_state"
+
+
+def event_digest(event):
+    """
+    A digest of an event listing's contents, used to tell whether an event
+    changed since it was last seen.
+
+    :param event: An event listing as returned by the API.
+    :return: A short hex digest.
+    """
+    encoded = json.dumps(event.get("event", event), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()[:16]
+
+
+def event_day(event):
+    """
+    The listing day of an event as YYYY-MM-DD, or "" if unknown.
+    """
+    return (event.get("listingDate") or event.get("event", {}).get("date") or "")[:10]
+
+
+def subtract_range(start_date, end_date, skip_from, skip_to):
+    """
+    The parts of [start_date, end_date] outside [skip_from, skip_to].
+
+    :return: A list of (start_date, end_date) tuples, at most two.
+    """
+    if skip_from > skip_to or skip_to < start_date or skip_from > end_date:
+        return [(start_date, end_date)]
+
+    ranges = []
+    if start_date < skip_from:
+        ranges.append((start_date, skip_from - timedelta(days=1)))
+    if end_date > skip_to:
+        ranges.append((skip_to + timedelta(days=1), end_date))
+    return ranges
+
+
+class AreaState:
+    """
+    The persisted watermark of one area: the listing dates already covered
+    and the digest of every event seen that can still change.
+    """
+
+    def __init__(self, area, state_dir=STATE_DIR):
+        self.area = area
+        self.path = os.path.join(state_dir, f"area_{area}.json")
+        self.covered_from = None
+        self.covered_to = None
+        self.seen = {}  # event id -> [listing day, digest]
+
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as file:
+                state = json.load(file)
+            self.covered_from = datetime.strptime(state["covered_from"], DATE_FORMAT).date()
+            self.covered_to = datetime.strptime(state["covered_to"], DATE_FORMAT).date()
+            self.seen = state.get("seen", {})
+
+    def windows(self, start_date, end_date, today):
+        """
+        The day ranges of [start_date, end_date] that have to be fetched.
+        Days already covered and before today are settled and skipped; days
+        from today on are fetched again because their listings can change.
+
+        :return: A list of (start_date, end_date) tuples.
+        """
+        if self.covered_from is None:
+            return [(start_date, end_date)]
+
+        settled_to = min(self.covered_to, today - timedelta(days=1))
+        return subtract_range(start_date, end_date, self.covered_from, settled_to)
+
+    def changed_events(self, events):
+        """
+        Filter events down to the ones that are new or changed, and remember them.
+
+        :param events: A list of event listings.
+        :return: The new or changed event listings.
+        """
+        changed = []
+        for event in events:
+            event_id = str(event.get("event", {}).get("id") or event.get("id"))
+            digest = event_digest(event)
+            if self.seen.get(event_id, [None, None])[1] == digest:
+                continue
+            self.seen[event_id] = [event_day(event), digest]
+            changed.append(event)
+        return changed
+
+    def extend(self, start_date, end_date):
+        """
+        Mark [start_date, end_date] as covered. Disjoint ranges replace the
+        old one, so the covered range never has holes.
+        """
+        if self.covered_from is None or start_date > self.covered_to + timedelta(days=1) \
+                or end_date < self.covered_from - timedelta(days=1):
+            self.covered_from, self.covered_to = start_date, end_date
+        else:
+            self.covered_from = min(self.covered_from, start_date)
+            self.covered_to = max(self.covered_to, end_date)
+
+    def save(self, today):
+        """
+        Write the state file. Events listed before today can no longer change,
+        so their digests are dropped to keep the file small.
+        """
+        cutoff = today.strftime(DATE_FORMAT)
+        self.seen = {event_id: entry for event_id, entry in self.seen.items() if entry[0] >= cutoff}
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump({
+                "area": self.area,
+                "covered_from": self.covered_from.strftime(DATE_FORMAT),
+                "covered_to": self.covered_to.strftime(DATE_FORMAT),
+                "seen": self.seen,
+            }, file, separators=(",", ":"))
+        os.replace(temporary_path, self.path)
+
+
+class IncrementalScrape:
+    """
+    A class to fetch only the windows of an area that are new or can still
+    change, and hand only new or changed events to the sinks.
+    """
+
+    def __init__(self, areas, state_dir=STATE_DIR, today=None):
+        self.state = AreaState(areas, state_dir)
+        self.today = today or datetime.now(timezone.utc).date()
+
+    def iter_changed_pages(self, start_date, end_date, max_results, concurrency, queue_size=QUEUE_SIZE):
+        """
+        Stream the windows of [start_date, end_date] not settled yet, page by
+        page, keeping only new or changed events.
+
+        :param start_date: The start date (YYYY-MM-DD, inclusive).
+        :param end_date: The end date (YYYY-MM-DD, inclusive).
+        :param max_results: Passed on to ShardPlanner.
+        :param concurrency: Passed on to ShardPlanner.
+        :param queue_size: Passed on to ShardPlanner.iter_pages.
+        :return: A generator of lists of new or changed event listings.
+        """
+        self.start_date = datetime.strptime(start_date, DATE_FORMAT).date()
+        self.end_date = datetime.strptime(end_date, DATE_FORMAT).date()
+
+        changed = 0
+        for window_start, window_end in self.state.windows(self.start_date, self.end_date, self.today):
+            planner = ShardPlanner(
+                self.state.area,
+                window_start.strftime(DATE_FORMAT),
+                window_end.strftime(DATE_FORMAT),
+                max_results,
+                concurrency,
+            )
+            for events in planner.iter_pages(queue_size):
+                events = self.state.changed_events(events)
+                changed += len(events)
+                if events:
+                    yield events
+
+        print(f"{changed} new or changed event(s) for area {self.state.area}")
+
+    def fetch_changed_events(self, start_date, end_date, max_results, concurrency):
+        """
+        Fetch the windows of [start_date, end_date] not settled yet.
+
+        :param start_date: The start date (YYYY-MM-DD, inclusive).
+        :param end_date: The end date (YYYY-MM-DD, inclusive).
+        :param max_results: Passed on to ShardPlanner.
+        :param concurrency: Passed on to ShardPlanner.
+        :return: The new or changed event listings.
+        """
+        changed = []
+        for events in self.iter_changed_pages(start_date, end_date, max_results, concurrency):
+            changed.extend(events)
+        return changed
+
+    def save(self):
+        """
+        Persist the watermark. Call this only after the sinks stored the
+        events, so a failed run is fetched again next time.
+        """
+        self.state.extend(self.start_date, self.end_date)
+        self.state.save(self.today)
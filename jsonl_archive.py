@@ -0,0 +1,355 @@
+import bisect
+import gzip
+import io
+import json
+import os
+import time
+import zlib
+
+import decoder
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FRAME_SIZE = 1 << 20  # Uncompressed bytes buffered before a frame is written (1 MB)
+FSYNC_INTERVAL = 5.0  # Seconds between fsyncs of the archive and its index
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+INDEX_SUFFIX = ".idx"
+KEYS_SUFFIX = ".ids"  # Sidecar with the key of every record, one JSON value per line
+SCAN_CHUNK = 1 << 20  # Bytes read at a time when an archive is scanned for its frames
+
+
+def compression_for(path):
+    """
+    The compression of an archive, from its file name: "gzip" for .gz, "zstd" for .zst, else None.
+    """
+    if path.endswith(".gz"):
+        return "gzip"
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError("Writing or reading .zst archives needs zstandard: pip install zstandard")
+        return "zstd"
+    return None
+
+
+def compress(data, compression):
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL)
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return data
+
+
+def decompress(data, compression):
+    if compression == "gzip":
+        return gzip.decompress(data)
+    if compression == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def decompressor(compression):
+    if compression == "gzip":
+        return zlib.decompressobj(wbits=31)
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+def scan_lines(file, offset, frame_size):
+    """
+    Split the bytes of an uncompressed archive from offset on into frames of
+    about frame_size bytes, at line ends.
+
+    :return: A (list of [offset, length, record count], end) tuple, end being the
+        end of the last complete line: a line without its newline was torn by a crash.
+    """
+    file.seek(offset)
+    frames = []
+    start = end = offset
+    records = 0
+    for line in iter(file.readline, b""):
+        if not line.endswith(b"\n"):
+            break
+        end += len(line)
+        records += bool(line.strip())
+        if end - start >= frame_size:
+            frames.append([start, end - start, records])
+            start, records = end, 0
+    if end > start:
+        frames.append([start, end - start, records])
+    return frames, end
+
+
+def scan_members(file, offset, compression):
+    """
+    Find the gzip members / zstd frames of a compressed archive from offset on.
+
+    :return: A (list of [offset, length, record count], end) tuple, end being the
+        end of the last complete frame: a frame cut short at the end of the file was torn by a crash.
+    :raises ValueError: If a frame is corrupt, rather than cutting off what follows it.
+    """
+    file.seek(offset)
+    frames = []
+    start = position = offset
+    stream = decompressor(compression)
+    records = 0
+    while True:
+        chunk = file.read(SCAN_CHUNK)
+        if not chunk:
+            return frames, start
+        position += len(chunk)
+        while chunk:
+            try:
+                records += stream.decompress(chunk).count(b"\n")
+            except (zlib.error, zstandard.ZstdError if zstandard else zlib.error) as error:
+                raise ValueError(f"Corrupt frame at byte {start}: {error}") from error
+            if not stream.eof:
+                break
+            chunk = stream.unused_data
+            end = position - len(chunk)
+            frames.append([start, end - start, records])
+            start, records = end, 0
+            stream = decompressor(compression)
+
+
+def read_index(path):
+    """
+    Read the sidecar index of an archive.
+
+    Each line of the index is a JSON list [offset, length, first, count]: a frame
+    of length bytes at offset in the archive, holding records first to first + count - 1.
+
+    :param path: The archive path.
+    :return: A list of [offset, length, first, count], or [] if there is no index.
+    """
+    frames = []
+    try:
+        with open(path + INDEX_SUFFIX, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    frames.append(json.loads(line))
+                except ValueError:
+                    break  # A line torn by a crash ends the index
+    except FileNotFoundError:
+        pass
+    return frames
+
+
+class ArchiveWriter:
+    """
+    Appends records to a JSON Lines archive, one compact record per line.
+
+    Records are written in frames of about FRAME_SIZE bytes. With a .gz or .zst
+    path every frame is compressed on its own, so the archive stays a valid
+    multi-member gzip / multi-frame zstd file (zcat and zstdcat read it whole)
+    and each frame can be decompressed without the ones before it. Every frame
+    is listed in the sidecar index (path + ".idx"), and both files are fsynced
+    at most every FSYNC_INTERVAL seconds.
+
+    Opening an existing archive appends to it. Bytes the index does not list
+    (an archive without index, or frames written just before a crash) are
+    scanned and added to the index; only a frame or line cut short at the end
+    of the file is cut off.
+
+    With a key function, the key of every record (e.g. its event id) is also
+    kept in a sidecar (path + ".ids") and in keys, so resuming a large archive
+    does not have to read it: only records the sidecar misses are read.
+    """
+
+    def __init__(self, path, frame_size=FRAME_SIZE, fsync_interval=FSYNC_INTERVAL, key=None):
+        self.path = path
+        self.key = key
+        self.compression = compression_for(path)
+        self.frame_size = frame_size
+        self.fsync_interval = fsync_interval
+
+        self.frames = read_index(path)
+        self.file = open(path, "a+b")
+        size = self.file.seek(0, os.SEEK_END)
+        # Frames the index lists but the archive lost
+        while self.frames and self.frames[-1][0] + self.frames[-1][1] > size:
+            self.frames.pop()
+        self.end = self.frames[-1][0] + self.frames[-1][1] if self.frames else 0
+        self.count = self.frames[-1][2] + self.frames[-1][3] if self.frames else 0
+        if size != self.end:
+            self.recover(size)
+
+        with open(path + INDEX_SUFFIX, "w", encoding="utf-8") as index:
+            for frame in self.frames:
+                index.write(json.dumps(frame) + "\n")
+        self.index = open(path + INDEX_SUFFIX, "a", encoding="utf-8")
+
+        self.keys = set()
+        self.keys_file = self.open_keys() if key is not None else None
+        self.buffer = []
+        self.buffer_keys = []
+        self.buffered = 0
+        self.buffered_bytes = 0
+        self.synced = time.monotonic()
+
+    def recover(self, size):
+        """
+        Add the frames past the end of the index to it, and cut off a torn one.
+
+        :param size: The size of the archive file.
+        """
+        if self.compression is None:
+            frames, end = scan_lines(self.file, self.end, self.frame_size)
+        else:
+            frames, end = scan_members(self.file, self.end, self.compression)
+        for offset, length, records in frames:
+            self.frames.append([offset, length, self.count, records])
+            self.count += records
+        self.end = end
+        if size != end:
+            print(f"Cutting off {size - end} bytes left half-written at the end of {self.path}")
+            self.file.truncate(end)
+        self.file.seek(end)
+
+    def open_keys(self):
+        """
+        Load the keys sidecar and bring it in line with the index: keys past the
+        last indexed record are dropped, keys it misses are read from the archive.
+
+        :return: The sidecar, open for appending.
+        """
+        keys = []
+        try:
+            with open(self.path + KEYS_SUFFIX, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        keys.append(json.loads(line))
+                    except ValueError:
+                        break  # A line torn by a crash
+        except FileNotFoundError:
+            pass
+        del keys[self.count:]
+        known = len(keys)
+        if known < self.count:
+            keys.extend(self.key(record) for record in ArchiveReader(self.path).read(start=known))
+
+        with open(self.path + KEYS_SUFFIX, "w", encoding="utf-8") as file:
+            file.writelines(json.dumps(key) + "\n" for key in keys)
+        self.keys = set(keys)
+        return open(self.path + KEYS_SUFFIX, "a", encoding="utf-8")
+
+    def write(self, record):
+        """
+        Append one record.
+
+        :param record: A JSON serializable object. A record carrying the bytes it
+            was decoded from (decoder.RawListing) is stored as those bytes.
+        """
+        raw = getattr(record, "raw", None)
+        if raw is None or b"\n" in raw or b"\r" in raw:
+            raw = decoder.dumps(record)
+        line = raw + b"\n"
+        self.buffer.append(line)
+        if self.key is not None:
+            key = self.key(record)
+            self.buffer_keys.append(key)
+            self.keys.add(key)
+        self.buffered += 1
+        self.buffered_bytes += len(line)
+        if self.buffered_bytes >= self.frame_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered records as one frame and add it to the index.
+        """
+        if not self.buffer:
+            return
+
+        data = compress(b"".join(self.buffer), self.compression)
+        self.file.write(data)
+        self.file.flush()
+        if self.keys_file is not None:
+            self.keys_file.writelines(json.dumps(key) + "\n" for key in self.buffer_keys)
+            self.keys_file.flush()
+            self.buffer_keys = []
+        frame = [self.end, len(data), self.count, self.buffered]
+        self.index.write(json.dumps(frame) + "\n")
+        self.index.flush()
+
+        self.frames.append(frame)
+        self.end += len(data)
+        self.count += self.buffered
+        self.buffer = []
+        self.buffered = 0
+        self.buffered_bytes = 0
+
+        if time.monotonic() - self.synced >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        os.fsync(self.index.fileno())
+        if self.keys_file is not None:
+            os.fsync(self.keys_file.fileno())
+        self.synced = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.sync()
+        self.file.close()
+        self.index.close()
+        if self.keys_file is not None:
+            self.keys_file.close()
+
+
+class ArchiveReader:
+    """
+    Reads a JSON Lines archive written by ArchiveWriter one frame at a time,
+    so memory use does not grow with the size of the archive.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.compression = compression_for(path)
+        self.frames = read_index(path)
+
+    def __len__(self):
+        """
+        The number of records listed in the index.
+        """
+        return self.frames[-1][2] + self.frames[-1][3] if self.frames else 0
+
+    def read(self, start=0):
+        """
+        Read records, seeking straight to the frame that holds the start record.
+
+        Archives without an index are read whole, as plain or compressed JSON Lines.
+
+        :param start: The number of the first record to read. (default: 0)
+        :return: A generator of records.
+        """
+        if not self.frames:
+            yield from self.read_unindexed(start)
+            return
+
+        position = max(0, bisect.bisect_right([frame[2] for frame in self.frames], start) - 1)
+        with open(self.path, "rb") as file:
+            for offset, length, first, count in self.frames[position:]:
+                file.seek(offset)
+                lines = [line for line in decompress(file.read(length), self.compression).splitlines() if line.strip()]
+                for line in lines[max(0, start - first):]:
+                    yield decoder.loads(line)
+
+    def read_unindexed(self, start=0):
+        if self.compression == "gzip":
+            file = gzip.open(self.path, "rb")
+        elif self.compression == "zstd":
+            reader = zstandard.ZstdDecompressor().stream_reader(open(self.path, "rb"), read_across_frames=True, closefd=True)
+            file = io.BufferedReader(reader)
+        else:
+            file = open(self.path, "rb")
+        with file:
+            for number, line in enumerate(file):
+                if number >= start and line.strip():
+                    yield decoder.loads(line)
+
+    def __iter__(self):
+        return self.read()
@@ -0,0 +1,203 @@
+import cProfile
+import functools
+import json
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = "ra_scraper"  # Prefix of the exported metric names
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PROFILE_LINES = 25  # Functions printed by profile(), by cumulative time
+
+
+class Histogram:
+    """
+    A latency histogram with fixed buckets, as exported to Prometheus.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one counts values above every bound
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """
+        Estimate a quantile as the upper bound of the bucket holding it.
+
+        :param q: The quantile, between 0 and 1.
+        :return: The estimate in seconds, the largest value seen if above every bound.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Registry:
+    """
+    Stage latency histograms and counters shared by every thread of a run.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+            self.counters = {}
+
+    def cache_hit_ratio(self):
+        hits = self.counters.get("cache_hits", 0)
+        lookups = hits + self.counters.get("cache_misses", 0)
+        return hits / lookups if lookups else None
+
+    def summary(self):
+        """
+        A JSON serializable summary: count, total, mean, p50, p95 and max seconds
+        per stage, every counter and the cache hit ratio.
+        """
+        with self.lock:
+            stages = {
+                stage: {
+                    "count": histogram.count,
+                    "seconds": round(histogram.sum, 6),
+                    "mean": round(histogram.sum / histogram.count, 6) if histogram.count else 0.0,
+                    "p50": round(histogram.quantile(0.5), 6),
+                    "p95": round(histogram.quantile(0.95), 6),
+                    "max": round(histogram.max, 6),
+                }
+                for stage, histogram in sorted(self.stages.items())
+            }
+            counters = dict(sorted(self.counters.items()))
+        return {"stages": stages, "counters": counters, "cache_hit_ratio": self.cache_hit_ratio()}
+
+    def prometheus(self):
+        """
+        The metrics in the Prometheus text exposition format.
+        """
+        lines = [
+            f"# HELP {PREFIX}_stage_seconds Time spent per call of each stage.",
+            f"# TYPE {PREFIX}_stage_seconds histogram",
+        ]
+        with self.lock:
+            for stage, histogram in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+                lines.append(f"{PREFIX}_{name}_total {value}")
+
+        ratio = self.cache_hit_ratio()
+        if ratio is not None:
+            lines.append(f"# TYPE {PREFIX}_cache_hit_ratio gauge")
+            lines.append(f"{PREFIX}_cache_hit_ratio {ratio}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def observe(stage, seconds):
+    registry.observe(stage, seconds)
+
+
+def increment(name, value=1):
+    registry.increment(name, value)
+
+
+@contextmanager
+def timer(stage):
+    """
+    Time the block and add it to the stage's histogram, also when it raises.
+
+    :param stage: The stage name, e.g. "http_request".
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(stage, time.perf_counter() - start)
+
+
+def timed(stage):
+    """
+    Decorator timing every call of a function as the given stage.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def export(path):
+    """
+    Write the metrics of the run: Prometheus text for a .prom or .txt path
+    (e.g. for the node_exporter textfile collector), a JSON summary otherwise.
+
+    :param path: The output file.
+    """
+    with open(path, "w", encoding="utf-8") as file:
+        if path.endswith((".prom", ".txt")):
+            file.write(registry.prometheus())
+        else:
+            json.dump(registry.summary(), file, indent=4)
+
+
+@contextmanager
+def profile(path=None):
+    """
+    Run the block under cProfile and print the functions taking the most
+    cumulative time. Before Python 3.12 cProfile only sees the calling
+    thread, i.e. parsing, name cleaning and the sinks of a scrape; the fetch
+    threads then only show up in the stage timings.
+
+    :param path: Also save the raw stats here, for snakeviz or pstats. (default: None)
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if path:
+            profiler.dump_stats(path)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(PROFILE_LINES)
@@ -0,0 +1,242 @@
+import sys
+import threading
+from collections import OrderedDict
+
+CACHE_SIZE = 10000  # Venues, genres and artists each kept by a ListingParser for reuse
+
+
+def _text(value):
+    """Interned string for repeated values, '' for missing ones."""
+    if value is None:
+        return ''
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Genre:
+    __slots__ = ('name', 'slug')
+
+    def __init__(self, name, slug):
+        self.name = name
+        self.slug = slug
+
+    def __repr__(self):
+        return f"Genre({self.name!r})"
+
+
+class Venue:
+    __slots__ = ('id', 'name', 'address', 'content_url', 'live')
+
+    def __init__(self, id, name, address, content_url, live):
+        self.id = id
+        self.name = name
+        self.address = address
+        self.content_url = content_url
+        self.live = live
+
+    def __repr__(self):
+        return f"Venue({self.id!r}, {self.name!r})"
+
+
+class Artist:
+    __slots__ = (
+        'id', 'country_id', 'name', 'first_name', 'last_name', 'aliases',
+        'facebook', 'instagram', 'twitter', 'soundcloud', 'discogs', 'bandcamp', 'website',
+    )
+
+    def __init__(self, id, country_id, name, first_name, last_name, aliases,
+                 facebook, instagram, twitter, soundcloud, discogs, bandcamp, website):
+        self.id = id
+        self.country_id = country_id
+        self.name = name
+        self.first_name = first_name
+        self.last_name = last_name
+        self.aliases = aliases
+        self.facebook = facebook
+        self.instagram = instagram
+        self.twitter = twitter
+        self.soundcloud = soundcloud
+        self.discogs = discogs
+        self.bandcamp = bandcamp
+        self.website = website
+
+    def __repr__(self):
+        return f"Artist({self.id!r}, {self.name!r})"
+
+
+class Event:
+    __slots__ = (
+        'id', 'listing_id', 'listing_date', 'title', 'date', 'start_time', 'end_time',
+        'cost', 'attending', 'content_url', 'is_ticketed', 'venue', 'artists', 'genres',
+        'lineup', 'raw',
+    )
+
+    def __init__(self, id, listing_id, listing_date, title, date, start_time, end_time,
+                 cost, attending, content_url, is_ticketed, venue, artists, genres, raw=None):
+        self.id = id
+        self.listing_id = listing_id
+        self.listing_date = listing_date
+        self.title = title
+        self.date = date
+        self.start_time = start_time
+        self.end_time = end_time
+        self.cost = cost
+        self.attending = attending
+        self.content_url = content_url
+        self.is_ticketed = is_ticketed
+        self.venue = venue
+        self.artists = artists
+        self.genres = genres
+        self.lineup = ', '.join(artist.name for artist in artists)
+        self.raw = raw
+
+    def __repr__(self):
+        return f"Event({self.id!r}, {self.title!r})"
+
+
+EMPTY_VENUE = Venue('', '', '', '', None)
+
+
+class ModelCache:
+    """
+    The models last built, by key: a least recently used map holding at most
+    max_size of them, safe to share between threads.
+    """
+
+    def __init__(self, max_size=CACHE_SIZE):
+        self.max_size = max_size
+        self.models = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.models)
+
+    def get(self, key):
+        with self.lock:
+            model = self.models.get(key)
+            if model is not None:
+                self.models.move_to_end(key)
+            return model
+
+    def add(self, key, model):
+        """
+        Keep a model, evicting the least recently used one when full.
+
+        :return: The model kept for the key, which another thread may have added first.
+        """
+        with self.lock:
+            model = self.models.setdefault(key, model)
+            self.models.move_to_end(key)
+            if len(self.models) > self.max_size:
+                self.models.popitem(last=False)
+            return model
+
+
+class ListingParser:
+    """
+    Builds the model of each event listing in a single pass. Venues, genres
+    and artists are shared between events by id, and their strings are
+    interned, so a venue or resident DJ seen in hundreds of events is kept once.
+    At most cache_size of each are remembered, so a long run does not keep
+    every venue and artist it ever saw.
+    """
+
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.venues = ModelCache(cache_size)
+        self.genres = ModelCache(cache_size)
+        self.artists = ModelCache(cache_size)
+
+    def venue(self, data):
+        if not data:
+            return EMPTY_VENUE
+        # Without an id, only the address tells apart venues sharing a name such as "Secret Location"
+        key = data.get('id') or (data.get('name'), data.get('address'))
+        venue = self.venues.get(key)
+        if venue is None:
+            venue = self.venues.add(key, Venue(
+                _text(data.get('id')),
+                _text(data.get('name')),
+                _text(data.get('address')),
+                _text(data.get('contentUrl')),
+                data.get('live'),
+            ))
+        return venue
+
+    def genre(self, data):
+        key = data.get('slug') or data.get('name')
+        genre = self.genres.get(key)
+        if genre is None:
+            genre = self.genres.add(key, Genre(_text(data.get('name')), _text(data.get('slug'))))
+        return genre
+
+    def artist(self, data):
+        key = data.get('id') or data.get('name')
+        artist = self.artists.get(key)
+        if artist is None:
+            artist = self.artists.add(key, Artist(
+                _text(data.get('id')),
+                _text(data.get('countryId')),
+                _text(data.get('name')),
+                _text(data.get('firstName')),
+                _text(data.get('lastName')),
+                tuple(data.get('aliases') or ()),
+                data.get('facebook') or '',
+                data.get('instagram') or '',
+                data.get('twitter') or '',
+                data.get('soundcloud') or '',
+                data.get('discogs') or '',
+                data.get('bandcamp') or '',
+                data.get('website') or '',
+            ))
+        return artist
+
+    def parse(self, listing, keep_raw=False):
+        """
+        Build the Event of one event listing.
+
+        :param listing: An event listing as returned by the API.
+        :param keep_raw: Keep a reference to the listing dict in Event.raw. (default: False)
+        :return: The Event, or None if the listing has no event.
+        """
+        data = listing.get('event')
+        if not data:
+            return None
+
+        return Event(
+            data.get('id'),
+            listing.get('id'),
+            listing.get('listingDate') or '',
+            data.get('title') or '',
+            data.get('date') or '',
+            data.get('startTime') or '',
+            data.get('endTime') or '',
+            data.get('cost') or '',
+            data.get('attending', ''),
+            data.get('contentUrl') or '',
+            data.get('isTicketed'),
+            self.venue(data.get('venue')),
+            tuple(self.artist(artist) for artist in data.get('artists') or ()),
+            tuple(self.genre(genre) for genre in data.get('genres') or ()),
+            listing if keep_raw else None,
+        )
+
+
+parser = ListingParser()
+
+
+def parse_events(events, keep_raw=False):
+    """
+    Turn event listings into Events. Events that are already parsed are
+    passed through, so every sink accepts either.
+
+    :param events: An iterable of event listings or Events.
+    :param keep_raw: Keep the listing dicts in Event.raw. (default: False)
+    :return: A list of Events.
+    """
+    parsed = []
+    for event in events:
+        if not isinstance(event, Event):
+            event = parser.parse(event, keep_raw)
+            if event is None:
+                continue
+        parsed.append(event)
+    return parsed
@@ -0,0 +1,139 @@
+import math
+import re
+from functools import lru_cache
+
+CACHE_SIZE = 65536  # Distinct lineup strings remembered by normalize_name
+
+NEWLINES = str.maketrans({'\n': ','})
+
+ROOM = re.compile(r'\broom|ROOM\b')
+TBA = re.compile(r'\bTBA|tba\b')
+# Whole words only, so dropping one can never create or break a match of another
+WORDS = re.compile(r'\b(?:Friends|friends|opening|Opening|OPENING|closing|Closing|CLOSING)\b')
+RESIDENTS = re.compile(r'\bResidents|residents\b')
+RESIDENT = re.compile(r'\bResident|resident\b')
+HOURS = [
+    re.compile(r'\b\d\d\s\-\d\d\b'),
+    re.compile(r'\b\d\d\-\d\d\b'),
+    re.compile(r'\b\d\d\-\s\d\d\b'),
+]
+UNDERSCORES = re.compile(r'_{2}[a-zA-Z]*_{2}')
+# (...) first, so live or & inside it are swallowed exactly as when run one after the other
+SEPARATORS = re.compile(r'\(.*?\)|\blive|LIVE|Live\b|&')
+BRACKETS = re.compile(r'\[.*?\]')
+PREFIXES = re.compile(r'[\s\w]+\:')
+COMMA_RUNS = re.compile(r',{2,}')
+TWO_DIGITS = re.compile(r'\b\d{2}\b')
+# None of these can be created or broken by replacing another one with a comma
+B2B = re.compile(r'\bb2b|B2B\b|w/|\+')
+
+
+def _collapse_commas(match):
+    # Two passes of ",," -> "," turn a run of n commas into ceil(n / 4) commas
+    return ',' * math.ceil(len(match.group()) / 4)
+
+
+def _normalize(name):
+    # Every pass is guarded by a substring test for text its pattern needs,
+    # so the regex only runs on the few names it can change.
+    if '\n' in name:
+        name = name.translate(NEWLINES)
+    if 'room' in name or 'ROOM' in name:
+        name = ROOM.sub('room:,', name)
+    if '\xa0' in name:
+        name = name.replace('\xa0', '')
+    if 'TBA' in name or 'tba' in name:
+        name = TBA.sub('', name)
+    if 'noch nicht fetsgelegt' in name:
+        name = name.replace('noch nicht fetsgelegt', '')
+    if 'riends' in name or 'pening' in name or 'PENING' in name or 'losing' in name or 'LOSING' in name:
+        name = WORDS.sub('', name)
+    if 'esidents' in name:
+        name = RESIDENTS.sub('', name)
+    if 'esident' in name:
+        name = RESIDENT.sub('', name)
+    if '-' in name:
+        for hours in HOURS:
+            name = hours.sub('', name)
+    if '__' in name:
+        name = UNDERSCORES.sub('', name)
+    if '(' in name or '&' in name or 'ive' in name or 'IVE' in name:
+        name = SEPARATORS.sub(',', name)
+    if '[' in name:
+        name = BRACKETS.sub('', name)
+    if ':' in name:
+        name = PREFIXES.sub('', name)
+    if '//' in name:
+        name = name.replace('//', ',')
+    if ',,' in name:
+        name = COMMA_RUNS.sub(_collapse_commas, name)
+    if "''," in name:
+        name = name.replace("'',", '')
+
+    if name.startswith(','):
+        name = name[1:]
+    if name[:1].isspace():
+        name = name[1:]
+    if name[-1:].isspace():
+        name = name[:-1]
+
+    if any(character.isdigit() for character in name):
+        name = TWO_DIGITS.sub('', name)
+    if '2' in name or 'w/' in name or '+' in name:
+        name = B2B.sub(',', name)
+
+    end = len(name)
+    while end and (name[end - 1] == ',' or name[end - 1].isspace()):
+        end -= 1
+    name = name[:end]
+
+    if name.startswith('@'):
+        name = name[1:]
+    return name
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def normalize_name(name):
+    """
+    Clean unwanted words and icons from a scraped name or lineup string.
+
+    Same rules, in the same order, as the original sequence of ~35 re.sub
+    calls, but precompiled, with rules that cannot interfere with each other
+    merged into one alternation or a plain str method, and every pass
+    skipped unless the name contains text it could match. Results are
+    memoized, as the same lineups come back across events.
+    bench_name_cleaner.py checks the output against the original rules.
+
+    :param name: The raw name.
+    :return: The cleaned string, artists separated by commas.
+    """
+    return _normalize(name)
+
+
+def clean_name(name):
+    """
+    normalize_name for any value: None and NaN (e.g. from pandas) give ''.
+    """
+    if name is None or name != name:
+        return ''
+    return normalize_name(name)
+
+
+def split_artists(name):
+    """
+    Clean a lineup string and split it into artist names.
+
+    :param name: The raw lineup string.
+    :return: A list of non-empty, stripped artist names.
+    """
+    return [artist.strip() for artist in clean_name(name).split(',') if artist.strip()]
+
+
+def split_artists_many(names):
+    """
+    Batch version of split_artists. Repeated lineup strings are only cleaned once.
+
+    :param names: An iterable of raw lineup strings.
+    :return: A list with one list of artist names per input.
+    """
+    return [split_artists(name) for name in names]
@@ -0,0 +1,244 @@
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import artist_index
+import batch_query
+import decoder
+import fingerprints
+import http_client
+import metrics
+import query_compiler
+import ratelimit
+import response_cache
+from event_fetcher import BATCH_SIZE, CONCURRENCY, MAX_SHARD_RESULTS, QUEUE_SIZE, EventFetcher
+from utils import MAX_CONNECTIONS, close_pool, configure_pool
+
+CITIES_PATH = "cities.txt"
+WORKERS = 4  # Areas scraped at the same time
+
+
+def read_areas(path=CITIES_PATH):
+    """
+    Read the "City - code" lines of cities.txt and drop duplicate codes, as
+    many cities and regions share one RA area.
+
+    :param path: The file to read.
+    :return: A dict of area code -> the names listed for it, in file order.
+        Lines without a numeric code (e.g. "None") are skipped.
+    """
+    areas = {}
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            name, separator, code = line.strip().rpartition(" - ")
+            if not separator or not code.isdigit():
+                continue
+            areas.setdefault(int(code), []).append(name)
+    return areas
+
+
+class Orchestrator:
+    """
+    Scrapes many areas in one process: a pool of workers takes areas one at a
+    time, each area streaming its pages through its own sinks. All requests
+    share one connection pool and the per-host rate limiter, so the rate is
+    a budget for the whole run, not per area.
+    """
+
+    def __init__(self, areas, start_date, end_date, workers=WORKERS, concurrency=CONCURRENCY,
+                 max_results=MAX_SHARD_RESULTS, queue_size=QUEUE_SIZE, incremental=False,
+                 postgres=True, batch_size=BATCH_SIZE, jsonl_dir=None, columnar_dir=None, store_path=None,
+                 overwrite=False):
+        self.areas = areas
+        self.start_date = start_date
+        self.end_date = end_date
+        self.workers = workers
+        self.concurrency = concurrency
+        self.max_results = max_results
+        self.queue_size = queue_size
+        self.incremental = incremental
+        self.postgres = postgres
+        self.batch_size = batch_size
+        self.jsonl_dir = jsonl_dir
+        self.columnar_dir = columnar_dir
+        self.store_path = store_path
+        self.overwrite = overwrite
+        self.lock = threading.Lock()
+        self.done = 0
+        self.failures = {}
+
+    def sinks(self, area):
+        """
+        The sinks of one area: postgres, a JSON Lines archive per area, the
+        shared columnar tables and the shared local store, as configured.
+
+        :param area: The area code.
+        :return: A list of sinks.
+        """
+        import pipeline
+
+        sinks = []
+        if self.jsonl_dir:
+            sinks.append(pipeline.JsonLinesSink(os.path.join(self.jsonl_dir, f"area_{area}.jsonl.gz"), resume=not self.overwrite))
+        if self.columnar_dir:
+            from columnar_export import ColumnarSink
+            sinks.append(ColumnarSink(self.columnar_dir, area))
+        if self.store_path:
+            from event_store import StoreSink
+            sinks.append(StoreSink(self.store_path, area))
+        if self.postgres:
+            event_fetcher = EventFetcher(area, f"{self.start_date}T00:00:00.000Z", f"{self.end_date}T23:59:59.999Z")
+            sinks.append(pipeline.PostgresSink(event_fetcher, self.batch_size))
+        return sinks
+
+    def scrape_area(self, area):
+        """
+        Stream every event of one area into its sinks.
+
+        :param area: The area code.
+        :return: The number of events stored.
+        """
+        # Imported here because sharding, incremental and pipeline build on EventFetcher
+        import pipeline
+        from incremental import IncrementalScrape
+        from sharding import ShardPlanner
+
+        if self.incremental:
+            scrape = IncrementalScrape(area)
+            pages = scrape.iter_changed_pages(self.start_date, self.end_date, self.max_results, self.concurrency, self.queue_size)
+        else:
+            planner = ShardPlanner(area, self.start_date, self.end_date, self.max_results, self.concurrency)
+            pages = planner.iter_pages(self.queue_size)
+
+        with metrics.timer("area"):
+            count = pipeline.run(pipeline.unique_events(pages), self.sinks(area))
+
+        if self.incremental:
+            scrape.save()
+        return count
+
+    def report(self, area, started, count=None, error=None):
+        with self.lock:
+            self.done += 1
+            progress = f"[{self.done}/{len(self.areas)}] {', '.join(self.areas[area][:2])} ({area})"
+            if error is None:
+                print(f"{progress}: {count} events in {time.monotonic() - started:.1f}s")
+            else:
+                self.failures[area] = error
+                print(f"{progress}: failed after {time.monotonic() - started:.1f}s: {error}")
+
+    def run_area(self, area):
+        started = time.monotonic()
+        try:
+            count = self.scrape_area(area)
+        except Exception as error:
+            self.report(area, started, error=error)
+            return 0
+        self.report(area, started, count)
+        return count
+
+    def run(self):
+        """
+        Scrape every area. A failing area is reported and does not stop the others.
+
+        :return: The total number of events stored.
+        """
+        total = 0
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        futures = [executor.submit(self.run_area, area) for area in self.areas]
+        try:
+            for future in as_completed(futures):
+                total += future.result()
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+            raise
+        finally:
+            executor.shutdown(wait=False)
+        return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scrape every area listed in cities.txt in one process.")
+    parser.add_argument("start_date", type=str, help="The start date for event listings (inclusive, format: YYYY-MM-DD).")
+    parser.add_argument("end_date", type=str, help="The end date for event listings (inclusive, format: YYYY-MM-DD).")
+    parser.add_argument("-f", "--cities", type=str, default=CITIES_PATH, help=f"File of 'City - code' lines (default: {CITIES_PATH}).")
+    parser.add_argument("-a", "--areas", type=int, nargs="+", help="Only scrape these area codes.")
+    parser.add_argument("-w", "--workers", type=int, default=WORKERS, help=f"Areas scraped at the same time (default: {WORKERS}).")
+    parser.add_argument("-c", "--concurrency", type=int, default=CONCURRENCY, help=f"Pages fetched at the same time per area (default: {CONCURRENCY}).")
+    parser.add_argument("-r", "--rate", type=float, default=ratelimit.RATE, help=f"Maximum requests per second sent to ra.co, shared by all areas (default: {ratelimit.RATE}).")
+    parser.add_argument("-s", "--max-shard-results", type=int, default=MAX_SHARD_RESULTS, help=f"As for event_fetcher.py (default: {MAX_SHARD_RESULTS}).")
+    parser.add_argument("-i", "--incremental", action="store_true", help="As for event_fetcher.py, with one watermark per area.")
+    parser.add_argument("-b", "--batch-size", type=int, default=BATCH_SIZE, help=f"Rows sent to postgres per INSERT statement (default: {BATCH_SIZE}).")
+    parser.add_argument("-p", "--page-batch", type=int, default=batch_query.BATCH_SIZE, help=f"Pages of all areas sent per request, 1 for one request per page (default: {batch_query.BATCH_SIZE}).")
+    parser.add_argument("-q", "--queue-size", type=int, default=QUEUE_SIZE, help=f"Pages buffered per area between the fetchers and the sinks (default: {QUEUE_SIZE}).")
+    parser.add_argument("--no-cache", action="store_true", help="Always fetch from ra.co instead of reusing cached responses.")
+    parser.add_argument("--jsonl-dir", type=str, help="Also write each area to DIR/area_<code>.jsonl.gz.")
+    parser.add_argument("--overwrite", action="store_true", help="Replace the archives of --jsonl-dir instead of appending the events not already in them.")
+    parser.add_argument("--columnar", type=str, help="Also write the columnar tables of every area to this directory (needs pyarrow).")
+    parser.add_argument("--store", type=str, help="Also upsert the events of every area into this local SQLite store, e.g. events.sqlite3.")
+    parser.add_argument("--artist-index", type=str, default=artist_index.INDEX_PATH, help=f"As for event_fetcher.py (default: {artist_index.INDEX_PATH}).")
+    parser.add_argument("--no-artist-index", action="store_true", help="As for event_fetcher.py.")
+    parser.add_argument("--fingerprints", type=str, default=fingerprints.INDEX_PATH, help=f"As for event_fetcher.py (default: {fingerprints.INDEX_PATH}).")
+    parser.add_argument("--no-fingerprints", action="store_true", help="As for event_fetcher.py.")
+    parser.add_argument("--no-postgres", action="store_true", help="Do not store the events in postgres.")
+    parser.add_argument("--json-backend", choices=decoder.BACKENDS, help="Library decoding the responses, as for event_fetcher.py.")
+    parser.add_argument("--metrics", type=str, help="Write stage timings and counters at the end of the run, as for event_fetcher.py.")
+    args = parser.parse_args()
+
+    areas = read_areas(args.cities)
+    if args.areas:
+        areas = {area: areas.get(area, [str(area)]) for area in dict.fromkeys(args.areas)}
+    print(f"Scraping {len(areas)} area(s) with {args.workers} worker(s) at {args.rate} requests/s")
+
+    ratelimit.configure(rate=args.rate)
+    http_client.configure(pool_size=max(args.workers * args.concurrency, http_client.POOL_SIZE))
+    configure_pool(max(args.workers, MAX_CONNECTIONS))
+    response_cache.configure(enabled=not args.no_cache)
+    batch_query.configure(args.page_batch)
+    artist_index.configure(args.artist_index, enabled=not (args.no_artist_index or args.no_postgres))
+    fingerprints.configure(args.fingerprints, enabled=not (args.no_fingerprints or args.no_postgres))
+    if args.jsonl_dir:
+        os.makedirs(args.jsonl_dir, exist_ok=True)
+
+    # Only request the fields the sinks read
+    import pipeline
+    sink_types = [] if args.no_postgres else [pipeline.PostgresSink]
+    if args.jsonl_dir:
+        sink_types.append(pipeline.JsonLinesSink)
+    if args.columnar:
+        from columnar_export import ColumnarSink
+        sink_types.append(ColumnarSink)
+    if args.store:
+        from event_store import StoreSink
+        sink_types.append(StoreSink)
+    query_compiler.configure(query_compiler.required_fields(sink_types))
+    decoder.configure(args.json_backend, keep_raw=any(sink.needs_raw for sink in sink_types))
+
+    orchestrator = Orchestrator(
+        areas, args.start_date, args.end_date,
+        workers=args.workers, concurrency=args.concurrency, max_results=args.max_shard_results,
+        queue_size=args.queue_size, incremental=args.incremental,
+        postgres=not args.no_postgres, batch_size=args.batch_size,
+        jsonl_dir=args.jsonl_dir, columnar_dir=args.columnar, store_path=args.store,
+        overwrite=args.overwrite,
+    )
+    started = time.monotonic()
+    total = orchestrator.run()
+    close_pool()
+    if args.metrics:
+        metrics.export(args.metrics)
+
+    print(f"Stored {total} events from {len(areas) - len(orchestrator.failures)} area(s) in {time.monotonic() - started:.0f}s")
+    if orchestrator.failures:
+        print(f"{len(orchestrator.failures)} area(s) failed:")
+        for area, error in orchestrator.failures.items():
+            print(f"  {area} ({', '.join(areas[area][:2])}): {error}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+import csv
+import os
+import queue
+import threading
+
+from event_fetcher import BATCH_SIZE, CONCURRENCY, CSV_HEADER, QUEUE_SIZE, EventFetcher
+import fingerprints
+import metrics
+from jsonl_archive import FRAME_SIZE, INDEX_SUFFIX, KEYS_SUFFIX, ArchiveWriter
+from models import parse_events
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+def produce(sources, concurrency=CONCURRENCY, queue_size=QUEUE_SIZE):
+    """
+    Run page sources on worker threads and yield their pages as they arrive.
+
+    The queue between the workers and the consumer holds at most queue_size
+    pages: when the sinks fall behind, the workers block instead of piling
+    pages up in memory. An error in a worker is raised in the consumer, and a
+    consumer that stops early makes the workers stop too.
+
+    :param sources: A list of callables, each returning an iterator of pages.
+    :param concurrency: The number of worker threads.
+    :param queue_size: The number of pages buffered.
+    :return: A generator of pages, in arrival order.
+    """
+    pages = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    pending = list(sources)
+    lock = threading.Lock()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def work():
+        while not stop.is_set():
+            with lock:
+                if not pending:
+                    break
+                source = pending.pop(0)
+            try:
+                for page in source():
+                    if not put(page):
+                        return
+            except Exception as error:
+                put(_Failure(error))
+                return
+        put(_DONE)
+
+    workers = [threading.Thread(target=work, daemon=True) for _ in range(max(1, min(concurrency, len(pending))))]
+    for worker in workers:
+        worker.start()
+
+    try:
+        running = len(workers)
+        while running:
+            item = pages.get()
+            if item is _DONE:
+                running -= 1
+            elif isinstance(item, _Failure):
+                raise item.error
+            else:
+                yield item
+    finally:
+        stop.set()
+
+
+def event_id(event):
+    """
+    The RA event id of an event listing.
+    """
+    return event.get("event", {}).get("id") or event.get("id")
+
+
+def unique_events(pages, seen=None):
+    """
+    Drop event listings without an event, and events already seen.
+
+    :param pages: An iterable of event lists.
+    :param seen: A set of event ids already seen. (default: an empty set)
+    :return: A generator of non-empty event lists.
+    """
+    seen = set() if seen is None else seen
+    for events in pages:
+        unique = []
+        for event in events:
+            if not event.get("event"):
+                continue
+            key = event_id(event)
+            if key in seen:
+                continue
+            seen.add(key)
+            unique.append(event)
+        if unique:
+            yield unique
+
+
+def run(pages, sinks):
+    """
+    Parse every page once into Events and hand it to every sink as it
+    arrives, then close the sinks. The listing dicts are only kept on the
+    Events when a sink needs them (needs_raw).
+
+    :param pages: An iterable of event lists.
+    :param sinks: A list of sinks.
+    :return: The number of events written.
+    :raises RuntimeError: If a sink failed to store some events (its failed count), so
+        callers do not save incremental state that would skip those events next time.
+    """
+    keep_raw = any(sink.needs_raw for sink in sinks)
+    count = 0
+    try:
+        for events in pages:
+            with metrics.timer("parse"):
+                events = parse_events(events, keep_raw)
+            for sink in sinks:
+                with metrics.timer(f"sink_{type(sink).__name__}"):
+                    sink.write(events)
+            count += len(events)
+    finally:
+        for sink in sinks:
+            with metrics.timer(f"sink_{type(sink).__name__}"):
+                sink.close()
+
+    failures = [f"{type(sink).__name__} failed to store {sink.failed} events"
+                for sink in sinks if getattr(sink, "failed", 0)]
+    if failures:
+        raise RuntimeError("; ".join(failures))
+    return count
+
+
+class CsvSink:
+    """
+    Writes events to a CSV file, one row per artist, as they arrive.
+    """
+    needs_raw = False
+    fields = (
+        "event { id title date startTime endTime contentUrl attending genres { name } venue { id name } "
+        "artists { id countryId name firstName lastName facebook instagram twitter soundcloud discogs bandcamp website } }"
+    )
+
+    def __init__(self, output_file="events.csv"):
+        self.file = open(output_file, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(CSV_HEADER)
+
+    def write(self, events):
+        self.writer.writerows(EventFetcher.csv_rows(events))
+
+    def close(self):
+        self.file.close()
+
+
+class JsonLinesSink:
+    """
+    Appends events to a JSON Lines archive, one compact event per line, as
+    they arrive (see jsonl_archive.py). A .gz or .zst path compresses it.
+
+    An existing archive is kept and events already in it are skipped, so a
+    run can be repeated or restarted after a crash; their ids come from the
+    archive's .ids sidecar, not from reading the archive. Without resume it is replaced.
+    """
+    needs_raw = True
+    fields = None  # The archive keeps whole listings
+
+    def __init__(self, output_file="events.jsonl", resume=True, frame_size=FRAME_SIZE):
+        if not resume:
+            for path in (output_file, output_file + INDEX_SUFFIX, output_file + KEYS_SUFFIX):
+                if os.path.exists(path):
+                    os.remove(path)
+        # The events seen are the ones the writer kept after its recovery
+        self.archive = ArchiveWriter(output_file, frame_size, key=event_id)
+        self.seen = self.archive.keys
+
+    def write(self, events):
+        for event in events:
+            if event.id in self.seen:
+                continue
+            self.archive.write(event.raw)
+
+    def close(self):
+        self.archive.close()
+
+
+class PostgresSink:
+    """
+    Stores events, their artists and their genres in postgres, batch_size events at a time.
+    Events whose fingerprint is unchanged since they were last written are
+    skipped (see fingerprints.py), and changed ones are upserted by RA event id.
+    """
+    needs_raw = False
+    fields = (
+        "event { title date startTime endTime attending cost genres { name slug } venue { id name address } "
+        "artists { id name aliases facebook instagram soundcloud discogs bandcamp website } }"
+    )
+
+    def __init__(self, event_fetcher, batch_size=BATCH_SIZE):
+        self.event_fetcher = event_fetcher
+        self.batch_size = batch_size
+        self.buffer = []
+        self.rows = 0
+        self.unchanged = 0
+        self.failed = 0  # Events of batches postgres did not fully store
+
+    def write(self, events):
+        self.buffer.extend(events)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        events, self.buffer = parse_events(self.buffer), []
+
+        index = fingerprints.get_index()
+        digests = None
+        if index is not None:
+            with metrics.timer("fingerprint"):
+                total = len(events)
+                events, digests = index.changed(events)
+            self.unchanged += total - len(events)
+            if not events:
+                return
+
+        failed_rows = self.event_fetcher.failed_rows
+        self.rows += self.event_fetcher.save_events_to_postgres(events, self.batch_size)
+        self.rows += self.event_fetcher.save_artists_to_postgres(events, self.batch_size)
+        self.rows += self.event_fetcher.save_genres_to_postgres(events, self.batch_size)
+
+        # Only remembered once everything is stored, so a failed batch is sent again next run;
+        # rows postgres rejected (dropped_rows) would be rejected again, so they do not count
+        if self.event_fetcher.failed_rows > failed_rows:
+            self.failed += len(events)
+        elif digests is not None:
+            index.record(digests)
+
+    def close(self):
+        self.flush()
+        if self.unchanged:
+            print(f"Skipped {self.unchanged} unchanged events.")
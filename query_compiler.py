@@ -0,0 +1,263 @@
+import hashlib
+import json
+import re
+import threading
+from functools import lru_cache
+
+import requests
+
+import response_cache
+
+QUERY_TEMPLATE_PATH = "graphql_query_template.json"
+SCHEMA_PATH = "graphql_schema.txt"
+ROOT_TYPE = "EventListings"  # Type returned by the eventListings field
+# Object type of the fields that have a selection of their own
+NESTED_TYPES = {
+    "data": "EventListing",
+    "event": "Event",
+    "venue": "Venue",
+    "artists": "Artist",
+    "genres": "Genre",
+    "images": "EventImage",
+    "pick": "EventPick",
+}
+# Always requested: ids for de-duplication, dates for sharding and incremental state
+BASE_FIELDS = "id listingDate event { id date }"
+PERSISTED_QUERY_VERSION = 1
+
+_fields = None  # Selection of each event listing, None for the full template query
+_persisted = False
+_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def load_template(path=QUERY_TEMPLATE_PATH):
+    """
+    The query template, read once per process. Callers must not modify it.
+    """
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+@lru_cache(maxsize=None)
+def load_schema(path=SCHEMA_PATH):
+    """
+    Read the field names of every type from the output of get_schema.py.
+
+    :param path: The schema file.
+    :return: A dict of type name -> set of field names.
+    """
+    types = {}
+    fields = None
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.startswith("Type: "):
+                fields = types.setdefault(line[len("Type: "):].split(" - ")[0].strip(), set())
+            elif line.startswith("  - ") and fields is not None:
+                fields.add(line[len("  - "):].split(" - ")[0].strip())
+    return types
+
+
+def parse_selection(selection):
+    """
+    Parse a GraphQL selection such as "id event { title venue { name } }".
+
+    :param selection: The fields, without the outer braces.
+    :return: A dict of field name -> dict of its own fields ({} for a leaf).
+    """
+    tokens = re.findall(r"[A-Za-z_][A-Za-z0-9_]*|[{}]", selection)
+    position = 0
+
+    def parse_fields():
+        nonlocal position
+        fields = {}
+        last = None
+        while position < len(tokens):
+            token = tokens[position]
+            position += 1
+            if token == "{":
+                if last is None:
+                    raise ValueError(f"Selection without a field in: {selection}")
+                merge_into(fields[last], parse_fields())
+            elif token == "}":
+                return fields
+            else:
+                fields.setdefault(token, {})
+                last = token
+        return fields
+
+    return parse_fields()
+
+
+def merge_into(fields, other):
+    """
+    Add the fields of other to fields, recursively.
+    """
+    for name, children in other.items():
+        merge_into(fields.setdefault(name, {}), children)
+    return fields
+
+
+def render(fields):
+    """
+    The selection text of parsed fields, in a canonical (sorted) order.
+    """
+    parts = []
+    for name in sorted(fields):
+        parts.append(f"{name} {{{render(fields[name])}}}" if fields[name] else name)
+    return " ".join(parts)
+
+
+def validate(fields, type_name, schema=None, path=""):
+    """
+    Check that every field exists on its type in graphql_schema.txt.
+
+    :param fields: Parsed fields, see parse_selection.
+    :param type_name: The type the fields are selected on.
+    :raises ValueError: On the first unknown field.
+    """
+    schema = load_schema() if schema is None else schema
+    known = schema.get(type_name)
+    if known is None:
+        return
+    for name, children in fields.items():
+        if name != "__typename" and name not in known:
+            raise ValueError(f"{type_name} has no field {name!r} ({path + name})")
+        if children:
+            validate(children, NESTED_TYPES.get(name), schema, f"{path}{name}.")
+
+
+def required_fields(sinks):
+    """
+    The listing fields a set of sinks reads, from their fields attribute.
+
+    :param sinks: Sinks or sink classes. A sink without fields (or with None) needs the full query.
+    :return: The merged selection text, or None for the full query.
+    """
+    fields = parse_selection(BASE_FIELDS)
+    for sink in sinks:
+        sink_fields = getattr(sink, "fields", None)
+        if sink_fields is None:
+            return None
+        merge_into(fields, parse_selection(sink_fields))
+    return render(fields)
+
+
+@lru_cache(maxsize=64)
+def compile_query(selection):
+    """
+    Build the GET_EVENT_LISTINGS document requesting only the given fields of
+    each listing, checked against the schema. Compiled documents are cached.
+
+    :param selection: The listing fields, see parse_selection; None for the template query.
+    :return: A (query, sha256 hex digest of the query) tuple.
+    """
+    query = load_template()["query"]
+    if selection is not None:
+        fields = parse_selection(selection)
+        validate({"data": fields, "totalResults": {}}, ROOT_TYPE)
+
+        start = query.index("{", query.index(")", query.index("eventListings(")))
+        query = f"{query[:start]}{{data {{{render(fields)}}} totalResults}}}}"
+    return query, hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+
+def configure(fields=None, persisted=False):
+    """
+    Set the fields requested by every listing payload built afterwards.
+
+    :param fields: The listing fields, e.g. from required_fields; None for the full template query.
+    :param persisted: Send persisted-query hashes instead of the query text, falling
+        back to the full text when the server does not know or support them.
+    :raises ValueError: If a field is not in the schema.
+    """
+    global _fields, _persisted
+    compile_query(fields)
+    with _lock:
+        _fields = fields
+        _persisted = persisted
+
+
+def listing_payload(areas, listing_date_gte, listing_date_lte, page=None):
+    """
+    A new GET_EVENT_LISTINGS payload with the configured fields.
+
+    :param areas: The area code to filter events.
+    :param listing_date_gte: The start date for event listings (inclusive).
+    :param listing_date_lte: The end date for event listings (inclusive).
+    :param page: The page number. (default: the template's)
+    :return: The payload.
+    """
+    template = load_template()
+    template_variables = template["variables"]
+    query, _ = compile_query(_fields)
+    return {
+        "operationName": template["operationName"],
+        "variables": {
+            "filters": {
+                "areas": {"eq": areas},
+                "listingDate": {"gte": listing_date_gte, "lte": listing_date_lte},
+            },
+            "filterOptions": dict(template_variables["filterOptions"]),
+            "pageSize": template_variables["pageSize"],
+            "page": template_variables["page"] if page is None else page,
+        },
+        "query": query,
+    }
+
+
+def persisted_extensions(query):
+    return {"persistedQuery": {"version": PERSISTED_QUERY_VERSION, "sha256Hash": hashlib.sha256(query.encode("utf-8")).hexdigest()}}
+
+
+def persisted_query_error(data):
+    """
+    The persisted-query error of a response, "PersistedQueryNotFound" or
+    "PersistedQueryNotSupported", or None.
+    """
+    for error in data.get("errors") or ():
+        for code in (error.get("message"), (error.get("extensions") or {}).get("code")):
+            if code in ("PersistedQueryNotFound", "PERSISTED_QUERY_NOT_FOUND"):
+                return "PersistedQueryNotFound"
+            if code in ("PersistedQueryNotSupported", "PERSISTED_QUERY_NOT_SUPPORTED"):
+                return "PersistedQueryNotSupported"
+    return None
+
+
+def post_json(url, payload, headers=None, decode=None, cached=True):
+    """
+    POST a GraphQL payload through the response cache. With persisted queries
+    on, only the hash of the query is sent; when the server does not know it,
+    the payload is sent again with the query text so the server can register
+    it, and when the server does not support it they are turned off.
+
+    :param url: The GraphQL endpoint.
+    :param payload: The GraphQL payload, with its query text.
+    :param headers: The request headers.
+    :param decode: Decodes the response body, see response_cache.post_json.
+    :param cached: Go through the response cache. (default: True)
+    :return: The decoded response.
+    :raises requests.exceptions.RequestException: If the request fails.
+    """
+    global _persisted
+    if not _persisted or "query" not in payload:
+        return response_cache.post_json(url, payload, headers=headers, decode=decode, cached=cached)
+
+    extensions = persisted_extensions(payload["query"])
+    hashed = {key: value for key, value in payload.items() if key != "query"}
+    hashed["extensions"] = extensions
+
+    try:
+        data = response_cache.post_json(url, hashed, headers=headers, decode=decode, cached=cached)
+        error = persisted_query_error(data)
+    except requests.exceptions.HTTPError:
+        error = "PersistedQueryNotSupported"
+
+    if error is None:
+        return data
+    if error == "PersistedQueryNotSupported":
+        print("The server does not support persisted queries, sending query texts")
+        with _lock:
+            _persisted = False
+        return response_cache.post_json(url, payload, headers=headers, decode=decode, cached=cached)
+    return response_cache.post_json(url, dict(payload, extensions=extensions), headers=headers, decode=decode, cached=cached)
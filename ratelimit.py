@@ -0,0 +1,208 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+import requests
+
+import metrics
+
+RATE = 4.0  # Requests per second allowed per host
+BURST = 4  # Number of requests that may be sent back to back
+MIN_RATE = 0.25  # The rate is never lowered below this after 429 responses
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0  # Seconds, doubled on every retry
+BACKOFF_CAP = 60.0  # Longest single wait between two attempts
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RetryError(requests.exceptions.RequestException):
+    """Raised when a request still fails after MAX_RETRIES retries."""
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket. Each request takes one token, tokens are
+    refilled at ``rate`` per second up to ``capacity``.
+
+    The rate is adaptive: it is halved whenever the server answers 429 and
+    grows back towards ``max_rate`` with every successful request.
+    """
+
+    def __init__(self, rate=RATE, capacity=BURST, min_rate=MIN_RATE):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """
+        Take one token, sleeping until it is available.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            wait = max(0.0, -self.tokens / self.rate, self.paused_until - now)
+
+        if wait:
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Stop handing out tokens for the given number of seconds.
+
+        :param seconds: How long to pause the bucket.
+        """
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def slow_down(self):
+        """
+        Halve the refill rate after the server signalled it is overloaded.
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def speed_up(self):
+        """
+        Grow the refill rate back towards its configured maximum.
+        """
+        with self.lock:
+            if self.rate < self.max_rate:
+                self._refill(time.monotonic())
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+class RateLimiter:
+    """
+    Keeps one TokenBucket per host, so every caller talking to ra.co shares
+    the same request budget.
+    """
+
+    def __init__(self, rate=RATE, burst=BURST):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, url):
+        """
+        Return the bucket for the host of the given url.
+
+        :param url: The url that is about to be requested.
+        :return: The TokenBucket for that host.
+        """
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.burst)
+            return self.buckets[host]
+
+
+limiter = RateLimiter()
+
+
+def configure(rate=RATE, burst=BURST):
+    """
+    Replace the shared limiter with one using the given rate and burst.
+
+    :param rate: Requests per second allowed per host.
+    :param burst: Number of requests that may be sent back to back.
+    """
+    global limiter
+    limiter = RateLimiter(rate, burst)
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header, given either in seconds or as an HTTP date.
+
+    :param value: The header value.
+    :return: The number of seconds to wait, or None if it cannot be parsed.
+    """
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt):
+    """
+    Exponential backoff with full jitter.
+
+    :param attempt: The number of the attempt that just failed, starting at 0.
+    :return: The number of seconds to wait before the next attempt.
+    """
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def request_with_retry(send, url, max_retries=MAX_RETRIES, **kwargs):
+    """
+    Send a request through the shared limiter, retrying connection errors,
+    429 and 5xx responses with backoff.
+
+    :param send: The function sending the request, e.g. requests.post.
+    :param url: The url to request.
+    :param max_retries: How many times a failed request is retried.
+    :param kwargs: Passed on to ``send``.
+    :return: The successful response.
+    :raises RetryError: If the request still fails after all retries.
+    """
+    bucket = limiter.bucket(url)
+
+    for attempt in range(max_retries + 1):
+        with metrics.timer("rate_limit_wait"):
+            bucket.acquire()
+
+        try:
+            response = send(url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as error:
+            if attempt == max_retries:
+                raise RetryError(f"{url} failed after {max_retries} retries: {error}") from error
+            print(f"Retrying {url} after error: {error}")
+            metrics.increment("retries")
+            bucket.pause(backoff_delay(attempt))
+            continue
+
+        if response.status_code not in RETRY_STATUSES:
+            bucket.speed_up()
+            return response
+
+        if attempt == max_retries:
+            raise RetryError(f"{url} failed after {max_retries} retries: {response.status_code}", response=response)
+
+        if response.status_code == 429:
+            bucket.slow_down()
+            metrics.increment("rate_limited")
+
+        delay = parse_retry_after(response.headers.get("Retry-After"))
+        if delay is None:
+            delay = backoff_delay(attempt)
+
+        print(f"Retrying {url} in {delay:.1f}s after status {response.status_code}")
+        metrics.increment("retries")
+        bucket.pause(delay)
@@ -0,0 +1,145 @@
+import json
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from response_cache import cache_key
+
+RECORDINGS_PATH = "recordings.jsonl"  # GraphQL request/response pairs, one per line
+LATENCY = 0.05  # Seconds the replay stub waits before answering
+ERROR_STATUS = 503  # Status of the errors injected by the replay stub
+
+
+def request_payload(request):
+    """
+    The JSON payload of a prepared request, or None if it has no JSON body.
+    """
+    if not request.body:
+        return None
+    try:
+        return json.loads(request.body)
+    except (TypeError, ValueError):
+        return None
+
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    A transport adapter that sends requests as usual and appends every
+    GraphQL request/response pair to a JSON Lines file:
+    {"request": {"url", "payload"}, "response": {"status", "headers", "body", "elapsed"}}
+    """
+
+    def __init__(self, path=RECORDINGS_PATH, **kwargs):
+        super().__init__(**kwargs)
+        self.file = open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        payload = request_payload(request)
+        if payload is not None:
+            record = {
+                "request": {"url": request.url, "payload": payload},
+                "response": {
+                    "status": response.status_code,
+                    "headers": {"Content-Type": response.headers.get("Content-Type", "application/json")},
+                    "body": response.content.decode("utf-8", errors="replace"),
+                    "elapsed": response.elapsed.total_seconds(),
+                },
+            }
+            with self.lock:
+                self.file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+                self.file.flush()
+        return response
+
+    def close(self):
+        super().close()
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+def variables_key(payload):
+    """
+    A key for a payload that ignores its query: a recording with more fields
+    than a request asks for still answers it.
+    """
+    return "variables:" + json.dumps([payload.get("operationName"), payload.get("variables")], sort_keys=True, default=str)
+
+
+def load_recordings(path=RECORDINGS_PATH):
+    """
+    Read recorded responses, keyed like the response cache and, for requests
+    selecting other fields than the recorded ones, by their variables alone.
+    A payload recorded twice keeps its last response.
+
+    :param path: The JSON Lines file written by RecordingAdapter.
+    :return: A dict of cache_key(payload) or variables_key(payload) -> recorded response.
+    """
+    recordings = {}
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                payload = record["request"]["payload"]
+                recordings[cache_key(payload)] = record["response"]
+                recordings[variables_key(payload)] = record["response"]
+    return recordings
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    A transport adapter answering GraphQL requests from recordings, without
+    touching the network. Every answer waits latency seconds (plus up to
+    jitter more), and a share error_rate of requests fail with ERROR_STATUS
+    and Retry-After: 0 to exercise the retries. Unrecorded payloads get a 404.
+    """
+
+    def __init__(self, recordings, latency=LATENCY, jitter=0.0, error_rate=0.0, seed=0):
+        super().__init__()
+        self.recordings = load_recordings(recordings) if isinstance(recordings, str) else recordings
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.misses = 0
+
+    def build_response(self, request, status, body, headers=None):
+        response = requests.Response()
+        response.status_code = status
+        response.reason = requests.status_codes._codes.get(status, ("",))[0].upper()
+        response.headers = CaseInsensitiveDict(headers or {"Content-Type": "application/json"})
+        response._content = body.encode("utf-8")
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def send(self, request, **kwargs):
+        with self.lock:
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            failed = self.random.random() < self.error_rate
+        time.sleep(delay)
+
+        if failed:
+            return self.build_response(request, ERROR_STATUS, '{"errors":[{"message":"injected error"}]}',
+                                       {"Content-Type": "application/json", "Retry-After": "0"})
+
+        payload = request_payload(request)
+        recorded = None
+        if payload is not None:
+            recorded = self.recordings.get(cache_key(payload)) or self.recordings.get(variables_key(payload))
+        if recorded is None:
+            with self.lock:
+                self.misses += 1
+            return self.build_response(request, 404, '{"errors":[{"message":"not recorded"}]}')
+
+        return self.build_response(request, recorded["status"], recorded["body"], recorded["headers"])
+
+    def close(self):
+        pass
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+import decoder
+import http_client
+import metrics
+
+CACHE_PATH = "ra_cache.sqlite3"
+MAX_SIZE = 512 * 1024 * 1024  # Bytes of compressed responses kept before evicting
+FUTURE_TTL = 60 * 60  # Seconds a response for listings that are not over yet stays fresh
+DEFAULT_TTL = 30 * 24 * 60 * 60  # Seconds for responses without a listingDate, e.g. area lookups
+NEVER = None
+
+
+def query_hash(payload):
+    """The sha256 hex digest of the query of a payload, or its persisted-query hash."""
+    if "query" not in payload:
+        persisted = (payload.get("extensions") or {}).get("persistedQuery") or {}
+        if persisted.get("sha256Hash"):
+            return persisted["sha256Hash"]
+    return hashlib.sha256(payload.get("query", "").encode("utf-8")).hexdigest()
+
+
+def cache_key(payload):
+    """
+    A content address for a GraphQL payload. The payload is normalized by
+    serializing operationName, variables (which include the page) and a hash
+    of the query with sorted keys. A persisted-query payload carries that hash
+    instead of the query, so both forms share one entry.
+
+    :param payload: The GraphQL payload.
+    :return: A hex sha256 digest.
+    """
+    normalized = {
+        "operationName": payload.get("operationName"),
+        "variables": payload.get("variables"),
+        "query": query_hash(payload),
+    }
+    encoded = json.dumps(normalized, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def listing_dates(variables):
+    """
+    Yield every listingDate upper bound found in the variables, including the
+    numbered filters of batched queries.
+    """
+    for name, value in variables.items():
+        if name.startswith("filters") and isinstance(value, dict):
+            listing_date = value.get("listingDate") or {}
+            yield listing_date.get("lte")
+
+
+def ttl_for(payload):
+    """
+    Pick the time to live for a response. Listings that ended before today
+    can no longer change and never expire, anything reaching today or later
+    expires after FUTURE_TTL.
+
+    :param payload: The GraphQL payload.
+    :return: The TTL in seconds, or NEVER.
+    """
+    upper_bounds = list(listing_dates(payload.get("variables") or {}))
+    if not upper_bounds:
+        return DEFAULT_TTL
+
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    if all(lte and lte[:10] < today for lte in upper_bounds):
+        return NEVER
+    return FUTURE_TTL
+
+
+class ResponseCache:
+    """
+    A size-bounded, least recently used cache of GraphQL response bodies,
+    stored zlib-compressed in SQLite.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_size=MAX_SIZE):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            body BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            expires REAL,
+            accessed REAL NOT NULL)""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.conn.commit()
+
+    def get(self, payload):
+        """
+        Look up the response for a payload.
+
+        :param payload: The GraphQL payload.
+        :return: The response body as bytes, or None if it is missing or expired.
+        """
+        key = cache_key(payload)
+        now = time.time()
+
+        with self.lock:
+            row = self.conn.execute("SELECT body, expires FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] is not None and row[1] < now:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.conn.commit()
+                return None
+            self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+
+        return zlib.decompress(row[0])
+
+    def set(self, payload, content, ttl=None):
+        """
+        Store the response for a payload and evict old entries if needed.
+
+        :param payload: The GraphQL payload.
+        :param content: The response body, stored as received.
+        :param ttl: Seconds until the entry expires. (default: chosen by ttl_for)
+        """
+        if ttl is None:
+            ttl = ttl_for(payload)
+
+        now = time.time()
+        body = zlib.compress(content)
+        expires = None if ttl is NEVER else now + ttl
+
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, body, size, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                (cache_key(payload), body, len(body), expires, now),
+            )
+            self.evict(now)
+            self.conn.commit()
+
+    def evict(self, now):
+        """
+        Drop expired entries, then the least recently used ones until the
+        cache is under max_size. Must be called with the lock held.
+        """
+        self.conn.execute("DELETE FROM responses WHERE expires IS NOT NULL AND expires < ?", (now,))
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_size:
+            return
+
+        victims = []
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            if total <= self.max_size:
+                break
+            victims.append((key,))
+            total -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_cache = None
+_enabled = True
+_lock = threading.Lock()
+
+
+def configure(path=CACHE_PATH, max_size=MAX_SIZE, enabled=True):
+    """
+    Set up the shared cache.
+
+    :param path: The SQLite file holding the cache.
+    :param max_size: Bytes of compressed responses kept before evicting.
+    :param enabled: Turn the cache off entirely when False.
+    """
+    global _cache, _enabled
+    with _lock:
+        if _cache is not None:
+            _cache.close()
+        _cache = ResponseCache(path, max_size) if enabled else None
+        _enabled = enabled
+
+
+def get_cache():
+    """
+    Return the shared cache, opening it on first use, or None when disabled.
+    """
+    global _cache
+    with _lock:
+        if _cache is None and _enabled:
+            _cache = ResponseCache()
+        return _cache
+
+
+def post_json(url, payload, headers=None, ttl=None, decode=None, refresh=False, cached=True, send=None):
+    """
+    POST a GraphQL payload, answering from the cache when possible. Only
+    responses carrying data are cached, so errors are always retried.
+
+    :param url: The GraphQL endpoint.
+    :param payload: The GraphQL payload.
+    :param headers: The request headers.
+    :param ttl: Seconds until the cached entry expires. (default: chosen by ttl_for)
+    :param decode: Decodes the response body, e.g. decoder.decode_listings. (default: decoder.loads)
+    :param refresh: Skip the cached response and fetch it again; the new one replaces it. (default: False)
+    :param cached: Look the response up in the cache and store it there. (default: True)
+    :param send: Returns the response body for a payload, e.g. batch_query.PageBatcher.send. (default: POST it to url)
+    :return: The decoded response.
+    :raises requests.exceptions.RequestException: If the request fails.
+    """
+    decode = decode or decoder.loads
+    cache = get_cache() if cached else None
+    if cache is not None and not refresh:
+        with metrics.timer("cache_lookup"):
+            content = cache.get(payload)
+        if content is not None:
+            metrics.increment("cache_hits")
+            with metrics.timer("json_decode"):
+                return decode(content)
+        metrics.increment("cache_misses")
+
+    if send is None:
+        response = http_client.post(url, headers=headers, json=payload)
+        response.raise_for_status()
+        content = response.content
+    else:
+        content = send(payload)
+    with metrics.timer("json_decode"):
+        data = decode(content)
+
+    if cache is not None and data.get("data") and not data.get("errors"):
+        cache.set(payload, content, ttl)
+
+    return data
@@ -0,0 +1,177 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from event_fetcher import CONCURRENCY, MAX_SHARD_RESULTS, QUEUE_SIZE, EventFetcher
+from pipeline import produce
+
+DATE_FORMAT = "%Y-%m-%d"
+
+
+def listing_window(start_date, end_date):
+    """
+    The listingDate bounds covering whole days from start_date to end_date.
+
+    :param start_date: The first day of the window (date).
+    :param end_date: The last day of the window (date, inclusive).
+    :return: A (listing_date_gte, listing_date_lte) tuple.
+    """
+    return (
+        start_date.strftime("%Y-%m-%dT00:00:00.000Z"),
+        end_date.strftime("%Y-%m-%dT23:59:59.999Z"),
+    )
+
+
+def split_range(start_date, end_date, parts):
+    """
+    Split [start_date, end_date] into at most ``parts`` non-overlapping,
+    contiguous day ranges of (nearly) equal length.
+
+    :param start_date: The first day (date).
+    :param end_date: The last day (date, inclusive).
+    :param parts: The number of ranges wanted.
+    :return: A list of (start_date, end_date) tuples covering every day exactly once.
+    """
+    days = (end_date - start_date).days + 1
+    parts = max(1, min(parts, days))
+
+    ranges = []
+    first_day = 0
+    for part in range(1, parts + 1):
+        last_day = days * part // parts - 1
+        ranges.append((start_date + timedelta(days=first_day), start_date + timedelta(days=last_day)))
+        first_day = last_day + 1
+    return ranges
+
+
+def merge_events(shards):
+    """
+    Merge the events of several shards, dropping events seen before.
+
+    :param shards: An iterable of event lists.
+    :return: One list of events, unique by event id, in shard order.
+    """
+    seen = set()
+    merged = []
+    for events in shards:
+        for event in events:
+            event_id = event.get("event", {}).get("id") or event.get("id")
+            if event_id in seen:
+                continue
+            seen.add(event_id)
+            merged.append(event)
+    return merged
+
+
+class ShardPlanner:
+    """
+    A class to split a long date range into non-overlapping shards, sized
+    from totalResults, and fetch them in parallel.
+    """
+
+    def __init__(self, areas, start_date, end_date, max_results=MAX_SHARD_RESULTS, concurrency=CONCURRENCY):
+        self.areas = areas
+        self.start_date = datetime.strptime(start_date, DATE_FORMAT).date()
+        self.end_date = datetime.strptime(end_date, DATE_FORMAT).date()
+        self.max_results = max_results
+        self.concurrency = concurrency
+
+    def fetcher(self, start_date, end_date):
+        """
+        An EventFetcher for the given day range.
+        """
+        return EventFetcher(self.areas, *listing_window(start_date, end_date), concurrency=self.concurrency)
+
+    def probe(self, date_range):
+        """
+        Fetch the first page of a day range.
+
+        :param date_range: A (start_date, end_date) tuple.
+        :return: The eventListings of page 1.
+        :raises requests.exceptions.RequestException: If the page cannot be fetched, so a
+            failed probe fails the plan instead of leaving an empty shard.
+        """
+        return self.fetcher(*date_range).get_listings(1)
+
+    def plan(self):
+        """
+        Split the date range into shards with at most ``max_results`` events
+        each. A range is probed by fetching its first page, then split into
+        ceil(totalResults / max_results) parts; parts that are still too big
+        are split again. Single days are never split.
+
+        :return: A list of (start_date, end_date, first_page) tuples, first_page
+            being the already fetched eventListings of page 1.
+        """
+        shards = []
+        pending = [(self.start_date, self.end_date)]
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while pending:
+                first_pages = executor.map(self.probe, pending)
+                ranges, pending = pending, []
+
+                for (start_date, end_date), first_page in zip(ranges, first_pages):
+                    total_results = first_page.get("totalResults")
+
+                    if (total_results or 0) <= self.max_results or start_date == end_date:
+                        shards.append((start_date, end_date, first_page))
+                    else:
+                        parts = math.ceil(total_results / self.max_results)
+                        pending.extend(split_range(start_date, end_date, parts))
+
+        shards.sort(key=lambda shard: shard[0])
+        return shards
+
+    def fetch_shard(self, shard):
+        """
+        Fetch every event of one shard.
+
+        :param shard: A (start_date, end_date, first_page) tuple from plan().
+        :return: A list of events.
+        """
+        start_date, end_date, first_page = shard
+        return self.fetcher(start_date, end_date).fetch_all_events(self.concurrency > 1, first_page)
+
+    def fetch_all_events(self):
+        """
+        Plan the shards, fetch them in parallel and merge the results.
+
+        :return: A list of all events in the date range, unique by event id, in date order.
+        """
+        shards = self.plan()
+        print(f"Fetching {len(shards)} shard(s) between {self.start_date} and {self.end_date}")
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return merge_events(executor.map(self.fetch_shard, shards))
+
+    def page_sources(self, shard):
+        """
+        One page source per page of a shard, for pipeline.produce: the first
+        page, already fetched by plan(), and a fetch of every other page, so
+        the pages of a shard are fetched concurrently too.
+
+        :param shard: A (start_date, end_date, first_page) tuple from plan().
+        :return: A list of callables, each returning an iterator of event lists.
+        """
+        start_date, end_date, first_page = shard
+        fetcher = self.fetcher(start_date, end_date)
+        sources = [lambda: iter([first_page.get("data") or []])]
+        for page_number in range(2, fetcher.page_count(first_page.get("totalResults")) + 1):
+            sources.append(lambda page_number=page_number: iter([fetcher.get_events(page_number)]))
+        return sources
+
+    def iter_pages(self, queue_size=QUEUE_SIZE):
+        """
+        Plan the shards and stream their pages as they arrive, fetching up to
+        ``concurrency`` pages at once, from one shard or several. Pages are
+        not de-duplicated, see pipeline.unique_events.
+
+        :param queue_size: The number of pages buffered before fetching pauses.
+        :return: A generator of event lists, in arrival order.
+        """
+        shards = self.plan()
+        print(f"Streaming {len(shards)} shard(s) between {self.start_date} and {self.end_date}")
+
+        sources = [source for shard in shards for source in self.page_sources(shard)]
+        yield from produce(sources, self.concurrency, queue_size)
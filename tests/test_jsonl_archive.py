@@ -0,0 +1,123 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from jsonl_archive import INDEX_SUFFIX, KEYS_SUFFIX, ArchiveReader, ArchiveWriter, read_index
+from models import parse_events
+from pipeline import JsonLinesSink
+
+
+def listing(number):
+    return {"id": f"l{number}", "event": {"id": str(number), "title": f"Event {number}"}}
+
+
+def lines(records):
+    return b"".join(json.dumps(record).encode("utf-8") + b"\n" for record in records)
+
+
+class ResumeWithoutIndexTest(unittest.TestCase):
+    """
+    Archives without an index, e.g. written before the index existed or whose
+    index was lost, are appended to without losing their records.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def resume(self, path, numbers):
+        sink = JsonLinesSink(path)
+        sink.write(parse_events([listing(number) for number in numbers], keep_raw=True))
+        sink.close()
+        return [record["event"]["id"] for record in ArchiveReader(path)]
+
+    def test_plain_archive(self):
+        path = self.path("old.jsonl")
+        with open(path, "wb") as file:
+            file.write(lines([listing(number) for number in range(3)]))
+
+        self.assertEqual(self.resume(path, [2, 3]), ["0", "1", "2", "3"])
+        self.assertEqual(len(ArchiveReader(path)), 4)
+
+    def test_gzip_archive(self):
+        path = self.path("old.jsonl.gz")
+        with gzip.open(path, "wb") as file:
+            file.write(lines([listing(number) for number in range(3)]))
+
+        self.assertEqual(self.resume(path, [1, 5]), ["0", "1", "2", "5"])
+
+    def test_lost_index(self):
+        path = self.path("events.jsonl.gz")
+        self.resume(path, range(3))
+        os.remove(path + INDEX_SUFFIX)
+
+        self.assertEqual(self.resume(path, [3]), ["0", "1", "2", "3"])
+
+    def test_torn_line_is_cut(self):
+        path = self.path("torn.jsonl")
+        with open(path, "wb") as file:
+            file.write(lines([listing(0), listing(1)]) + b'{"id": "l2", "ev')
+
+        self.assertEqual(self.resume(path, [2]), ["0", "1", "2"])
+
+    def test_torn_frame_is_cut(self):
+        path = self.path("torn.jsonl.gz")
+        self.resume(path, range(2))
+        with open(path, "ab") as file:
+            file.write(gzip.compress(lines([listing(2)]))[:-6])
+
+        self.assertEqual(self.resume(path, [2]), ["0", "1", "2"])
+
+    def test_unindexed_frame_is_kept(self):
+        path = self.path("crash.jsonl.gz")
+        self.resume(path, range(2))
+        frames = read_index(path)
+        with open(path, "ab") as file:
+            file.write(gzip.compress(lines([listing(2)])))
+
+        writer = ArchiveWriter(path)
+        writer.close()
+        self.assertEqual(len(read_index(path)), len(frames) + 1)
+        self.assertEqual([record["event"]["id"] for record in ArchiveReader(path)], ["0", "1", "2"])
+
+
+class ResumeKeysTest(unittest.TestCase):
+    """
+    Resuming takes the ids of the archived events from the .ids sidecar.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "events.jsonl.gz")
+        sink = JsonLinesSink(self.path)
+        sink.write(parse_events([listing(number) for number in range(3)], keep_raw=True))
+        sink.close()
+
+    def test_resume_does_not_read_the_archive(self):
+        with mock.patch.object(ArchiveReader, "read", side_effect=AssertionError("archive read")):
+            sink = JsonLinesSink(self.path)
+        self.assertEqual(sink.seen, {"0", "1", "2"})
+        sink.close()
+
+    def test_missing_keys_are_read_from_the_archive(self):
+        with open(self.path + KEYS_SUFFIX, "r", encoding="utf-8") as file:
+            keys = file.readlines()
+        with open(self.path + KEYS_SUFFIX, "w", encoding="utf-8") as file:
+            file.writelines(keys[:1] + ['"1'])
+
+        sink = JsonLinesSink(self.path)
+        self.assertEqual(sink.seen, {"0", "1", "2"})
+        sink.close()
+        with open(self.path + KEYS_SUFFIX, "r", encoding="utf-8") as file:
+            self.assertEqual(len(file.readlines()), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,28 @@
+import argparse
 import re
+import threading
 from configparser import ConfigParser
+from contextlib import contextmanager
 
 import psycopg2
+from psycopg2.extensions import STATUS_READY
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+import metrics
+from name_normalizer import clean_name
+
+BATCH_SIZE = 1000  # Rows sent to postgres per INSERT statement by bulk_insert
+MIN_CONNECTIONS = 1
+MAX_CONNECTIONS = 8  # Upper bound of connections held by the pool, i.e. of parallel writers
+
+_connection_params = None
+_pool = None
+_pool_lock = threading.Lock()
+_max_connections = MAX_CONNECTIONS
+_slots = threading.BoundedSemaphore(MAX_CONNECTIONS)  # Makes borrowers wait for a free connection
+_created = set()  # Schema statements already run by ensure_tables
+_schema_lock = threading.Lock()
 
 
 def config(filename='database.ini', section='postgresql'):
@@ -23,175 +44,196 @@ def config(filename='database.ini', section='postgresql'):
     return db
 
 
-def commit_to_dataBase(query):
-    """ Connect to the PostgreSQL database server """
-    conn = None
-
-    try:
-        # read connection parameters
-        params = config()
-        # connect to the PostgreSQL server
-        print('Connecting to the PostgreSQL database...')
-        conn = psycopg2.connect(**params)
-        # create a cursor
-        cur = conn.cursor()
-        # execute a statement
-        cur.execute(query)
-        conn.commit()
-        cur.close()
+def connection_params():
+    """database.ini is read once per process, every later call reuses the parsed parameters"""
+    global _connection_params
+    if _connection_params is None:
+        _connection_params = config()
+    return _connection_params
+
+
+def get_pool():
+    """Lazily builds the connection pool shared by every database helper"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadedConnectionPool(MIN_CONNECTIONS, _max_connections, **connection_params())
+        return _pool
+
+
+def configure_pool(max_connections=MAX_CONNECTIONS):
+    """Sets the number of connections the pool may hold, e.g. one per parallel writer; call before the first query"""
+    global _max_connections, _slots
+    close_pool()
+    with _pool_lock:
+        _max_connections = max(MIN_CONNECTIONS, max_connections)
+        _slots = threading.BoundedSemaphore(_max_connections)
+
+
+def close_pool():
+    """Closes every pooled connection, e.g. at the end of a run"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+@contextmanager
+def connection():
+    """Borrows a connection from the pool, waiting while all of them are in use, and always hands it back"""
+    slots = _slots
+    with slots:
+        pool = get_pool()
+        conn = pool.getconn()
+        try:
+            yield conn
+        finally:
+            if not conn.closed and conn.status != STATUS_READY:
+                conn.rollback()
+            pool.putconn(conn)
+
+
+@contextmanager
+def transaction():
+    """Yields a cursor inside a transaction: committed if the block succeeds, rolled back if it raises"""
+    with connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                yield cur
+
+
+@contextmanager
+def cursor():
+    """Yields a cursor for read-only queries, nothing is committed"""
+    with connection() as conn:
+        with conn.cursor() as cur:
+            yield cur
+        conn.rollback()
 
 
+def commit_to_dataBase(query):
+    """ Execute a statement on the PostgreSQL database server and commit it """
+    try:
+        with transaction() as cur:
+            cur.execute(query)
 
     except (Exception, psycopg2.DatabaseError) as error:
         print(error)
-        # close the communication with the PostgreSQL
-
-
-    finally:
-        if conn is not None:
-            conn.close()
-            print('Database connection closed.')
 
 
 def commit_to_dataBase2(query):
-    """ Connect to the PostgreSQL database server """
-    conn = None
-
+    """ Execute a statement on the PostgreSQL database server and commit it """
     try:
-        # read connection parameters
-        params = config()
-        # connect to the PostgreSQL server
-        print('Connecting to the PostgreSQL database...')
-        conn = psycopg2.connect(**params)
-        # create a cursor
-        cur = conn.cursor()
-        # execute a statement
-        cur.execute(query)
-        conn.commit()
-        cur.close()
+        with transaction() as cur:
+            cur.execute(query)
 
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(error)
+
+
+def ensure_tables(*queries):
+    """Runs CREATE ... IF NOT EXISTS statements once per process, before the first write that needs them"""
+    with _schema_lock:
+        missing = [query for query in queries if query not in _created]
+        if not missing:
+            return
+        with transaction() as cur:
+            for query in missing:
+                cur.execute(query)
+        _created.update(missing)
 
 
+def _insert_rows(query, rows, template, batch_size):
+    """Stores rows in one transaction; when a row is rejected, stores the two halves separately
+    to find it. Returns the number of rows stored and the errors of the rows left out."""
+    try:
+        with metrics.timer('db_write'), transaction() as cur:
+            execute_values(cur, query, rows, template=template, page_size=batch_size)
+        return len(rows), []
+
+    except (psycopg2.DataError, psycopg2.IntegrityError) as error:
+        # A value that does not fit its column, a missing reference...: only the rows at fault are lost
+        if len(rows) == 1:
+            return 0, [error]
+        middle = len(rows) // 2
+        stored, errors = _insert_rows(query, rows[:middle], template, batch_size)
+        more_stored, more_errors = _insert_rows(query, rows[middle:], template, batch_size)
+        return stored + more_stored, errors + more_errors
+
+
+def insert_rows(query, rows, template=None, batch_size=BATCH_SIZE):
+    """Insert many rows in one transaction, batch_size rows per statement.
+
+    query must contain a single VALUES %s placeholder, see psycopg2.extras.execute_values.
+    When postgres rejects some rows (e.g. a value too long for its column), the batch is
+    split until those rows are found: they are dropped and logged, every other row is
+    stored. Any other error (connection, syntax...) stores none of them and is raised.
+    Returns (rows stored, rows dropped)."""
+    rows = list(rows)
+    if not rows:
+        return 0, 0
+
+    stored, errors = _insert_rows(query, rows, template, batch_size)
+    if errors:
+        metrics.increment('rows_dropped', len(errors))
+        print(f'Dropped {len(errors)} rows postgres rejected, e.g.: {str(errors[0]).strip()}')
+    if stored:
+        metrics.increment('rows_written', stored)
+        print(f'Inserted {stored} rows.')
+    return stored, len(errors)
+
+
+def bulk_insert(query, rows, template=None, batch_size=BATCH_SIZE):
+    """Like insert_rows, but errors are printed. Returns the number of rows stored."""
+    try:
+        return insert_rows(query, rows, template, batch_size)[0]
     except (Exception, psycopg2.DatabaseError) as error:
         print(error)
-        # close the communication with the PostgreSQL
+        return 0
 
 
-    finally:
-        if conn is not None:
-            conn.close()
-            print('Database connection closed.')
+def fit(value, width, cut=True):
+    """Makes a text fit a VARCHAR(width) column: cut to width, or with cut=False
+    (e.g. for a URL, useless once cut) replaced by None when too long"""
+    if not isinstance(value, str) or len(value) <= width:
+        return value
+    return value[:width] if cut else None
 
 
 def call_club_data(query):
-    """ Connect to the PostgreSQL database server """
-    conn = None
-
+    """ Execute a query on the PostgreSQL database server without committing """
     try:
-        # read connection parameters
-        params = config()
-        # connect to the PostgreSQL server
-        print('Connecting to the PostgreSQL database...')
-        conn = psycopg2.connect(**params)
-        # create a cursor
-        cur = conn.cursor()
-        # execute a statement
-        cur.execute(query)
-        #conn.commit()
-        cur.close()
-
-
+        with cursor() as cur:
+            cur.execute(query)
 
     except (Exception, psycopg2.DatabaseError) as error:
         print(error)
-        # close the communication with the PostgreSQL
-
-
-    finally:
-        if conn is not None:
-            conn.close()
-            print('Database connection closed.')
 
 
 def extract_from_dataBase(query):
-    """ Connect to the PostgreSQL database server to allow for artist names to be inputed to
+    """ Query the PostgreSQL database server to allow for artist names to be inputed to
     spotify api search"""
-    conn = None
+    artdict = {}
 
     try:
-        # read connection parameters
-        params = config()
-        # connect to the PostgreSQL server
-        print('Connecting to the PostgreSQL database...')
-        conn = psycopg2.connect(**params)
-        # create a cursor
-        cur = conn.cursor()
-        # execute a statement
-        cur.execute(query)
-        result = cur.fetchall()
-        artdict = {}
+        with cursor() as cur:
+            cur.execute(query)
+            result = cur.fetchall()
 
         for i in result:
             x = i[1].split(',')
             artdict[i[0]] = x
 
-        conn.commit()
-        cur.close()
-
-
-
     except (Exception, psycopg2.DatabaseError) as error:
         print(error)
-        # close the communication with the PostgreSQL
-
 
-    finally:
-        if conn is not None:
-            conn.close()
-            print('Database connection closed.')
     return artdict
 
 
 def name_cleaner(name):
-    """Cleans unwanted words and icons from names scraped"""
-    
-    if pd.notnull(name):
-        name = re.sub('\\n', ',', name)
-        name = re.sub(r'\broom|ROOM\b', 'room:,', name)
-        name = re.sub('(\\xa0)', '', name)
-        name = re.sub(r'\bTBA|tba\b', '', name)
-        name = re.sub('(noch nicht fetsgelegt)', '', name)
-        name = re.sub(r'\b(Friends|friends)\b', '', name)
-        name = re.sub(r'\b(opening|Opening|OPENING)\b', '', name)
-        name = re.sub(r'\b(closing|Closing|CLOSING)\b', '', name)
-        name = re.sub(r'\bResidents|residents\b', '', name)
-        name = re.sub(r'\bResident|resident\b', '', name)
-        name = re.sub(r'\b(\d\d\s\-\d\d)\b', '', name)
-        name = re.sub(r'\b(\d\d\-\d\d)\b', '', name)
-        name = re.sub(r'\b(\d\d\-\s\d\d)\b', '', name)
-        name = re.sub(r'(\_{2}[a-zA-Z]*\_{2})', '', name)
-        name = re.sub(r'\blive|LIVE|Live\b', ',', name)
-        name = re.sub(r"\(.*?\)", ',', name)
-        name = re.sub(r'\&', ',', name)
-        name = re.sub(r'\[.*?\]', '', name)
-        name = re.sub(r'[\s\w]+\:', '', name)
-        name = re.sub(r'\/{2}', ',', name)
-        name = re.sub(r'\,{2}', ',', name)
-        name = re.sub(r'\,{2}', ',', name)
-        name = re.sub(r'\'{2},', '', name)
-        name = re.sub(r'^,', '', name)
-        name = re.sub(r'^\s', '', name)
-        name = re.sub(r'\s$', '', name)
-        name = re.sub(r'\b\d{2}\b', '', name)
-        name = re.sub(r'\bb2b|B2B\b', ',', name)
-        name = re.sub(r'w\/', ',', name)
-        name = re.sub(r'\+', ',', name)
-        name = re.sub(r'\&', ',', name)  # & symbol, replace with ','
-        name = re.sub(r'[,\s]*$', '', name)  # white space & comma from end of string
-        name = re.sub(r'^@', '', name)  # @ from the beginning of str
-        djList = name.split(',')
-        return name
-    return ''
+    """Cleans unwanted words and icons from names scraped, see name_normalizer.normalize_name"""
+    return clean_name(name)
 
 def clean_names(names):
     cleaned_names = []
@@ -272,19 +314,117 @@ event_genres TEXT[]
 );
 """
 
-merge_genre_query = """UPDATE event_data
-    SET event_genres = subquery2.event_genres
-    FROM (
-      SELECT event_name, array_agg(genre) AS event_genres
-      FROM (
-        SELECT event_name, unnest(unique_genres) AS genre
-        FROM (
-          SELECT event_name, array_agg(distinct genre) AS unique_genres
-          FROM event_data, unnest(event_genres) AS genre
-          GROUP BY event_name, genre
-        ) AS subquery
-        GROUP BY event_name, unique_genres
-      ) AS subquery2
-      GROUP BY event_name
-    ) AS subquery2
-    WHERE event_data.event_name = subquery2.event_name;"""
+# RA artist id of each row, filled in by save_artists_to_postgres through the artist index
+add_artists_ra_id_column = """ALTER TABLE artists ADD COLUMN IF NOT EXISTS ra_artist_id VARCHAR(20);
+CREATE INDEX IF NOT EXISTS artists_ra_artist_id ON artists (ra_artist_id);
+"""
+
+create_genres_table = """CREATE TABLE IF NOT EXISTS genres (
+genre_slug VARCHAR(100) PRIMARY KEY,
+genre_name VARCHAR(100) NOT NULL
+);
+"""
+
+# Keys event_data by RA event id instead of event_name, so distinct events sharing a name
+# are all kept, and adds the content hash the loader compares before rewriting a row.
+# Rows stored before have no RA id and are left as they are. Links keyed by event_name
+# cannot be carried over and are dropped; they are written again with the events.
+# Destructive, so only run by `python utils.py migrate`, see migrate.
+migrate_event_data_key = """ALTER TABLE event_data ADD COLUMN IF NOT EXISTS ra_event_id VARCHAR(20);
+ALTER TABLE event_data ADD COLUMN IF NOT EXISTS content_hash BIGINT;
+CREATE UNIQUE INDEX IF NOT EXISTS event_data_ra_event_id ON event_data (ra_event_id);
+ALTER TABLE event_data DROP CONSTRAINT IF EXISTS event_data_pkey CASCADE;
+CREATE INDEX IF NOT EXISTS event_data_event_name ON event_data (event_name);
+DO $$ BEGIN
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_name = 'event_genres' AND column_name = 'event_name') THEN
+        DROP TABLE event_genres;
+    END IF;
+END $$;
+"""
+
+# Run by ensure_tables before writing events: fails on a schema migrate_event_data_key was not run on
+check_event_data_key = """DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_indexes
+                   WHERE schemaname = current_schema() AND indexname = 'event_data_ra_event_id')
+       OR NOT EXISTS (SELECT 1 FROM information_schema.columns
+                      WHERE table_schema = current_schema() AND table_name = 'event_data'
+                      AND column_name = 'content_hash')
+       OR EXISTS (SELECT 1 FROM information_schema.columns
+                  WHERE table_schema = current_schema() AND table_name = 'event_genres'
+                  AND column_name = 'event_name')
+       OR EXISTS (SELECT 1 FROM pg_constraint
+                  WHERE conrelid = to_regclass('event_data') AND contype = 'p') THEN
+        RAISE EXCEPTION 'event_data is missing or still keyed by event_name, run "python utils.py migrate" first';
+    END IF;
+END $$;
+"""
+
+create_event_genres_table = """CREATE TABLE IF NOT EXISTS event_genres (
+ra_event_id VARCHAR(20) NOT NULL REFERENCES event_data (ra_event_id) ON DELETE CASCADE,
+genre_slug VARCHAR(100) NOT NULL REFERENCES genres (genre_slug),
+PRIMARY KEY (ra_event_id, genre_slug)
+);
+CREATE INDEX IF NOT EXISTS event_genres_genre_slug ON event_genres (genre_slug, ra_event_id);
+"""
+
+
+def migration_plan():
+    """Lists what migrate_event_data_key drops on this database, empty when it drops nothing"""
+    plan = []
+    with cursor() as cur:
+        cur.execute("SELECT to_regclass('event_data') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            raise Exception('event_data does not exist')
+        cur.execute("""SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+                       WHERE conrelid = 'event_data'::regclass AND contype = 'p'""")
+        for name, definition in cur.fetchall():
+            plan.append(f'the constraint {name} of event_data: {definition}')
+        # The foreign keys using that primary key go with it (CASCADE)
+        cur.execute("""SELECT conname, conrelid::regclass::text FROM pg_constraint
+                       WHERE contype = 'f' AND conindid IN (
+                           SELECT conindid FROM pg_constraint WHERE conrelid = 'event_data'::regclass AND contype = 'p')""")
+        for name, table in cur.fetchall():
+            plan.append(f'the foreign key {name} of {table}')
+        cur.execute("""SELECT 1 FROM information_schema.columns
+                       WHERE table_schema = current_schema() AND table_name = 'event_genres' AND column_name = 'event_name'""")
+        if cur.fetchone():
+            cur.execute("SELECT COUNT(*) FROM event_genres")
+            plan.append(f'the table event_genres and its {cur.fetchone()[0]} links keyed by event_name')
+    return plan
+
+
+def migrate(apply=False):
+    """Prints what migrate_event_data_key drops, and runs it when apply is set"""
+    plan = migration_plan()
+    for item in plan:
+        print(f'Drops {item}')
+    if not plan:
+        print('Nothing to drop.')
+    if not apply:
+        print('Nothing was changed, run again with --yes to migrate.')
+        return
+    with transaction() as cur:
+        cur.execute(migrate_event_data_key)
+    print('event_data is keyed by ra_event_id.')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain the postgres schema.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = commands.add_parser('migrate', help='Key event_data by RA event id instead of event_name.')
+    migrate_parser.add_argument('--yes', action='store_true', help='Run the migration, instead of only printing what it drops.')
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'migrate':
+            migrate(args.yes)
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(error)
+        raise SystemExit(1)
+    finally:
+        close_pool()
+
+
+if __name__ == '__main__':
+    main()